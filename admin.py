@@ -1,272 +1,377 @@
-from aiogram import Dispatcher, types, Bot
-from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.context import FSMContext
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-import sqlite3
-import logging
-
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-class AdminStates(StatesGroup):
-    edit_welcome = State()
-    edit_info = State()
-    edit_rules = State()
-    block_user = State()
-    set_delay = State()
-
-def get_admin_menu():
-    buttons = [
-        [KeyboardButton(text="Редактировать приветствие"), KeyboardButton(text="Редактировать информацию")],
-        [KeyboardButton(text="Редактировать правила"), KeyboardButton(text="Блокировать пользователя")],
-        [KeyboardButton(text="Список заблокированных"), KeyboardButton(text="Модерация постов")],
-        [KeyboardButton(text="Настройки модерации"), KeyboardButton(text="Задержка постов")],
-        [KeyboardButton(text="Удалить пост"), KeyboardButton(text="Назад")]
-    ]
-    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
-
-def setup_handlers(dp: Dispatcher, conn: sqlite3.Connection, bot: Bot):
-    @dp.message(lambda message: message.text == "Админка")
-    async def admin_menu(message: types.Message):
-        c = conn.cursor()
-        c.execute("SELECT is_admin FROM users WHERE user_id = ?", (message.from_user.id,))
-        result = c.fetchone()
-        if not result or not result[0]:
-            await message.answer("У вас нет доступа к админке!")
-            return
-        await message.answer("Панель администратора", reply_markup=get_admin_menu())
-
-    @dp.message(lambda message: message.text == "Редактировать приветствие")
-    async def edit_welcome(message: types.Message, state: FSMContext):
-        await message.answer("Введите новое приветственное сообщение:")
-        await state.set_state(AdminStates.edit_welcome)
-
-    @dp.message(AdminStates.edit_welcome)
-    async def process_welcome(message: types.Message, state: FSMContext):
-        c = conn.cursor()
-        c.execute("UPDATE settings SET value = ? WHERE key = 'welcome_message'", (message.text,))
-        conn.commit()
-        await message.answer("Приветствие обновлено!", reply_markup=get_admin_menu())
-        await state.clear()
-
-    @dp.message(lambda message: message.text == "Редактировать информацию")
-    async def edit_info(message: types.Message, state: FSMContext):
-        await message.answer("Введите новый текст информации:")
-        await state.set_state(AdminStates.edit_info)
-
-    @dp.message(AdminStates.edit_info)
-    async def process_info(message: types.Message, state: FSMContext):
-        c = conn.cursor()
-        c.execute("UPDATE settings SET value = ? WHERE key = 'info'", (message.text,))
-        conn.commit()
-        await message.answer("Информация обновлена!", reply_markup=get_admin_menu())
-        await state.clear()
-
-    @dp.message(lambda message: message.text == "Редактировать правила")
-    async def edit_rules(message: types.Message, state: FSMContext):
-        await message.answer("Введите новый текст правил:")
-        await state.set_state(AdminStates.edit_rules)
-
-    @dp.message(AdminStates.edit_rules)
-    async def process_rules(message: types.Message, state: FSMContext):
-        c = conn.cursor()
-        c.execute("UPDATE settings SET value = ? WHERE key = 'rules'", (message.text,))
-        conn.commit()
-        await message.answer("Правила обновлены!", reply_markup=get_admin_menu())
-        await state.clear()
-
-    @dp.message(lambda message: message.text == "Блокировать пользователя")
-    async def block_user(message: types.Message, state: FSMContext):
-        await message.answer("Введите ник пользователя (с @):")
-        await state.set_state(AdminStates.block_user)
-
-    @dp.message(AdminStates.block_user)
-    async def process_block(message: types.Message, state: FSMContext):
-        username = message.text.lstrip("@")
-        c = conn.cursor()
-        c.execute("UPDATE users SET is_blocked = 1 WHERE username = ?", (username,))
-        if c.rowcount == 0:
-            await message.answer("Пользователь не найден!")
-        else:
-            c.execute("SELECT user_id FROM users WHERE username = ?", (username,))
-            user_id = c.fetchone()[0]
-            await bot.send_message(user_id, "Администрация StoryGram заблокировала вас.")
-            await message.answer("Пользователь заблокирован!", reply_markup=get_admin_menu())
-        conn.commit()
-        await state.clear()
-
-    @dp.message(lambda message: message.text == "Список заблокированных")
-    async def blocked_list(message: types.Message):
-        c = conn.cursor()
-        c.execute("SELECT username FROM users WHERE is_blocked = 1")
-        blocked = c.fetchall()
-
-        if not blocked:
-            await message.answer("Нет заблокированных пользователей", reply_markup=get_admin_menu())
-            return
-
-        text = "Заблокированные пользователи:\n" + "\n".join([f"@{u[0]}" for u in blocked])
-        buttons = [[KeyboardButton(text=f"Разблокировать @{u[0]}") for u in blocked[:2]],
-                   [KeyboardButton(text="Назад")]]
-        keyboard = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
-        await message.answer(text, reply_markup=keyboard)
-
-    @dp.message(lambda message: message.text and message.text.startswith("Разблокировать @"))
-    async def unblock_user(message: types.Message):
-        username = message.text.split("@")[1]
-        c = conn.cursor()
-        c.execute("SELECT user_id FROM users WHERE username = ?", (username,))
-        user = c.fetchone()
-        if user:
-            user_id = user[0]
-            c.execute("UPDATE users SET is_blocked = 0 WHERE username = ?", (username,))
-            conn.commit()
-            await bot.send_message(user_id, "Вы были разблокированы администрацией StoryGram!")
-            await message.answer(f"@{username} разблокирован!", reply_markup=get_admin_menu())
-        else:
-            await message.answer(f"Пользователь @{username} не найден.", reply_markup=get_admin_menu())
-
-    @dp.message(lambda message: message.text == "Модерация постов")
-    async def moderate_posts(message: types.Message):
-        c = conn.cursor()
-        c.execute("SELECT post_id, title, content, image_id, username FROM posts p "
-                  "JOIN users u ON p.user_id = u.user_id WHERE status = 'pending' ORDER BY created_at ASC LIMIT 5")
-        posts = c.fetchall()
-
-        if not posts:
-            await message.answer("Нет постов на модерации", reply_markup=get_admin_menu())
-            return
-
-        for post_id, title, content, image_id, username in posts:
-            short_content = content[:100] + "..." if len(content) > 100 else content
-            text = f"📝 {title}\n{short_content}\nАвтор: @{username}"
-
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text=f"Одобрить: {title[:15]}..." if len(title) > 15 else f"Одобрить: {title}",
-                                      callback_data=f"approve_{post_id}"),
-                 InlineKeyboardButton(text=f"Вернуть: {title[:15]}..." if len(title) > 15 else f"Вернуть: {title}",
-                                      callback_data=f"return_{post_id}")]
-            ])
-
-            if image_id:
-                await bot.send_photo(message.chat.id, photo=image_id, caption=text, reply_markup=keyboard)
-            else:
-                await message.answer(text, reply_markup=keyboard)
-
-    @dp.callback_query(lambda c: c.data.startswith("approve_"))
-    async def approve_post(callback: types.CallbackQuery):
-        post_id = int(callback.data.split("_")[1])
-        c = conn.cursor()
-        c.execute("SELECT user_id, title FROM posts WHERE post_id = ?", (post_id,))
-        user_id, title = c.fetchone()
-        c.execute("UPDATE posts SET status = 'approved' WHERE post_id = ?", (post_id,))
-        c.execute("UPDATE users SET posts_count = posts_count + 1 WHERE user_id = ?", (user_id,))
-        conn.commit()
-
-        await bot.send_message(user_id, f"История '{title}' прошла модерацию и опубликована ✅")
-        if callback.message.photo:
-            await callback.message.edit_caption(caption=callback.message.caption + "\n✅ Пост одобрен!",
-                                                reply_markup=None)
-        else:
-            await callback.message.edit_text(callback.message.text + "\n✅ Пост одобрен!", reply_markup=None)
-        await callback.answer("Пост одобрен!")
-
-    @dp.callback_query(lambda c: c.data.startswith("return_"))
-    async def return_post(callback: types.CallbackQuery):
-        post_id = int(callback.data.split("_")[1])
-        c = conn.cursor()
-        c.execute("SELECT user_id, title FROM posts WHERE post_id = ?", (post_id,))
-        user_id, title = c.fetchone()
-        c.execute("UPDATE posts SET status = 'returned' WHERE post_id = ?", (post_id,))
-        conn.commit()
-
-        await bot.send_message(user_id, f"История '{title}' не прошла модерацию и возвращена на доработку ❌")
-        if callback.message.photo:
-            await callback.message.edit_caption(caption=callback.message.caption + "\n↩️ Пост возвращён на доработку!",
-                                                reply_markup=None)
-        else:
-            await callback.message.edit_text(callback.message.text + "\n↩️ Пост возвращён на доработку!",
-                                             reply_markup=None)
-        await callback.answer("Пост возвращён на доработку!")
-
-    @dp.message(lambda message: message.text == "Настройки модерации")
-    async def moderation_settings(message: types.Message):
-        c = conn.cursor()
-        c.execute("SELECT value FROM settings WHERE key = 'moderation_enabled'")
-        current = c.fetchone()[0]
-        keyboard = ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton(text="Включить модерацию"), KeyboardButton(text="Выключить модерацию")],
-                [KeyboardButton(text="Назад")]
-            ],
-            resize_keyboard=True
-        )
-        await message.answer(f"Модерация сейчас: {'включена' if current == '1' else 'выключена'}",
-                             reply_markup=keyboard)
-
-    @dp.message(lambda message: message.text in ["Включить модерацию", "Выключить модерацию"])
-    async def toggle_moderation(message: types.Message):
-        c = conn.cursor()
-        value = '1' if message.text == "Включить модерацию" else '0'
-        c.execute("UPDATE settings SET value = ? WHERE key = 'moderation_enabled'", (value,))
-        conn.commit()
-        await message.answer(f"Модерация {'включена' if value == '1' else 'выключена'}!",
-                             reply_markup=get_admin_menu())
-
-    @dp.message(lambda message: message.text == "Задержка постов")
-    async def set_delay(message: types.Message, state: FSMContext):
-        c = conn.cursor()
-        c.execute("SELECT value FROM settings WHERE key = 'post_delay'")
-        current = c.fetchone()[0]
-        await message.answer(f"Текущая задержка: {current} минут\nВведите новое значение (в минутах):")
-        await state.set_state(AdminStates.set_delay)
-
-    @dp.message(AdminStates.set_delay)
-    async def process_delay(message: types.Message, state: FSMContext):
-        try:
-            delay = int(message.text)
-            if delay < 1:
-                raise ValueError
-            c = conn.cursor()
-            c.execute("UPDATE settings SET value = ? WHERE key = 'post_delay'", (delay,))
-            conn.commit()
-            await message.answer(f"Задержка установлена: {delay} минут", reply_markup=get_admin_menu())
-            await state.clear()
-        except ValueError:
-            await message.answer("Введите корректное число!")
-
-    @dp.message(lambda message: message.text == "Удалить пост")
-    async def delete_post_menu(message: types.Message):
-        c = conn.cursor()
-        c.execute("SELECT post_id, title, username FROM posts p JOIN users u ON p.user_id = u.user_id "
-                  "WHERE status = 'approved' ORDER BY created_at DESC LIMIT 5")
-        posts = c.fetchall()
-        if not posts:
-            await message.answer("Нет опубликованных постов для удаления.", reply_markup=get_admin_menu())
-            return
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=f"{title} (@{username})", callback_data=f"admin_delete_{post_id}")]
-            for post_id, title, username in posts
-        ])
-        await message.answer("Выберите пост для удаления:", reply_markup=keyboard)
-
-    @dp.callback_query(lambda c: c.data.startswith("admin_delete_"))
-    async def delete_post(callback: types.CallbackQuery):
-        try:
-            post_id = int(callback.data.split("_")[2])
-            c = conn.cursor()
-            c.execute("SELECT title, user_id FROM posts WHERE post_id = ?", (post_id,))
-            post = c.fetchone()
-            if post:
-                title, user_id = post
-                c.execute("DELETE FROM posts WHERE post_id = ?", (post_id,))
-                conn.commit()
-                await bot.send_message(user_id, f"История '{title}' удалена администрацией.")
-                await callback.message.edit_text(f"Пост '{title}' удалён.", reply_markup=None)
-                await callback.answer("Удаление завершено!")
-            else:
-                await callback.answer("Пост не найден!")
-        except (IndexError, ValueError) as e:
-            logger.error(f"Ошибка в delete_post: {e}")
-            await callback.answer("Ошибка при удалении поста.")
\ No newline at end of file
+from aiogram import Dispatcher, types, Bot
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.context import FSMContext
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
+import logging
+from datetime import datetime
+from db import Database
+from settings import Settings
+from metrics import Metrics
+from notifications import NotificationQueue
+from routing import Routes
+from callbacks import (CallbackData, encode_callback, decode_callback, APPROVE, RETURN, ADMIN_DELETE,
+                       MOD_SELECT, MOD_VIEW, MOD_APPROVE_SELECTED, MOD_RETURN_SELECTED, MOD_APPROVE_PAGE, MOD_PAGE,
+                       MOD_PAGE_BACK)
+from system import get_main_menu
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Постов на странице очереди модерации: текст страницы укладывается в одно сообщение
+MODERATION_PAGE = 8
+SELECTED, UNSELECTED = "☑", "☐"
+MAX_TEXT, MAX_CAPTION = 4096, 1024
+APPROVED_TEXT = "История '{title}' прошла модерацию и опубликована ✅"
+RETURNED_TEXT = "История '{title}' не прошла модерацию и возвращена на доработку ❌"
+
+
+def _short(text: str, length: int) -> str:
+    return text[:length] + "..." if len(text) > length else text
+
+
+def _age(created_at: str) -> str:
+    minutes = int((datetime.now() - datetime.fromisoformat(created_at)).total_seconds() // 60)
+    if minutes < 60:
+        return f"{max(minutes, 0)} мин"
+    if minutes < 24 * 60:
+        return f"{minutes // 60} ч {minutes % 60} мин"
+    return f"{minutes // (24 * 60)} д {minutes // 60 % 24} ч"
+
+
+def queue_summary(depth: int, oldest: str) -> str:
+    if not depth:
+        return "Очередь модерации пуста"
+    return f"На модерации: {depth}, самый старый ждёт {_age(oldest)}"
+
+class AdminStates(StatesGroup):
+    edit_welcome = State()
+    edit_info = State()
+    edit_rules = State()
+    block_user = State()
+    set_delay = State()
+
+def get_admin_menu():
+    buttons = [
+        [KeyboardButton(text="Редактировать приветствие"), KeyboardButton(text="Редактировать информацию")],
+        [KeyboardButton(text="Редактировать правила"), KeyboardButton(text="Блокировать пользователя")],
+        [KeyboardButton(text="Список заблокированных"), KeyboardButton(text="Модерация постов")],
+        [KeyboardButton(text="Настройки модерации"), KeyboardButton(text="Задержка постов")],
+        [KeyboardButton(text="Удалить пост"), KeyboardButton(text="Метрики")],
+        [KeyboardButton(text="Назад")]
+    ]
+    return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+
+
+async def admins_only(event, data: dict) -> bool:
+    # Общая проверка всех маршрутов админки, в том числе ввода в состояниях и кнопок под постами
+    if data.get("is_admin"):
+        return True
+    if isinstance(event, types.CallbackQuery):
+        await event.answer("Нет доступа")
+        return False
+    # Права могли снять посреди ввода - выводим из состояния админки
+    if data.get("raw_state") is not None:
+        await data["state"].set_state(None)
+    await event.answer("У вас нет доступа к админке!")
+    return False
+
+def setup_handlers(dp: Dispatcher, routes: Routes, db: Database, bot: Bot, settings: Settings, metrics: Metrics,
+                   notifications: NotificationQueue):
+    admin_routes = routes.guarded(admins_only)
+
+    @routes.menu("admin")
+    async def render_admin_menu(message: types.Message, is_admin: bool):
+        if not is_admin:
+            await message.answer("Вы вернулись в главное меню", reply_markup=get_main_menu())
+            return
+        await message.answer("Панель администратора", reply_markup=get_admin_menu())
+
+    @admin_routes.text("Админка", opens="admin")
+    async def admin_menu(message: types.Message):
+        await message.answer("Панель администратора", reply_markup=get_admin_menu())
+
+    @admin_routes.text("Редактировать приветствие")
+    async def edit_welcome(message: types.Message, state: FSMContext):
+        await message.answer("Введите новое приветственное сообщение:")
+        await state.set_state(AdminStates.edit_welcome)
+
+    @admin_routes.state(AdminStates.edit_welcome)
+    async def process_welcome(message: types.Message, state: FSMContext):
+        await settings.set('welcome_message', message.text)
+        await message.answer("Приветствие обновлено!", reply_markup=get_admin_menu())
+        await state.clear()
+
+    @admin_routes.text("Редактировать информацию")
+    async def edit_info(message: types.Message, state: FSMContext):
+        await message.answer("Введите новый текст информации:")
+        await state.set_state(AdminStates.edit_info)
+
+    @admin_routes.state(AdminStates.edit_info)
+    async def process_info(message: types.Message, state: FSMContext):
+        await settings.set('info', message.text)
+        await message.answer("Информация обновлена!", reply_markup=get_admin_menu())
+        await state.clear()
+
+    @admin_routes.text("Редактировать правила")
+    async def edit_rules(message: types.Message, state: FSMContext):
+        await message.answer("Введите новый текст правил:")
+        await state.set_state(AdminStates.edit_rules)
+
+    @admin_routes.state(AdminStates.edit_rules)
+    async def process_rules(message: types.Message, state: FSMContext):
+        await settings.set('rules', message.text)
+        await message.answer("Правила обновлены!", reply_markup=get_admin_menu())
+        await state.clear()
+
+    @admin_routes.text("Блокировать пользователя")
+    async def block_user(message: types.Message, state: FSMContext):
+        await message.answer("Введите ник пользователя (с @):")
+        await state.set_state(AdminStates.block_user)
+
+    @admin_routes.state(AdminStates.block_user)
+    async def process_block(message: types.Message, state: FSMContext):
+        username = message.text.lstrip("@")
+        user_id = await db.block_user(username)
+        if user_id is None:
+            await message.answer("Пользователь не найден!")
+        else:
+            await notifications.notify(user_id, "Администрация StoryGram заблокировала вас.")
+            await message.answer("Пользователь заблокирован!", reply_markup=get_admin_menu())
+        await state.clear()
+
+    @admin_routes.text("Список заблокированных", leaf=True)
+    async def blocked_list(message: types.Message):
+        blocked = await db.get_blocked_usernames()
+
+        if not blocked:
+            await message.answer("Нет заблокированных пользователей", reply_markup=get_admin_menu())
+            return
+
+        text = "Заблокированные пользователи:\n" + "\n".join([f"@{u}" for u in blocked])
+        buttons = [[KeyboardButton(text=f"Разблокировать @{u}") for u in blocked[:2]],
+                   [KeyboardButton(text="Назад")]]
+        keyboard = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+        await message.answer(text, reply_markup=keyboard)
+
+    @admin_routes.text_prefix("Разблокировать @")
+    async def unblock_user(message: types.Message):
+        username = message.text.split("@")[1]
+        user_id = await db.unblock_user(username)
+        if user_id is not None:
+            await notifications.notify(user_id, "Вы были разблокированы администрацией StoryGram!")
+            await message.answer(f"@{username} разблокирован!", reply_markup=get_admin_menu())
+        else:
+            await message.answer(f"Пользователь @{username} не найден.", reply_markup=get_admin_menu())
+
+    def page_keyboard(page):
+        # Состояние выбора хранится в самой клавиатуре: отметка в тексте кнопки поста
+        rows = []
+        for number, (post_id, title, *_) in enumerate(page.posts, 1):
+            rows.append([InlineKeyboardButton(text=f"{UNSELECTED} {number}. {_short(title, 25)}",
+                                              callback_data=encode_callback(MOD_SELECT, post_id)),
+                         InlineKeyboardButton(text="🔍", callback_data=encode_callback(MOD_VIEW, post_id))])
+        rows.append([InlineKeyboardButton(text="✅ Одобрить выбранные", callback_data=encode_callback(MOD_APPROVE_SELECTED)),
+                     InlineKeyboardButton(text="↩️ Вернуть выбранные", callback_data=encode_callback(MOD_RETURN_SELECTED))])
+        rows.append([InlineKeyboardButton(text="✅ Одобрить все на странице",
+                                          callback_data=encode_callback(MOD_APPROVE_PAGE))])
+        # Страница редактируется на месте, поэтому листать можно в обе стороны
+        navigation = []
+        if page.prev_cursor:
+            navigation.append(InlineKeyboardButton(text="◀ Назад",
+                                                   callback_data=encode_callback(MOD_PAGE_BACK, cursor=page.prev_cursor)))
+        if page.next_cursor:
+            navigation.append(InlineKeyboardButton(text="Дальше ▶",
+                                                   callback_data=encode_callback(MOD_PAGE, cursor=page.next_cursor)))
+        if navigation:
+            rows.append(navigation)
+        return InlineKeyboardMarkup(inline_keyboard=rows)
+
+    async def render_queue(cursor: str = None, backward: bool = False):
+        # (текст, клавиатура) страницы очереди модерации; клавиатура None - очередь пуста
+        depth, oldest = await db.get_moderation_queue()
+        if not depth:
+            return "Нет постов на модерации", None
+        page = await db.get_pending_page(cursor, backward, MODERATION_PAGE)
+        if not page.posts and backward:
+            # Посты до курсора уже рассмотрены - показываем очередь сначала
+            page = await db.get_pending_page(None, False, MODERATION_PAGE)
+        if not page.posts:
+            return f"{queue_summary(depth, oldest)}\nДальше постов нет", None
+        lines = [queue_summary(depth, oldest)]
+        for number, (post_id, title, content, username, image_id, created_at) in enumerate(page.posts, 1):
+            lines.append(f"\n{number}. 📝 {title}{' 🖼' if image_id else ''}\n"
+                         f"{_short(content, 100)}\nАвтор: @{username}, {_age(created_at)} назад")
+        return "\n".join(lines), page_keyboard(page)
+
+    def page_selection(markup: InlineKeyboardMarkup):
+        # ([post_id всех постов страницы], [post_id выбранных]) по кнопкам выбора
+        page, selected = [], []
+        for row in markup.inline_keyboard if markup else ():
+            button = row[0]
+            cb = decode_callback(button.callback_data)
+            if cb.action == MOD_SELECT:
+                page.append(cb.post_id)
+                if button.text.startswith(SELECTED):
+                    selected.append(cb.post_id)
+        return page, selected
+
+    async def decide(post_ids, status: str) -> int:
+        # Решение одной транзакцией, уведомления авторам - фоном через очередь
+        decided = await db.moderate_posts(post_ids, status)
+        template = APPROVED_TEXT if status == 'approved' else RETURNED_TEXT
+        # Пост рассматривается один раз, поэтому решение по нему - естественный ключ дедупликации
+        await notifications.notify_many([(user_id, template.format(title=title), f"{status}:{post_id}")
+                                         for post_id, user_id, title in decided])
+        logger.info(f"Модерация: {status} {len(decided)} из {len(post_ids)}")
+        return len(decided)
+
+    @admin_routes.text("Модерация постов")
+    async def moderate_posts(message: types.Message):
+        text, keyboard = await render_queue()
+        await message.answer(text, reply_markup=keyboard or get_admin_menu())
+
+    @admin_routes.callback(MOD_PAGE)
+    @admin_routes.callback(MOD_PAGE_BACK)
+    async def moderation_page(callback: types.CallbackQuery, cb: CallbackData):
+        text, keyboard = await render_queue(cb.cursor, cb.action == MOD_PAGE_BACK)
+        await callback.message.edit_text(text, reply_markup=keyboard)
+        await callback.answer()
+
+    @admin_routes.callback(MOD_SELECT)
+    async def toggle_selection(callback: types.CallbackQuery, cb: CallbackData):
+        rows = [list(row) for row in callback.message.reply_markup.inline_keyboard]
+        for row in rows:
+            button = row[0]
+            if button.callback_data == callback.data:
+                mark, rest = button.text.split(" ", 1)
+                mark = UNSELECTED if mark == SELECTED else SELECTED
+                row[0] = InlineKeyboardButton(text=f"{mark} {rest}", callback_data=button.callback_data)
+        await callback.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+        await callback.answer()
+
+    @admin_routes.callback(MOD_APPROVE_SELECTED)
+    @admin_routes.callback(MOD_RETURN_SELECTED)
+    @admin_routes.callback(MOD_APPROVE_PAGE)
+    async def decide_page(callback: types.CallbackQuery, cb: CallbackData):
+        page, selected = page_selection(callback.message.reply_markup)
+        post_ids = page if cb.action == MOD_APPROVE_PAGE else selected
+        if not post_ids:
+            await callback.answer("Отметьте посты")
+            return
+        status = 'returned' if cb.action == MOD_RETURN_SELECTED else 'approved'
+        decided = await decide(post_ids, status)
+        summary = f"{'✅ Одобрено' if status == 'approved' else '↩️ Возвращено'}: {decided}"
+        if decided < len(post_ids):
+            summary += f", уже рассмотрены: {len(post_ids) - decided}"
+        # Рассмотренные посты ушли из очереди - показываем её сначала, с самых старых
+        text, keyboard = await render_queue()
+        await callback.message.edit_text(f"{summary}\n\n{text}", reply_markup=keyboard)
+        await callback.answer(summary)
+
+    @admin_routes.callback(MOD_VIEW)
+    async def view_pending_post(callback: types.CallbackQuery, cb: CallbackData):
+        # Пост целиком, с картинкой и кнопками решения по одному посту
+        post = await db.get_post_with_author(cb.post_id)
+        if not post:
+            await callback.answer("Пост не найден!")
+            return
+        title, content, username, image_id, is_compressed = post
+        text = f"📝 {title}\n{content}\nАвтор: @{username}"
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Одобрить", callback_data=encode_callback(APPROVE, cb.post_id)),
+             InlineKeyboardButton(text="Вернуть", callback_data=encode_callback(RETURN, cb.post_id))]
+        ])
+        if image_id:
+            # Несжатые изображения хранятся как документы
+            send = bot.send_photo if is_compressed else bot.send_document
+            await send(callback.message.chat.id, image_id, caption=_short(text, MAX_CAPTION), reply_markup=keyboard)
+        else:
+            await callback.message.answer(_short(text, MAX_TEXT), reply_markup=keyboard)
+        await callback.answer()
+
+    async def decide_one(callback: types.CallbackQuery, post_id: int, status: str, note: str):
+        if not await decide([post_id], status):
+            note = "Пост уже рассмотрен"
+        if callback.message.photo or callback.message.document:
+            await callback.message.edit_caption(caption=(callback.message.caption or "") + f"\n{note}",
+                                                reply_markup=None)
+        else:
+            await callback.message.edit_text(callback.message.text + f"\n{note}", reply_markup=None)
+        await callback.answer(note)
+
+    @admin_routes.callback(APPROVE)
+    async def approve_post(callback: types.CallbackQuery, cb: CallbackData):
+        await decide_one(callback, cb.post_id, 'approved', "✅ Пост одобрен!")
+
+    @admin_routes.callback(RETURN)
+    async def return_post(callback: types.CallbackQuery, cb: CallbackData):
+        await decide_one(callback, cb.post_id, 'returned', "↩️ Пост возвращён на доработку!")
+
+    @admin_routes.text("Настройки модерации", leaf=True)
+    async def moderation_settings(message: types.Message):
+        current = settings.moderation_enabled
+        keyboard = ReplyKeyboardMarkup(
+            keyboard=[
+                [KeyboardButton(text="Включить модерацию"), KeyboardButton(text="Выключить модерацию")],
+                [KeyboardButton(text="Назад")]
+            ],
+            resize_keyboard=True
+        )
+        await message.answer(f"Модерация сейчас: {'включена' if current else 'выключена'}",
+                             reply_markup=keyboard)
+
+    @admin_routes.text("Включить модерацию", "Выключить модерацию")
+    async def toggle_moderation(message: types.Message):
+        enabled = message.text == "Включить модерацию"
+        await settings.set('moderation_enabled', enabled)
+        await message.answer(f"Модерация {'включена' if enabled else 'выключена'}!",
+                             reply_markup=get_admin_menu())
+
+    @admin_routes.text("Задержка постов")
+    async def set_delay(message: types.Message, state: FSMContext):
+        current = settings.post_delay
+        await message.answer(f"Текущая задержка: {current} минут\nВведите новое значение (в минутах):")
+        await state.set_state(AdminStates.set_delay)
+
+    @admin_routes.state(AdminStates.set_delay)
+    async def process_delay(message: types.Message, state: FSMContext):
+        try:
+            delay = int(message.text)
+            if delay < 1:
+                raise ValueError
+            await settings.set('post_delay', delay)
+            await message.answer(f"Задержка установлена: {delay} минут", reply_markup=get_admin_menu())
+            await state.clear()
+        except ValueError:
+            await message.answer("Введите корректное число!")
+
+    @admin_routes.text("Метрики")
+    async def show_metrics(message: types.Message):
+        depth, oldest = await db.get_moderation_queue()
+        await message.answer(f"[Модерация]\n  {queue_summary(depth, oldest)}\n{metrics.format()}",
+                             reply_markup=get_admin_menu())
+
+    @admin_routes.text("Удалить пост")
+    async def delete_post_menu(message: types.Message):
+        posts = await db.get_recent_approved(5)
+        if not posts:
+            await message.answer("Нет опубликованных постов для удаления.", reply_markup=get_admin_menu())
+            return
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=f"{title} (@{username})", callback_data=encode_callback(ADMIN_DELETE, post_id))]
+            for post_id, title, username in posts
+        ])
+        await message.answer("Выберите пост для удаления:", reply_markup=keyboard)
+
+    @admin_routes.callback(ADMIN_DELETE)
+    async def delete_post(callback: types.CallbackQuery, cb: CallbackData):
+        post = await db.get_post_author_title(cb.post_id)
+        # Пост мог удалить другой администратор, пока открыт список
+        if post and await db.delete_post(cb.post_id):
+            user_id, title = post
+            await notifications.notify(user_id, f"История '{title}' удалена администрацией.", f"deleted:{cb.post_id}")
+            await callback.message.edit_text(f"Пост '{title}' удалён.", reply_markup=None)
+            await callback.answer("Удаление завершено!")
+        else:
+            await callback.answer("Пост не найден!")
\ No newline at end of file
@@ -0,0 +1,957 @@
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import aiohttp
+from aiogram import Bot, Dispatcher
+from aiogram.exceptions import TelegramForbiddenError, TelegramNetworkError, TelegramRetryAfter
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.methods import SendMessage
+
+from cards import CardRenderer
+from db import Database
+from digest import DigestAggregator
+from events import POST_PUBLISHED
+from feed_cache import FeedPageCache
+from fsm_storage import SQLiteStorage
+from metrics import Metrics
+from notifications import NotificationQueue, outbox_summary
+from pagination import encode_cursor
+from prefetch import PagePrefetcher
+from reactions import ReactionBuffer
+from routing import Routes
+from sampler import StorySampler
+from seen import SeenSet, SeenTracker
+from sender import SendScheduler, TokenBucket, INTERACTIVE, NOTIFICATION
+from system import setup_database
+from webhook import WebhookServer, SECRET_HEADER, percentile
+
+
+SEED_START = datetime(2024, 1, 1)
+
+
+def seed_database(path, posts=20000, users=1000, comments=50000):
+    conn = sqlite3.connect(path)
+    setup_database(conn)
+    start = SEED_START
+    conn.executemany("INSERT OR IGNORE INTO users (user_id, username, joined_at) VALUES (?, ?, ?)",
+                     ((u, f"user_{u}", start.isoformat()) for u in range(1, users + 1)))
+    conn.executemany("INSERT INTO posts (user_id, title, content, created_at, status) VALUES (?, ?, ?, ?, 'approved')",
+                     ((random.randint(1, users), f"Story {i}", "Текст истории " * 20,
+                       (start + timedelta(seconds=i)).isoformat()) for i in range(posts)))
+    conn.executemany("INSERT INTO comments (post_id, user_id, username, content, created_at) VALUES (?, ?, ?, ?, ?)",
+                     ((random.randint(1, posts), u % users + 1, f"user_{u % users + 1}", "Комментарий",
+                       (start + timedelta(seconds=u)).isoformat()) for u in range(comments)))
+    conn.commit()
+    conn.close()
+
+
+class LoopLag:
+    # Замеряет максимальную задержку цикла событий
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.max_lag = 0.0
+        self._task = None
+
+    async def _tick(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.max_lag = max(self.max_lag, time.perf_counter() - started - self.interval)
+
+    def __enter__(self):
+        self._task = asyncio.create_task(self._tick())
+        return self
+
+    def __exit__(self, *exc):
+        self._task.cancel()
+
+
+FEED_QUERY = ("SELECT post_id, title, content, username, image_id FROM posts p "
+              "JOIN users u ON p.user_id = u.user_id "
+              "WHERE status = 'approved' AND post_id > ? ORDER BY created_at ASC LIMIT 10")
+COMMENTS_QUERY = "SELECT username, content FROM comments WHERE post_id = ? ORDER BY created_at DESC LIMIT 3"
+
+
+async def _old_client(conn, client_id, iterations, posts):
+    for i in range(iterations):
+        c = conn.cursor()
+        c.execute(FEED_QUERY, (random.randint(0, posts - 10),))
+        for row in c.fetchall():
+            c.execute(COMMENTS_QUERY, (row[0],))
+            c.fetchall()
+        if i % 5 == 0:
+            post_id = random.randint(1, posts)
+            c.execute("SELECT reaction FROM reactions WHERE user_id = ? AND post_id = ?", (client_id, post_id))
+            if not c.fetchone():
+                c.execute("INSERT INTO reactions (user_id, post_id, reaction) VALUES (?, ?, 'like')",
+                          (client_id, post_id))
+                c.execute("UPDATE posts SET likes = likes + 1 WHERE post_id = ?", (post_id,))
+                conn.commit()
+        await asyncio.sleep(0)
+
+
+async def _new_client(db, reactions, client_id, iterations, posts):
+    for i in range(iterations):
+        offset = random.randint(0, posts - 10)
+        await db.get_feed_page(encode_cursor((SEED_START + timedelta(seconds=offset)).isoformat(), offset + 1))
+        if i % 5 == 0:
+            await reactions.add_like(client_id, random.randint(1, posts))
+
+
+async def bench_db(clients, iterations, posts):
+    workdir = tempfile.mkdtemp()
+    old_path = os.path.join(workdir, "old.db")
+    new_path = os.path.join(workdir, "new.db")
+    seed_database(old_path, posts=posts)
+    seed_database(new_path, posts=posts)
+
+    conn = sqlite3.connect(old_path)
+    with LoopLag() as lag:
+        started = time.perf_counter()
+        await asyncio.gather(*(_old_client(conn, i, iterations, posts) for i in range(clients)))
+        old_time = time.perf_counter() - started
+    conn.close()
+    print(f"старая схема (одно соединение, rollback journal): {old_time:.2f} c, "
+          f"макс. задержка цикла {lag.max_lag * 1000:.1f} мс")
+
+    db = Database(new_path)
+    await db.connect()
+    reactions = ReactionBuffer(db)
+    with LoopLag() as lag:
+        started = time.perf_counter()
+        await asyncio.gather(*(_new_client(db, reactions, i, iterations, posts) for i in range(clients)))
+        await reactions.flush()
+        new_time = time.perf_counter() - started
+    await reactions.close()
+    await db.close()
+    print(f"новая схема (WAL, пул читателей, один писатель): {new_time:.2f} c, "
+          f"макс. задержка цикла {lag.max_lag * 1000:.1f} мс")
+
+
+def bench_sampler(posts, samples):
+    ids = list(range(1, posts + 1))
+    likes = [random.randint(0, 50) for _ in ids]
+
+    sampler = StorySampler(weighted=True)
+    started = time.perf_counter()
+    sampler.load(list(zip(ids, likes)))
+    print(f"загрузка {posts} постов в сэмплер: {time.perf_counter() - started:.2f} c")
+
+    for weighted in (False, True):
+        sampler.weighted = weighted
+        started = time.perf_counter()
+        for _ in range(samples):
+            sampler.sample()
+        per_call = (time.perf_counter() - started) / samples * 1e6
+        print(f"выбор ({'по лайкам' if weighted else 'равномерно'}): {per_call:.2f} мкс")
+
+    started = time.perf_counter()
+    for post_id in range(1, samples + 1):
+        sampler.remove(post_id)
+        sampler.add(posts + post_id)
+        sampler.add_like(posts + post_id)
+    print(f"удаление + добавление + лайк: {(time.perf_counter() - started) / samples * 1e6:.2f} мкс")
+
+    sampler.no_repeat = True
+    started = time.perf_counter()
+    for _ in range(samples):
+        sampler.sample(user_id=1)
+    print(f"выбор без повторов: {(time.perf_counter() - started) / samples * 1e6:.2f} мкс")
+
+    path = os.path.join(tempfile.mkdtemp(), "random.db")
+    seed_database(path, posts=posts, comments=0)
+    conn = sqlite3.connect(path)
+    queries = 5
+    started = time.perf_counter()
+    for _ in range(queries):
+        conn.execute("SELECT post_id, title, content, username, image_id FROM posts p "
+                     "JOIN users u ON p.user_id = u.user_id WHERE status = 'approved' "
+                     "ORDER BY RANDOM() LIMIT 1").fetchone()
+    print(f"ORDER BY RANDOM() на {posts} постах: {(time.perf_counter() - started) / queries * 1000:.1f} мс")
+    conn.close()
+
+
+class FakeTelegramAPI:
+    # Имитирует лимиты Bot API: ~30 сообщений/с всего и ~1/с на чат с небольшим запасом
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=20, latency=0.02):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate, self.chat_burst = chat_rate, chat_burst
+        self.chats = {}
+        self.latency = latency
+        self.delivered = 0
+        self.rejected = 0
+
+    async def make_request(self, bot, method):
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        chat = self.chats.setdefault(method.chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+        if self.global_bucket.wait_time(now) > 0 or chat.wait_time(now) > 0:
+            self.rejected += 1
+            raise TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=1)
+        self.global_bucket.consume(now)
+        chat.consume(now)
+        self.delivered += 1
+        return True
+
+
+async def _send_all(call, chats, per_chat):
+    async def one_chat(chat_id):
+        for i in range(per_chat):
+            try:
+                await call(SendMessage(chat_id=chat_id, text=f"message {i}"))
+            except TelegramRetryAfter:
+                pass
+    await asyncio.gather(*(one_chat(chat_id) for chat_id in range(1, chats + 1)))
+
+
+async def bench_sender(chats, per_chat):
+    total = chats * per_chat
+
+    api = FakeTelegramAPI()
+    started = time.perf_counter()
+    await _send_all(lambda method: api.make_request(None, method), chats, per_chat)
+    elapsed = time.perf_counter() - started
+    print(f"без планировщика: доставлено {api.delivered}/{total} за {elapsed:.1f} c "
+          f"({api.delivered / elapsed:.1f}/с), 429: {api.rejected}")
+
+    api = FakeTelegramAPI()
+    scheduler = SendScheduler(max_retries=10)
+    started = time.perf_counter()
+    await _send_all(lambda method: scheduler(api.make_request, None, method), chats, per_chat)
+    elapsed = time.perf_counter() - started
+    await scheduler.close()
+    print(f"с планировщиком: доставлено {api.delivered}/{total} за {elapsed:.1f} c "
+          f"({api.delivered / elapsed:.1f}/с), 429: {api.rejected}")
+
+    # Стоимость выдачи разрешения при большой очереди: половина чатов под flood wait
+    backlog = chats * per_chat * 10
+    scheduler = SendScheduler(global_rate=1e9, chat_rate=1e9, chat_burst=10 ** 9,
+                              max_queue={INTERACTIVE: backlog, NOTIFICATION: backlog})
+    for chat_id in range(1, chats // 2 + 1):
+        scheduler._chat_bucket(chat_id).block(3600)
+    waiters = [asyncio.create_task(scheduler.acquire(i % chats + 1, NOTIFICATION)) for i in range(backlog)]
+    started = time.perf_counter()
+    granted = 0
+    while granted < backlog - backlog // chats * (chats // 2):
+        await asyncio.sleep(0.01)
+        granted = sum(waiter.done() for waiter in waiters)
+    elapsed = time.perf_counter() - started
+    print(f"очередь {backlog} запросов, половина чатов под flood wait: "
+          f"{elapsed / granted * 1e6:.1f} мкс на разрешение")
+    await scheduler.close()
+    await asyncio.gather(*waiters, return_exceptions=True)
+
+
+async def _fsm_flow(storage, users, steps):
+    # Каждый пользователь проходит шаги мастера: смена состояния и дописывание данных
+    async def one_user(user_id):
+        key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+        for step in range(steps):
+            await storage.get_state(key)
+            await storage.set_state(key, f"ProfileStates:step_{step}")
+            await storage.update_data(key, {f"field_{step}": "x" * 100, "feed_cursor": f"{step}.{user_id}"})
+        await storage.get_data(key)
+    started = time.perf_counter()
+    await asyncio.gather(*(one_user(user_id) for user_id in range(1, users + 1)))
+    await storage.close()
+    return time.perf_counter() - started
+
+
+async def bench_fsm(users, steps):
+    ops = users * steps * 4
+    variants = [
+        ("MemoryStorage", lambda path: MemoryStorage()),
+        ("SQLite, общий режим: запись до коммита", lambda path: SQLiteStorage(path)),
+        ("SQLite, один процесс: пакетная запись + кэш", lambda path: SQLiteStorage(path, shared=False)),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        for i, (name, make) in enumerate(variants):
+            storage = make(os.path.join(tmp, f"fsm_{i}.db"))
+            with LoopLag() as lag:
+                elapsed = await _fsm_flow(storage, users, steps)
+            line = f"{name}: {ops / elapsed:,.0f} оп/с, лаг цикла {lag.max_lag * 1000:.0f} мс"
+            if isinstance(storage, SQLiteStorage):
+                line += (f", транзакций {storage.stats['flushes']}"
+                         f" на {storage.stats['writes']} записей")
+            print(line)
+
+
+async def bench_webhook(updates, concurrency, workers, queue_size, work_ms):
+    dp = Dispatcher()
+
+    @dp.message()
+    async def handler(message):
+        # Имитация обработчика: запросы к БД и Bot API
+        await asyncio.sleep(work_ms / 1000)
+
+    bot = Bot("123:ABC")
+    server = WebhookServer(dp, bot, "secret", workers=workers, queue_size=queue_size, enqueue_timeout=0.5)
+    await server.start("127.0.0.1", 18080)
+    url = f"http://127.0.0.1:18080{server.path}"
+    ack_ms, statuses = [], Counter()
+    counter = iter(range(updates))
+
+    async def client(session):
+        for i in counter:
+            payload = {"update_id": i, "message": {
+                "message_id": i, "date": 0, "text": "Лента",
+                "chat": {"id": i % 500 + 1, "type": "private"},
+                "from": {"id": i % 500 + 1, "is_bot": False, "first_name": "u"}}}
+            started = time.perf_counter()
+            async with session.post(url, json=payload, headers={SECRET_HEADER: "secret"}) as response:
+                statuses[response.status] += 1
+            ack_ms.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    await server.stop()
+    elapsed = time.perf_counter() - started
+    await bot.session.close()
+
+    handled = list(server.latencies)
+    print(f"{updates} апдейтов за {elapsed:.1f} c ({updates / elapsed:.0f}/с), ответы: {dict(statuses)}")
+    print(f"ответ вебхука: p50 {percentile(ack_ms, 0.5):.1f} мс, p99 {percentile(ack_ms, 0.99):.1f} мс")
+    print(f"обработка (приём -> конец обработчика): p50 {percentile(handled, 0.5):.1f} мс, "
+          f"p99 {percentile(handled, 0.99):.1f} мс")
+
+
+def _like_one(conn, user_id, post_id):
+    # Прежний путь: проверка, вставка и commit на каждое нажатие (счётчики обновляют триггеры)
+    if conn.execute("SELECT reaction FROM reactions WHERE user_id = ? AND post_id = ?",
+                    (user_id, post_id)).fetchone():
+        return False
+    conn.execute("INSERT INTO reactions (user_id, post_id, reaction) VALUES (?, ?, 'like')", (user_id, post_id))
+    conn.commit()
+    return True
+
+
+async def bench_reactions(users, taps, hot_posts):
+    # Вирусные посты: все нажатия приходятся на несколько постов
+    workdir = tempfile.mkdtemp()
+    for i, label in enumerate(("по коммиту на лайк", "буфер с групповой записью")):
+        path = os.path.join(workdir, f"{i}.db")
+        seed_database(path, posts=1000, users=users, comments=0)
+        db = Database(path)
+        await db.connect()
+        reactions = ReactionBuffer(db)
+        if label == "по коммиту на лайк":
+            async def like(user_id, post_id):
+                return await db.run_sync(_like_one, user_id, post_id)
+        else:
+            like = reactions.add_like
+
+        async def client(user_id):
+            for _ in range(taps):
+                await like(user_id, random.randint(1, hot_posts))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(u) for u in range(1, users + 1)))
+        await reactions.flush()
+        elapsed = time.perf_counter() - started
+        total, counted = await db.run_sync(lambda conn: conn.execute(
+            "SELECT (SELECT COUNT(*) FROM reactions), (SELECT SUM(likes) FROM posts)").fetchone())
+        await reactions.close()
+        await db.close()
+        print(f"{label}: {users * taps / elapsed:.0f} нажатий/с, лайков {total}, сумма счётчиков {counted}, "
+              f"транзакций {reactions.stats['flushes'] or total}")
+
+
+async def bench_feed(opens, concurrency, posts):
+    # Одновременные открытия ленты: запрос в БД на каждое против общего кэша первых страниц
+    path = os.path.join(tempfile.mkdtemp(), "feed.db")
+    seed_database(path, posts=posts)
+    db = Database(path)
+    await db.connect()
+    cache = FeedPageCache(db)
+    cache.attach(db.events)
+
+    async def direct():
+        page = await db.get_feed_page(comments_limit=0)
+        await db.get_feed_page(page.next_cursor, comments_limit=0)
+
+    async def cached():
+        page = await cache.get_page()
+        await cache.get_page(page.next_cursor)
+
+    for label, open_feed in (("запрос в БД", direct), ("общий кэш", cached)):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def client(i):
+            async with semaphore:
+                await open_feed()
+                # Изредка публикуется новый пост - кэш должен сброситься
+                if label == "общий кэш" and i % 1000 == 999:
+                    db.events.publish(POST_PUBLISHED, post_id=0, user_id=0)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client(i) for i in range(opens)))
+        elapsed = time.perf_counter() - started
+        print(f"{label}: {opens / elapsed:.0f} открытий/с")
+    print(f"кэш: {dict(cache.metrics())}")
+    await db.close()
+
+
+async def bench_trending(posts, likes, batch):
+    # Пропускная способность лайков и комментариев с обновлением оценок популярного и без него
+    import db as db_module
+    import trending
+
+    workdir = tempfile.mkdtemp()
+    popular = [1 / (rank + 1) for rank in range(posts)]
+    cum_weights = list(itertools.accumulate(popular))
+    for i, label in enumerate(("без оценок", "с оценками")):
+        path = os.path.join(workdir, f"{i}.db")
+        seed_database(path, posts=posts, users=5000, comments=0)
+        conn = sqlite3.connect(path)
+        trending.seed_scores(conn, now=SEED_START + timedelta(seconds=posts))
+        conn.commit()
+        conn.close()
+        if label == "без оценок":
+            db_module.bump_scores = lambda *args, **kwargs: None
+        else:
+            db_module.bump_scores = trending.bump_scores
+        db = Database(path)
+        await db.connect()
+
+        # Пакеты лайков, как их пишет ReactionBuffer, на посты с распределением Ципфа
+        targets = random.choices(range(1, posts + 1), cum_weights=cum_weights, k=likes)
+        pairs = [(random.randint(1, 5000), post_id) for post_id in targets]
+        started = time.perf_counter()
+        for offset in range(0, likes, batch):
+            await db.add_likes(pairs[offset:offset + batch])
+        batched = likes / (time.perf_counter() - started)
+
+        comments = likes // 10
+        started = time.perf_counter()
+        for post_id in targets[:comments]:
+            await db.add_comment(post_id, 1, "user_1", "Комментарий")
+        single = comments / (time.perf_counter() - started)
+        print(f"{label}: лайки пакетами по {batch} - {batched:.0f}/с, комментарии по одному - {single:.0f}/с")
+
+        if label == "с оценками":
+            timings = []
+            for _ in range(50):
+                started = time.perf_counter()
+                page = await db.get_trending_page()
+                for _ in range(3):
+                    page = await db.get_trending_page(page.next_cursor)
+                timings.append(time.perf_counter() - started)
+            print(f"популярное, четыре страницы: p50 {percentile(timings, 0.5) * 1000:.1f} мс, "
+                  f"p99 {percentile(timings, 0.99) * 1000:.1f} мс")
+            # Чистка через неделю после последнего события: затухло всё
+            later = datetime.now() + timedelta(days=7)
+            started, pruned = time.perf_counter(), 0
+            while True:
+                deleted = await db.run_sync(trending.prune_scores_chunk, later, 500)
+                pruned += deleted
+                if deleted < 500:
+                    break
+            print(f"чистка: {pruned} постов чанками по 500 за {time.perf_counter() - started:.2f} c")
+        await db.close()
+    db_module.bump_scores = trending.bump_scores
+
+
+def _reading_history(posts, count):
+    # Просмотренные посты: сплошной отрезок ленты, прочитанный подряд, и случайные посты
+    # из остальной ленты (популярное, случайная история)
+    start = random.randint(1, max(1, posts - count))
+    run = count // 2
+    return list(range(start, start + run)) + random.sample(range(1, posts + 1), count - run)
+
+
+async def bench_seen(users, posts, sample):
+    # Память: множества просмотров выборки пользователей, пересчитанные на users
+    random.seed(1)
+    sizes = [random.choice((20, 100, 500, 2000, 20000)) for _ in range(sample)]
+    blob_bytes = memory_bytes = set_bytes = 0
+    started = time.perf_counter()
+    for count in sizes:
+        history = _reading_history(posts, count)
+        seen = SeenSet()
+        for post_id in history:
+            seen.add(post_id)
+        blob_bytes += len(seen.to_bytes())
+        memory_bytes += seen.nbytes
+        # set из int: таблица множества плюс по объекту int на каждый post_id
+        set_bytes += sys.getsizeof(set(history)) + 28 * count
+    per_add = (time.perf_counter() - started) / sum(sizes)
+    scale = users / sample
+    print(f"{users} пользователей, в среднем {sum(sizes) / sample:.0f} просмотров: "
+          f"BLOB {blob_bytes * scale / 2 ** 20:.0f} МБ, в памяти {memory_bytes * scale / 2 ** 20:.0f} МБ, "
+          f"set(int) {set_bytes * scale / 2 ** 20:.0f} МБ, таблица (user_id, post_id) ~"
+          f"{sum(sizes) * scale * 2 * 20 / 2 ** 20:.0f} МБ; add {per_add * 1e6:.2f} мкс")
+
+    # Задержка "Непрочитанного" на ленте из posts постов
+    path = os.path.join(tempfile.mkdtemp(), "seen.db")
+    conn = sqlite3.connect(path)
+    setup_database(conn)
+    conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'author')")
+    conn.executemany("INSERT INTO posts (user_id, title, content, created_at, status) VALUES (1, ?, '', ?, 'approved')",
+                     ((f"Story {i}", (SEED_START + timedelta(seconds=i)).isoformat()) for i in range(posts)))
+    conn.commit()
+    conn.close()
+    db = Database(path)
+    await db.connect()
+    for label, count in (("новичок", 0), ("читатель", 2000), ("прочитал первые 100 тысяч", 100_000)):
+        tracker = SeenTracker(db)
+        user_id = count + 1
+        if count == 100_000:
+            history = list(range(1, count + 1))
+        else:
+            history = _reading_history(posts, count) if count else []
+        await tracker.mark(user_id, history)
+        timings = []
+        for attempt in range(3):
+            started = time.perf_counter()
+            page = await tracker.unread_page(user_id)
+            if page.next_cursor:
+                await tracker.unread_page(user_id, page.next_cursor)
+            timings.append(time.perf_counter() - started)
+        print(f"{label}: две страницы непрочитанного - первое открытие {timings[0] * 1000:.1f} мс, "
+              f"повторное {min(timings[1:]) * 1000:.1f} мс, просмотрено постов {tracker.stats['scanned']}")
+        started = time.perf_counter()
+        await tracker.close()
+        print(f"  запись множества {len(history)} просмотров: {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    # Групповая запись: 5000 изменённых пользователей одной транзакцией
+    tracker = SeenTracker(db)
+    for user_id in range(1, 5001):
+        await tracker.mark(user_id, _reading_history(posts, 100))
+    started = time.perf_counter()
+    await tracker.close()
+    print(f"запись 5000 изменённых множеств: {(time.perf_counter() - started) * 1000:.0f} мс")
+    await db.close()
+
+
+_SYLLABLES = ["ка", "ро", "ми", "на", "ле", "то", "ва", "ст", "пр", "до", "ль", "ри", "бо", "жи", "зе", "мо"]
+_FORMS = ["а", "ы", "е", "у", "ой", "ами", "ах", "ов", ""]
+
+
+def _search_corpus(posts, words=20, vocabulary=50000):
+    # Синтетические "русские" слова с распределением Ципфа: есть и частые, и редкие основы
+    random.seed(1)
+    stems = list({"".join(random.choices(_SYLLABLES, k=random.randint(2, 4))) for _ in range(vocabulary)})
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(stems))))
+    for i in range(posts):
+        chosen = random.choices(stems, cum_weights=cum_weights, k=words)
+        yield (f"{chosen[0]}{random.choice(_FORMS)} {chosen[1]}{random.choice(_FORMS)}",
+               " ".join(stem + random.choice(_FORMS) for stem in chosen)), stems
+
+
+async def bench_search(posts, queries):
+    from search import to_match_query
+    from migrations import rebuild_search_index
+
+    path = os.path.join(tempfile.mkdtemp(), "search.db")
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    setup_database(conn)
+    conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'author')")
+    stems = None
+
+    def rows():
+        nonlocal stems
+        for (title, content), stems in _search_corpus(posts):
+            yield title, content
+
+    # Вставка без триггера индекса, затем массовая перестройка - как python search.py
+    conn.execute("DROP TRIGGER trg_posts_fts_insert")
+    started = time.perf_counter()
+    conn.executemany("INSERT INTO posts (user_id, title, content, created_at, status) "
+                     "VALUES (1, ?, ?, '2024-01-01', 'approved')", rows())
+    conn.commit()
+    print(f"{posts} постов вставлено за {time.perf_counter() - started:.1f} c")
+    started = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    rebuild_search_index(conn)
+    conn.commit()
+    print(f"индекс перестроен за {time.perf_counter() - started:.1f} c, "
+          f"файл {os.path.getsize(path) / 2 ** 20:.0f} МБ")
+    conn.close()
+
+    db = Database(path)
+    await db.connect()
+    cases = {
+        "частое слово": stems[0] + "ами",
+        "среднее слово": stems[len(stems) // 100] + "ой",
+        "редкое слово": stems[-1],
+        "два слова": f"{stems[5]}ы {stems[50]}",
+    }
+    for name, text in cases.items():
+        match = await to_match_query(db, text)
+        timings, found = [], None
+        for _ in range(queries):
+            started = time.perf_counter()
+            # Раскрытие основ по словарю индекса входит в замер
+            await to_match_query(db, text)
+            page = await db.search_posts(match)
+            if page.next_cursor:
+                await db.search_posts(match, page.next_cursor)
+            timings.append(time.perf_counter() - started)
+        total = await db.run_sync(lambda c: c.execute("SELECT COUNT(*) FROM posts_fts WHERE posts_fts MATCH ?",
+                                                      (match,)).fetchone()[0])
+        print(f"{name} ({text}, совпадений {total}): две страницы p50 {percentile(timings, 0.5) * 1000:.1f} мс, "
+              f"p99 {percentile(timings, 0.99) * 1000:.1f} мс")
+
+    started = time.perf_counter()
+    await db.run_sync(lambda c: c.execute("SELECT post_id FROM posts WHERE status = 'approved' AND "
+                                          "(title LIKE ? OR content LIKE ?) LIMIT 6",
+                                          (f"%{stems[-1]}%", f"%{stems[-1]}%")).fetchall())
+    print(f"для сравнения LIKE по редкому слову: {(time.perf_counter() - started) * 1000:.0f} мс")
+    await db.close()
+
+
+class _ScheduledBot:
+    # send_message через планировщик на имитации Bot API - как у настоящего бота с SendScheduler
+    def __init__(self, scheduler, api):
+        self.scheduler, self.api = scheduler, api
+
+    async def send_message(self, chat_id, text):
+        return await self.scheduler(self.api.make_request, None, SendMessage(chat_id=chat_id, text=text))
+
+
+async def bench_moderation(posts, page, decisions, authors):
+    path = os.path.join(tempfile.mkdtemp(), "moderation.db")
+    seed_database(path, posts=posts, comments=0)
+    conn = sqlite3.connect(path)
+    conn.execute("UPDATE posts SET status = 'pending'")
+    conn.commit()
+    conn.close()
+    db = Database(path)
+    await db.connect()
+
+    # Решения: транзакция на пост против транзакции на страницу очереди
+    single = min(posts // 4, 2000)
+    started = time.perf_counter()
+    for post_id in range(1, single + 1):
+        await db.moderate_posts([post_id], 'approved')
+    print(f"по одному посту: {single / (time.perf_counter() - started):.0f} постов/с")
+    started, decided = time.perf_counter(), 0
+    while decided < single:
+        pending = await db.get_pending_page(limit=page)
+        decided += len(await db.moderate_posts([row[0] for row in pending.posts], 'approved'))
+    print(f"страницами по {page}: {decided / (time.perf_counter() - started):.0f} постов/с")
+
+    # Страница из середины очереди и сводка по очереди
+    middle = (await db.run_sync(lambda conn: conn.execute(
+        "SELECT created_at, post_id FROM posts WHERE status = 'pending' "
+        "ORDER BY created_at LIMIT 1 OFFSET ?", ((posts - 2 * single) // 2,)).fetchone()))
+    timings = []
+    for _ in range(200):
+        started = time.perf_counter()
+        await db.get_pending_page(encode_cursor(*middle), limit=page)
+        await db.get_moderation_queue()
+        timings.append(time.perf_counter() - started)
+    depth, _ = await db.get_moderation_queue()
+    print(f"страница и сводка при очереди {depth}: p50 {percentile(timings, 0.5) * 1000:.1f} мс, "
+          f"p99 {percentile(timings, 0.99) * 1000:.1f} мс")
+
+    # Уведомления о decisions решениях для authors авторов
+    recipients = [i % authors + 1 for i in range(decisions)]
+    api, scheduler = FakeTelegramAPI(), SendScheduler(max_retries=10)
+    bot = _ScheduledBot(scheduler, api)
+    started = time.perf_counter()
+    for chat_id in recipients:
+        await bot.send_message(chat_id, "История прошла модерацию")
+    print(f"отправка из обработчика: {api.delivered} сообщений, администратор ждёт "
+          f"{time.perf_counter() - started:.1f} c")
+    await scheduler.close()
+
+    api, scheduler = FakeTelegramAPI(), SendScheduler(max_retries=10)
+    queue = NotificationQueue(db, _ScheduledBot(scheduler, api))
+    started = time.perf_counter()
+    for offset in range(0, decisions, page):
+        await queue.notify_many([(chat_id, "История прошла модерацию", f"bench:{offset + i}")
+                                 for i, chat_id in enumerate(recipients[offset:offset + page])])
+    enqueued = time.perf_counter() - started
+    await queue.dispatch()
+    print(f"очередь уведомлений: {api.delivered} сообщений, постановка {enqueued * 1000:.1f} мс, "
+          f"доставка за {time.perf_counter() - started:.1f} c, склеено {queue.stats['coalesced']}")
+    await scheduler.close()
+    await db.close()
+
+
+class _FlakyTelegramAPI(FakeTelegramAPI):
+    # Сетевые сбои с вероятностью failure_rate и чаты, заблокировавшие бота
+    def __init__(self, failure_rate, blocked):
+        super().__init__(global_rate=1000, chat_rate=100, chat_burst=100, latency=0.005)
+        self.failure_rate = failure_rate
+        self.blocked = blocked
+        self.lines = Counter()
+
+    async def make_request(self, bot, method):
+        if method.chat_id in self.blocked:
+            raise TelegramForbiddenError(method=method, message="Forbidden: bot was blocked by the user")
+        if random.random() < self.failure_rate:
+            await asyncio.sleep(self.latency)
+            raise TelegramNetworkError(method=method, message="Connection reset")
+        result = await super().make_request(bot, method)
+        self.lines.update(method.text.split("\n"))
+        return result
+
+
+async def _drain(queue, db):
+    while True:
+        await asyncio.sleep(0.05)
+        counts, _ = await db.run_sync(outbox_summary)
+        if not counts.get("pending"):
+            return counts
+
+
+async def bench_outbox(notifications, chats, failure_rate, duplicates):
+    path = os.path.join(tempfile.mkdtemp(), "outbox.db")
+    conn = sqlite3.connect(path)
+    setup_database(conn)
+    conn.close()
+    db = Database(path)
+    await db.connect()
+    blocked = set(range(1, chats + 1, 50))
+    api, scheduler = _FlakyTelegramAPI(failure_rate, blocked), SendScheduler(global_rate=1000, chat_rate=100,
+                                                                             chat_burst=100, max_retries=10)
+    bot = _ScheduledBot(scheduler, api)
+    # Повторные постановки того же уведомления (тот же ключ) должны отсеиваться
+    keys = [random.randrange(notifications) if random.random() < duplicates else i for i in range(notifications)]
+    rows = [(key % chats + 1, f"n{key}", f"bench:{key}") for key in keys]
+
+    started = time.perf_counter()
+    queue = NotificationQueue(db, bot, window=0.01, retry_base=0.05, retry_max=0.5)
+    for row in rows:
+        await queue.notify_many([row])
+    enqueued = time.perf_counter() - started
+    print(f"постановка по одному: {notifications / enqueued:.0f}/с, отсеяно дублей {queue.stats['deduplicated']}")
+
+    # Перезапуск посреди отправки: второй экземпляр дочитывает таблицу
+    queue.start()
+    await asyncio.sleep(0.3)
+    await queue.close()
+    first = dict(queue.stats)
+    queue = NotificationQueue(db, bot, window=0.01, retry_base=0.05, retry_max=0.5)
+    queue.start()
+    counts = await _drain(queue, db)
+    await queue.close()
+    elapsed = time.perf_counter() - started
+    unique = len(set(keys))
+    expected = {f"n{key}" for key in set(keys) if key % chats + 1 not in blocked}
+    delivered = {line for line in api.lines if line in expected}
+    twice = sum(count - 1 for line, count in api.lines.items() if count > 1)
+    print(f"уникальных уведомлений {unique}: доставлено {len(delivered)}/{len(expected)}, "
+          f"мёртвых {counts.get('dead', 0)} (заблокированные чаты), повторно из-за перезапуска {twice}")
+    print(f"до перезапуска отправлено {first.get('sent', 0)} сообщений; всего сообщений {api.delivered}, "
+          f"сбоев сети {first.get('failed', 0) + queue.stats['failed']}, за {elapsed:.1f} c")
+    await scheduler.close()
+    await db.close()
+
+async def bench_digest(posts, likes, comments, authors):
+    path = os.path.join(tempfile.mkdtemp(), "digest.db")
+    seed_database(path, posts=posts, users=authors, comments=0)
+    db = Database(path)
+    await db.connect()
+    authors_by_post = dict(await db.run_sync(lambda conn: conn.execute("SELECT post_id, user_id FROM posts").fetchall()))
+    queue = NotificationQueue(db, None)
+    digests = DigestAggregator(db, queue)
+
+    # Лайки и комментарии на посты с распределением Ципфа, как их публикует Database
+    popular = [1 / (rank + 1) for rank in range(posts)]
+    targets = random.choices(range(1, posts + 1), cum_weights=list(itertools.accumulate(popular)), k=likes + comments)
+    events = [(authors_by_post[post_id], random.randint(1, authors), post_id, i < likes)
+              for i, post_id in enumerate(targets)]
+    started = time.perf_counter()
+    for author_id, actor_id, post_id, is_like in events:
+        if is_like:
+            digests.add(author_id, actor_id, post_id, likes=1)
+        else:
+            digests.add(author_id, actor_id, post_id, comments=1)
+    elapsed = time.perf_counter() - started
+    print(f"учёт события: {elapsed / len(events) * 1e6:.2f} мкс, авторов с активностью {digests.metrics()['авторов ждут']}")
+
+    started = time.perf_counter()
+    await digests.checkpoint()
+    print(f"контрольная точка: {time.perf_counter() - started:.2f} c")
+
+    started = time.perf_counter()
+    sent = await digests.run_once(datetime.now() + timedelta(days=1))
+    counts, _ = await db.run_sync(outbox_summary)
+    print(f"сводки: {sent} сообщений вместо {digests.stats['included']} за {time.perf_counter() - started:.2f} c, "
+          f"в очереди уведомлений {counts.get('pending', 0)}")
+    print(f"при 30 сообщениях/с по событию на сообщение: {digests.stats['included'] / 30 / 60:.0f} мин отправки, "
+          f"сводками: {sent / 30:.0f} c")
+    await db.close()
+
+
+def _collect_routes():
+    # Настоящая таблица маршрутов бота (обработчики не вызываются)
+    import admin, feed, random_post, search, system, user
+    from settings import Settings
+
+    dp, routes, db, bot = Dispatcher(), Routes(), Database(":memory:"), Bot("123:ABC")
+    settings = Settings(db)
+    system.setup_handlers(dp, routes, db, bot, settings)
+    cards = CardRenderer(db)
+    prefetcher = PagePrefetcher()
+    seen = SeenTracker(db)
+    notifications = NotificationQueue(db, bot)
+    user.setup_handlers(dp, routes, db, bot, settings, cards, prefetcher, notifications)
+    feed.setup_handlers(dp, routes, db, bot, ReactionBuffer(db), cards, FeedPageCache(db), prefetcher, seen)
+    admin.setup_handlers(dp, routes, db, bot, settings, Metrics(), notifications)
+    random_post.setup_handlers(dp, routes, db, bot, cards, seen)
+    search.setup_handlers(dp, routes, db, bot, cards)
+    return sorted(routes._texts), sorted(routes._callbacks), bot
+
+
+async def bench_routing(updates):
+    from aiogram.types import CallbackQuery, Chat, Message, Update, User
+    from callbacks import CallbackDataMiddleware, encode_callback, _LEGACY
+
+    texts, actions, bot = _collect_routes()
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    async def noop(event):
+        pass
+
+    # Прежняя схема: фильтр на каждый текст и префикс callback_data
+    legacy = Dispatcher()
+    for text in texts:
+        legacy.message.register(noop, lambda m, text=text: m.text == text)
+    for prefix, _ in _LEGACY:
+        legacy.callback_query.register(noop, lambda c, prefix=prefix: c.data.startswith(prefix))
+
+    routes = Routes()
+    for text in texts:
+        routes.text(text)(noop)
+    for action in actions:
+        routes.callback(action)(noop)
+    routed = Dispatcher()
+    routed.callback_query.outer_middleware(CallbackDataMiddleware())
+    routes.setup(routed)
+
+    user, chat = User(id=1, is_bot=False, first_name="u"), Chat(id=1, type="private")
+
+    def message(text):
+        return Update(update_id=1, message=Message(message_id=1, date=0, chat=chat, from_user=user, text=text))
+
+    def callback(data):
+        return Update(update_id=2, callback_query=CallbackQuery(id="1", from_user=user, chat_instance="x", data=data))
+
+    last_prefix, last_action = _LEGACY[-1]
+    # (апдейт для цепочки фильтров, апдейт для таблицы маршрутов)
+    samples = {
+        "первый текст": (message(texts[0]), message(texts[0])),
+        "последний текст": (message(texts[-1]), message(texts[-1])),
+        "последний callback": (callback(f"{last_prefix}123"), callback(encode_callback(last_action, 123))),
+    }
+    print(f"маршрутов: {len(texts)} текстов, {len(actions)} действий callback")
+    for name, pair in samples.items():
+        line = []
+        for label, dp, update in (("цепочка фильтров", legacy, pair[0]), ("таблица маршрутов", routed, pair[1])):
+            started = time.perf_counter()
+            for _ in range(updates):
+                await dp.feed_update(bot, update)
+            line.append(f"{label} {(time.perf_counter() - started) / updates * 1e6:.1f} мкс")
+        print(f"{name}: " + ", ".join(line))
+    await bot.session.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки StoryGram")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("db", help="старое соединение против WAL-пула")
+    p.add_argument("--clients", type=int, default=50)
+    p.add_argument("--iterations", type=int, default=20)
+    p.add_argument("--posts", type=int, default=20000)
+    p = sub.add_parser("sampler", help="сэмплер случайных историй против ORDER BY RANDOM()")
+    p.add_argument("--posts", type=int, default=1_000_000)
+    p.add_argument("--samples", type=int, default=100_000)
+    p = sub.add_parser("sender", help="пропускная способность планировщика отправки на имитации Bot API")
+    p.add_argument("--chats", type=int, default=20)
+    p.add_argument("--per-chat", type=int, default=15)
+    p = sub.add_parser("fsm", help="SQLite-хранилище FSM против MemoryStorage")
+    p.add_argument("--users", type=int, default=1000)
+    p.add_argument("--steps", type=int, default=10)
+    p = sub.add_parser("webhook", help="нагрузочный тест вебхука с очередью и обработчиками")
+    p.add_argument("--updates", type=int, default=20000)
+    p.add_argument("--concurrency", type=int, default=20)
+    p.add_argument("--workers", type=int, default=16)
+    p.add_argument("--queue-size", type=int, default=1000)
+    p.add_argument("--work-ms", type=float, default=5)
+    p = sub.add_parser("reactions", help="лайки: коммит на каждое нажатие против буфера")
+    p.add_argument("--users", type=int, default=500)
+    p.add_argument("--taps", type=int, default=20)
+    p.add_argument("--hot-posts", type=int, default=5)
+    p = sub.add_parser("feed", help="первые страницы ленты: БД против общего кэша")
+    p.add_argument("--opens", type=int, default=5000)
+    p.add_argument("--concurrency", type=int, default=200)
+    p.add_argument("--posts", type=int, default=20000)
+    p = sub.add_parser("trending", help="обновление оценок популярного на лайках и комментариях")
+    p.add_argument("--posts", type=int, default=100_000)
+    p.add_argument("--likes", type=int, default=200_000)
+    p.add_argument("--batch", type=int, default=500)
+    p = sub.add_parser("seen", help="просмотренные посты: память множеств и задержка непрочитанного")
+    p.add_argument("--users", type=int, default=100_000)
+    p.add_argument("--posts", type=int, default=1_000_000)
+    p.add_argument("--sample", type=int, default=2000)
+    p = sub.add_parser("search", help="полнотекстовый поиск FTS5 на большом корпусе")
+    p.add_argument("--posts", type=int, default=1_000_000)
+    p.add_argument("--queries", type=int, default=50)
+    p = sub.add_parser("moderation", help="пакетная модерация и очередь уведомлений авторам")
+    p.add_argument("--posts", type=int, default=20000)
+    p.add_argument("--page", type=int, default=8)
+    p.add_argument("--decisions", type=int, default=400)
+    p.add_argument("--authors", type=int, default=40)
+    p = sub.add_parser("outbox", help="доставка уведомлений из outbox со сбоями и перезапуском")
+    p.add_argument("--notifications", type=int, default=5000)
+    p.add_argument("--chats", type=int, default=500)
+    p.add_argument("--failure-rate", type=float, default=0.1)
+    p.add_argument("--duplicates", type=float, default=0.1)
+    p = sub.add_parser("digest", help="сводки авторам: учёт событий и число сообщений")
+    p.add_argument("--posts", type=int, default=100_000)
+    p.add_argument("--likes", type=int, default=200_000)
+    p.add_argument("--comments", type=int, default=20_000)
+    p.add_argument("--authors", type=int, default=5000)
+    p = sub.add_parser("routing", help="стоимость выбора обработчика на апдейт")
+    p.add_argument("--updates", type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.bench == "db":
+        asyncio.run(bench_db(args.clients, args.iterations, args.posts))
+    elif args.bench == "sampler":
+        bench_sampler(args.posts, args.samples)
+    elif args.bench == "sender":
+        asyncio.run(bench_sender(args.chats, args.per_chat))
+    elif args.bench == "fsm":
+        asyncio.run(bench_fsm(args.users, args.steps))
+    elif args.bench == "reactions":
+        asyncio.run(bench_reactions(args.users, args.taps, args.hot_posts))
+    elif args.bench == "feed":
+        asyncio.run(bench_feed(args.opens, args.concurrency, args.posts))
+    elif args.bench == "trending":
+        asyncio.run(bench_trending(args.posts, args.likes, args.batch))
+    elif args.bench == "seen":
+        asyncio.run(bench_seen(args.users, args.posts, args.sample))
+    elif args.bench == "search":
+        asyncio.run(bench_search(args.posts, args.queries))
+    elif args.bench == "moderation":
+        asyncio.run(bench_moderation(args.posts, args.page, args.decisions, args.authors))
+    elif args.bench == "outbox":
+        asyncio.run(bench_outbox(args.notifications, args.chats, args.failure_rate, args.duplicates))
+    elif args.bench == "digest":
+        asyncio.run(bench_digest(args.posts, args.likes, args.comments, args.authors))
+    elif args.bench == "routing":
+        asyncio.run(bench_routing(args.updates))
+    elif args.bench == "webhook":
+        asyncio.run(bench_webhook(args.updates, args.concurrency, args.workers, args.queue_size, args.work_ms))
+
+
+if __name__ == "__main__":
+    main()
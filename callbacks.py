@@ -0,0 +1,133 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import CallbackQuery, TelegramObject
+
+from pagination import to_base36, from_base36, decode_cursor, decode_rank_cursor, decode_search_cursor
+
+logger = logging.getLogger(__name__)
+
+# callback_data: <версия><код действия>[:post_id[:экран[:курсор]]], числа в base36.
+# Например "1r:2n:f" - прочитать пост 95 из ленты. Telegram ограничивает данные 64 байтами.
+VERSION = "1"
+MAX_BYTES = 64
+_SEPARATOR = ":"
+
+# Действия
+READ = "read"
+LIKE = "like"
+COMMENT = "comment"
+DELETE = "delete"
+EDIT = "edit"
+FEED_MORE = "feed_more"
+MY_POSTS_MORE = "my_posts_more"
+APPROVE = "approve"
+RETURN = "return"
+ADMIN_DELETE = "admin_delete"
+SEARCH_MORE = "search_more"
+TRENDING_MORE = "trending_more"
+UNREAD_MORE = "unread_more"
+# Пакетная модерация
+MOD_SELECT = "mod_select"
+MOD_VIEW = "mod_view"
+MOD_APPROVE_SELECTED = "mod_approve_selected"
+MOD_RETURN_SELECTED = "mod_return_selected"
+MOD_APPROVE_PAGE = "mod_approve_page"
+MOD_PAGE = "mod_page"
+MOD_PAGE_BACK = "mod_page_back"
+
+_CODES = {
+    READ: "r", LIKE: "l", COMMENT: "c", DELETE: "d", EDIT: "e",
+    FEED_MORE: "f", MY_POSTS_MORE: "m", APPROVE: "a", RETURN: "t", ADMIN_DELETE: "x",
+    SEARCH_MORE: "s", TRENDING_MORE: "p", UNREAD_MORE: "n",
+    MOD_SELECT: "k", MOD_VIEW: "v", MOD_APPROVE_SELECTED: "y", MOD_RETURN_SELECTED: "z",
+    MOD_APPROVE_PAGE: "w", MOD_PAGE: "q", MOD_PAGE_BACK: "b",
+}
+_ACTIONS = {code: action for action, code in _CODES.items()}
+
+# Экран, с которого открыт пост
+FEED = "f"
+RANDOM = "r"
+MY_POSTS = "m"
+SEARCH = "s"
+TRENDING = "p"
+UNREAD = "n"
+
+# Формат курсора по действию; остальные курсоры - позиция в ленте
+_CURSOR_DECODERS = {SEARCH_MORE: decode_search_cursor, TRENDING_MORE: decode_rank_cursor}
+
+# Кнопки, отправленные до перехода на кодек; admin_delete_ проверяется раньше delete_
+_LEGACY = [
+    ("admin_delete_", ADMIN_DELETE), ("delete_", DELETE), ("read_", READ), ("like_", LIKE),
+    ("comment_", COMMENT), ("edit_", EDIT), ("approve_", APPROVE), ("return_", RETURN),
+]
+_LEGACY_EXACT = {"load_more": FEED_MORE, "load_more_my_posts": MY_POSTS_MORE}
+
+
+class CallbackData(NamedTuple):
+    action: str
+    post_id: Optional[int] = None
+    origin: Optional[str] = None
+    cursor: Optional[str] = None
+
+
+def encode_callback(action: str, post_id: int = None, origin: str = None, cursor: str = None) -> str:
+    fields = [VERSION + _CODES[action],
+              "" if post_id is None else to_base36(post_id),
+              origin or "",
+              cursor or ""]
+    while len(fields) > 1 and not fields[-1]:
+        fields.pop()
+    data = _SEPARATOR.join(fields)
+    if len(data.encode()) > MAX_BYTES:
+        raise ValueError(f"callback_data длиннее {MAX_BYTES} байт: {data!r}")
+    return data
+
+
+def decode_callback(data: str) -> CallbackData:
+    # ValueError при неизвестном формате или действии
+    if not data:
+        raise ValueError("Пустой callback_data")
+    if data[0] != VERSION:
+        return _decode_legacy(data)
+    head, *fields = data.split(_SEPARATOR)
+    if len(head) != 2 or head[1] not in _ACTIONS or len(fields) > 3:
+        raise ValueError(f"Неизвестный callback_data: {data!r}")
+    fields += [""] * (3 - len(fields))
+    post_id, origin, cursor = fields
+    action = _ACTIONS[head[1]]
+    if cursor:
+        # Курсор приходит от клиента: проверяем сразу, а не в запросе к БД
+        try:
+            _CURSOR_DECODERS.get(action, decode_cursor)(cursor)
+        except (ValueError, OverflowError):
+            raise ValueError(f"Повреждённый курсор в callback_data: {data!r}") from None
+    return CallbackData(action, from_base36(post_id) if post_id else None, origin or None, cursor or None)
+
+
+def _decode_legacy(data: str) -> CallbackData:
+    if data in _LEGACY_EXACT:
+        return CallbackData(_LEGACY_EXACT[data])
+    for prefix, action in _LEGACY:
+        if data.startswith(prefix):
+            return CallbackData(action, int(data[len(prefix):]))
+    raise ValueError(f"Неизвестный callback_data: {data!r}")
+
+
+class CallbackDataMiddleware(BaseMiddleware):
+    # Разбирает callback_data один раз и передаёт обработчикам в data["cb"]
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if isinstance(event, CallbackQuery):
+            try:
+                data["cb"] = decode_callback(event.data)
+            except ValueError:
+                logger.warning(f"Не удалось разобрать callback_data {event.data!r}")
+                await event.answer("Кнопка устарела, откройте раздел заново")
+                return None
+        return await handler(event, data)
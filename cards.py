@@ -0,0 +1,142 @@
+import html
+import logging
+from collections import Counter, OrderedDict
+from typing import NamedTuple, Optional
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from db import Database
+from events import POST_PUBLISHED, POST_DELETED, COMMENT_ADDED
+from callbacks import encode_callback, READ, DELETE, FEED, RANDOM, MY_POSTS, SEARCH, TRENDING, UNREAD
+
+logger = logging.getLogger(__name__)
+
+# Виды карточки поста
+FEED_CARD = "feed"      # превью в ленте
+RANDOM_CARD = "random"  # превью случайной истории
+MY_CARD = "my"          # превью в "Мои истории" (без HTML, с кнопкой удаления)
+SEARCH_CARD = "search"  # превью в результатах поиска
+TRENDING_CARD = "trending"  # превью в популярном
+UNREAD_CARD = "unread"  # превью в непрочитанном
+FULL_CARD = "full"      # полный текст после "Читать дальше"
+
+PREVIEW_LENGTH = 100
+PREVIEW_COMMENTS = 3
+FULL_COMMENTS = 5
+
+_ORIGINS = {FEED_CARD: FEED, RANDOM_CARD: RANDOM, MY_CARD: MY_POSTS, SEARCH_CARD: SEARCH, TRENDING_CARD: TRENDING,
+            UNREAD_CARD: UNREAD}
+
+
+class Card(NamedTuple):
+    text: str
+    image_id: Optional[str] = None
+    is_compressed: bool = False
+    keyboard: Optional[InlineKeyboardMarkup] = None
+
+
+def _comments_text(comments) -> str:
+    return "\n".join([f"@{c[0]}: {c[1]}" for c in comments]) if comments else "Нет комментариев"
+
+
+def build_card(view: str, post_id: int, title: str, content: str, username: Optional[str], comments,
+               image_id: Optional[str] = None, is_compressed: bool = False) -> Card:
+    if view != FULL_CARD and len(content) > PREVIEW_LENGTH:
+        content = content[:PREVIEW_LENGTH] + "..."
+    if view == MY_CARD:
+        text = f"📝 {title}\n{content}\nКомментарии:\n{_comments_text(comments)}"
+        keyboard = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Читать дальше", callback_data=encode_callback(READ, post_id, MY_POSTS)),
+             InlineKeyboardButton(text="Удалить", callback_data=encode_callback(DELETE, post_id))]
+        ])
+        return Card(text, keyboard=keyboard)
+
+    text = (f"📝 {html.escape(title)}\n{html.escape(content)}\n"
+            f"Автор: <a href='tg://user?id={post_id}'>@{html.escape(username)}</a>\n"
+            f"Комментарии:\n{_comments_text(comments)}")
+    if view == FULL_CARD:
+        # Кнопки полной карточки зависят от того, лайкнул ли пост читатель, их строит обработчик
+        return Card(text, image_id, bool(is_compressed))
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Читать дальше", callback_data=encode_callback(READ, post_id, _ORIGINS[view]))]
+    ])
+    return Card(text, keyboard=keyboard)
+
+
+class CardRenderer:
+    """Общий рендерер карточек постов с LRU-кэшем на max_size карточек.
+
+    Ключ кэша - (post_id, вид карточки). Карточка сбрасывается только по событиям,
+    которые меняют её содержимое: новый комментарий, одобрение и удаление поста.
+    Лайки в карточке не отображаются и кэш не сбрасывают.
+    """
+
+    def __init__(self, db: Database, max_size: int = 5000):
+        self.db = db
+        self.max_size = max_size
+        self.stats = Counter()
+        self._cache: "OrderedDict[tuple, Card]" = OrderedDict()
+        # Растёт при каждом сбросе: карточка, прочитанная до сброса, в кэш не попадает
+        self._seq = 0
+
+    def attach(self, events):
+        events.subscribe(POST_PUBLISHED, lambda post_id, **_: self.invalidate(post_id))
+        events.subscribe(POST_DELETED, lambda post_id, **_: self.invalidate(post_id))
+        events.subscribe(COMMENT_ADDED, lambda post_id, **_: self.invalidate(post_id))
+
+    def invalidate(self, post_id: int):
+        self._seq += 1
+        for view in (*_ORIGINS, FULL_CARD):
+            if self._cache.pop((post_id, view), None) is not None:
+                self.stats["invalidations"] += 1
+
+    def _lookup(self, key) -> Optional[Card]:
+        card = self._cache.get(key)
+        if card is None:
+            self.stats["misses"] += 1
+            return None
+        self._cache.move_to_end(key)
+        self.stats["hits"] += 1
+        return card
+
+    def _store(self, key, card: Card, seq: int):
+        if seq != self._seq:
+            return
+        self._cache[key] = card
+        if len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    async def render(self, post_id: int, view: str) -> Optional[Card]:
+        # Карточка одного поста; None - поста нет
+        key = (post_id, view)
+        card = self._lookup(key)
+        if card is not None:
+            return card
+        seq = self._seq
+        post = await self.db.get_post_with_author(post_id)
+        if not post:
+            return None
+        title, content, username, image_id, is_compressed = post
+        comments = await self.db.get_latest_comments(post_id, FULL_COMMENTS if view == FULL_CARD else PREVIEW_COMMENTS)
+        card = build_card(view, post_id, title, content, username, comments, image_id, is_compressed)
+        self._store(key, card, seq)
+        return card
+
+    async def render_page(self, view: str, rows) -> list:
+        # rows: [(post_id, title, content, username), ...] из страницы, загруженной без комментариев.
+        # Комментарии подгружаются одним запросом только для карточек, которых нет в кэше.
+        cards = {row[0]: self._lookup((row[0], view)) for row in rows}
+        missing = [row for row in rows if cards[row[0]] is None]
+        if missing:
+            seq = self._seq
+            comments = await self.db.get_latest_comments_many([row[0] for row in missing], PREVIEW_COMMENTS)
+            for post_id, title, content, username in missing:
+                cards[post_id] = build_card(view, post_id, title, content, username, comments[post_id])
+                self._store((post_id, view), cards[post_id], seq)
+        return [cards[row[0]] for row in rows]
+
+    def metrics(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = f"{self.stats['hits'] / lookups * 100:.1f}%" if lookups else "-"
+        return {**self.stats, "размер": len(self._cache), "попадания": hit_rate}
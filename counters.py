@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import sqlite3
+import sys
+from collections import Counter
+
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+# Фактические значения считаются из первичных данных. Чанк - диапазон id после курсора,
+# поэтому каждая транзакция короткая и не держит блокировку записи надолго.
+_POST_DRIFT = """
+SELECT p.post_id, p.likes, p.dislikes,
+       (SELECT COUNT(*) FROM reactions r WHERE r.post_id = p.post_id AND r.reaction = 'like'),
+       (SELECT COUNT(*) FROM reactions r WHERE r.post_id = p.post_id AND r.reaction = 'dislike')
+FROM (SELECT post_id, likes, dislikes FROM posts WHERE post_id > ? ORDER BY post_id LIMIT ?) p
+"""
+
+_USER_DRIFT = """
+SELECT u.user_id, u.posts_count, u.likes, u.dislikes,
+       (SELECT COUNT(*) FROM posts p WHERE p.user_id = u.user_id AND p.status = 'approved'),
+       (SELECT COUNT(*) FROM reactions r JOIN posts p ON p.post_id = r.post_id
+        WHERE p.user_id = u.user_id AND r.reaction = 'like'),
+       (SELECT COUNT(*) FROM reactions r JOIN posts p ON p.post_id = r.post_id
+        WHERE p.user_id = u.user_id AND r.reaction = 'dislike')
+FROM (SELECT user_id, posts_count, likes, dislikes FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?) u
+"""
+
+
+def reconcile_posts_chunk(conn, after_id: int, limit: int, repair: bool = True):
+    # -> (последний проверенный post_id или None, [(post_id, было, стало), ...])
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(_POST_DRIFT, (after_id, limit)).fetchall()
+        drift = [(post_id, (likes, dislikes), (real_likes, real_dislikes))
+                 for post_id, likes, dislikes, real_likes, real_dislikes in rows
+                 if (likes, dislikes) != (real_likes, real_dislikes)]
+        if repair and drift:
+            conn.executemany("UPDATE posts SET likes = ?, dislikes = ? WHERE post_id = ?",
+                             [(*real, post_id) for post_id, _, real in drift])
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return (max(row[0] for row in rows) if rows else None), drift
+
+
+def reconcile_users_chunk(conn, after_id: int, limit: int, repair: bool = True):
+    # -> (последний проверенный user_id или None, [(user_id, было, стало), ...])
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(_USER_DRIFT, (after_id, limit)).fetchall()
+        drift = [(row[0], row[1:4], row[4:7]) for row in rows if row[1:4] != row[4:7]]
+        if repair and drift:
+            conn.executemany("UPDATE users SET posts_count = ?, likes = ?, dislikes = ? WHERE user_id = ?",
+                             [(*real, user_id) for user_id, _, real in drift])
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return (max(row[0] for row in rows) if rows else None), drift
+
+
+class CounterReconciler:
+    """Фоновая сверка денормализованных счётчиков с reactions и posts.
+
+    Счётчики ведут триггеры (миграция counter_triggers); сверка находит и исправляет
+    расхождение, накопленное до них или после ручных правок базы. Проход идёт чанками
+    по chunk_size строк в потоке писателя с паузой между чанками, чтобы запись
+    обработчиков не ждала.
+    """
+
+    def __init__(self, db: Database, chunk_size: int = 500, pause: float = 0.05,
+                 interval: float = 24 * 3600, repair: bool = True):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.interval = interval
+        self.repair = repair
+        self.stats = Counter()
+        self._task = None
+
+    async def _sweep(self, chunk, kind: str) -> int:
+        after_id, fixed = -1, 0
+        while True:
+            last_id, drift = await self.db.run_sync_to_end(chunk, after_id, self.chunk_size, self.repair)
+            if last_id is None:
+                return fixed
+            self.stats["chunks"] += 1
+            for row_id, stored, actual in drift:
+                logger.warning(f"Расхождение счётчиков {kind} {row_id}: было {stored}, должно быть {actual}")
+            fixed += len(drift)
+            after_id = last_id
+            await asyncio.sleep(self.pause)
+
+    async def run_once(self) -> dict:
+        # Посты сверяются раньше авторов: счётчики авторов считаются по реакциям на их посты
+        report = {"posts": await self._sweep(reconcile_posts_chunk, "posts"),
+                  "users": await self._sweep(reconcile_users_chunk, "users")}
+        self.stats["runs"] += 1
+        self.stats["posts_drift"] += report["posts"]
+        self.stats["users_drift"] += report["users"]
+        logger.info(f"Сверка счётчиков: расхождений в постах {report['posts']}, у пользователей {report['users']}")
+        return report
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Ошибка сверки счётчиков")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        # Дожидается текущего чанка, чтобы база не закрылась под ним
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+if __name__ == "__main__":
+    # Отчёт о расхождениях без исправления: python counters.py database.db
+    # С исправлением: python counters.py database.db --repair
+    logging.basicConfig(level=logging.INFO)
+    path = sys.argv[1] if len(sys.argv) > 1 else 'database.db'
+    repair = "--repair" in sys.argv
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    for name, chunk in (("постов", reconcile_posts_chunk), ("пользователей", reconcile_users_chunk)):
+        after_id, total = -1, 0
+        while after_id is not None:
+            after_id, drift = chunk(connection, after_id, 1000, repair)
+            for row_id, stored, actual in drift:
+                logger.info(f"{row_id}: было {stored}, должно быть {actual}")
+            total += len(drift)
+        logger.info(f"Расхождений у {name}: {total}" + (" (исправлено)" if repair else ""))
+    connection.close()
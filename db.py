@@ -0,0 +1,567 @@
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from events import EventBus, POST_PUBLISHED, POST_DELETED, POST_LIKED, COMMENT_ADDED, USER_STATUS_CHANGED
+from pagination import keyset_query, build_page, encode_rank_cursor, decode_rank_cursor, encode_search_cursor, decode_search_cursor
+from trending import bump_scores, PUBLISH_WEIGHT, LIKE_WEIGHT, COMMENT_WEIGHT
+
+logger = logging.getLogger(__name__)
+
+# Профиль PRAGMA по умолчанию: WAL позволяет читателям не блокировать писателя
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -16000,  # в КиБ (отрицательное значение), ~16 МБ на соединение
+    'mmap_size': 128 * 1024 * 1024,
+    'busy_timeout': 5000,  # мс
+}
+
+
+# Больше любого символа в порядке BINARY: prefix + _MAX_CHAR - верхняя граница слов с префиксом
+_MAX_CHAR = chr(0x10FFFF)
+
+
+class PostPage(NamedTuple):
+    posts: list
+    comments: dict  # post_id -> [(username, content), ...], новые сверху
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+
+
+class RankedPage(NamedTuple):
+    # Страница поиска, популярного или непрочитанного
+    posts: list  # [(post_id, title, content, username), ...] от лучших к худшим
+    next_cursor: Optional[str]
+
+
+class Database:
+    """Асинхронный слой доступа к SQLite.
+
+    Запись идёт через одно соединение в отдельном потоке, чтение - через пул
+    соединений только для чтения. Цикл событий aiogram не блокируется.
+    """
+
+    def __init__(self, path: str, readers: int = 4, pragmas: dict = None):
+        self.path = path
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._read_executor = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-reader")
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._conn = None
+        # Уведомления об изменениях для кэшей в памяти
+        self.events = EventBus()
+
+    def _apply_pragmas(self, conn, read_only=False):
+        for name, value in self.pragmas.items():
+            # journal_mode хранится в файле БД, менять его может только писатель
+            if read_only and name == 'journal_mode':
+                continue
+            conn.execute(f"PRAGMA {name} = {value}")
+        if read_only:
+            conn.execute("PRAGMA query_only = 1")
+
+    def _reader_conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+            self._apply_pragmas(conn, read_only=True)
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    async def _write(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def _read(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, func, *args)
+
+    def _fetchone(self, query, params=()):
+        return self._reader_conn().execute(query, params).fetchone()
+
+    def _fetchall(self, query, params=()):
+        return self._reader_conn().execute(query, params).fetchall()
+
+    def _execute(self, query, params=()):
+        c = self._conn.execute(query, params)
+        self._conn.commit()
+        return c
+
+    async def connect(self):
+        def _connect():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._apply_pragmas(self._conn)
+        await self._write(_connect)
+        logger.info(f"База данных {self.path} подключена ({self.pragmas['journal_mode']})")
+
+    async def run_sync(self, func, *args):
+        # Выполняет func(conn, *args) в потоке писателя
+        return await self._write(func, self._conn, *args)
+
+    async def run_sync_to_end(self, func, *args):
+        # Как run_sync, но отмена вызывающей задачи дожидается конца func: поток писателя
+        # не прерывается, и фоновая задача не должна завершиться раньше своего запроса
+        future = asyncio.ensure_future(self.run_sync(func, *args))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([future])
+            raise
+
+    async def close(self):
+        if self._conn is not None:
+            await self._write(self._conn.close)
+            self._conn = None
+        self._read_executor.shutdown(wait=True)
+        self._executor.shutdown(wait=True)
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+
+    # --- Пользователи ---
+
+    async def user_exists(self, user_id: int) -> bool:
+        return await self._read(self._fetchone, "SELECT 1 FROM users WHERE user_id = ?", (user_id,)) is not None
+
+    async def create_user(self, user_id: int, username: str, is_admin: int):
+        await self._write(self._execute,
+                        "INSERT INTO users (user_id, username, is_admin, joined_at) VALUES (?, ?, ?, ?)",
+                        (user_id, username, is_admin, datetime.now().isoformat()))
+        self.events.publish(USER_STATUS_CHANGED, user_id=user_id, is_blocked=False, is_admin=bool(is_admin))
+
+    async def get_profile(self, user_id: int):
+        return await self._read(self._fetchone,
+                               "SELECT name, about, last_profile_edit, username FROM users WHERE user_id = ?",
+                               (user_id,))
+
+    async def update_profile(self, user_id: int, name: str, about: str):
+        await self._write(self._execute,
+                        "UPDATE users SET name = ?, about = ?, last_profile_edit = ? WHERE user_id = ?",
+                        (name, about, datetime.now().isoformat(), user_id))
+
+    async def get_user_stats(self, user_id: int):
+        return await self._read(self._fetchone,
+                               "SELECT posts_count, likes FROM users WHERE user_id = ?", (user_id,))
+
+    async def get_admin_ids(self):
+        rows = await self._read(self._fetchall, "SELECT user_id FROM users WHERE is_admin = 1")
+        return [row[0] for row in rows]
+
+    async def block_user(self, username: str):
+        # Возвращает user_id заблокированного пользователя или None
+        def _block():
+            c = self._conn.execute("UPDATE users SET is_blocked = 1 WHERE username = ?", (username,))
+            if c.rowcount == 0:
+                return None
+            row = self._conn.execute("SELECT user_id FROM users WHERE username = ?", (username,)).fetchone()
+            self._conn.commit()
+            return row[0]
+        user_id = await self._write(_block)
+        if user_id is not None:
+            self.events.publish(USER_STATUS_CHANGED, user_id=user_id, is_blocked=True)
+        return user_id
+
+    async def unblock_user(self, username: str):
+        def _unblock():
+            row = self._conn.execute("SELECT user_id FROM users WHERE username = ?", (username,)).fetchone()
+            if not row:
+                return None
+            self._conn.execute("UPDATE users SET is_blocked = 0 WHERE username = ?", (username,))
+            self._conn.commit()
+            return row[0]
+        user_id = await self._write(_unblock)
+        if user_id is not None:
+            self.events.publish(USER_STATUS_CHANGED, user_id=user_id, is_blocked=False)
+        return user_id
+
+    async def get_blocked_ids(self):
+        rows = await self._read(self._fetchall, "SELECT user_id FROM users WHERE is_blocked = 1")
+        return [row[0] for row in rows]
+
+    async def get_blocked_usernames(self):
+        rows = await self._read(self._fetchall, "SELECT username FROM users WHERE is_blocked = 1")
+        return [row[0] for row in rows]
+
+    # --- Настройки ---
+
+    async def get_settings(self):
+        return await self._read(self._fetchall, "SELECT key, value FROM settings")
+
+    async def set_setting(self, key: str, value):
+        await self._write(self._execute, "UPDATE settings SET value = ? WHERE key = ?", (value, key))
+
+    # --- Посты ---
+
+    async def has_pending_posts(self, user_id: int) -> bool:
+        row = await self._read(self._fetchone,
+                              "SELECT COUNT(*) FROM posts WHERE user_id = ? AND status IN ('pending', 'returned')",
+                              (user_id,))
+        return row[0] > 0
+
+    async def get_last_post_time(self, user_id: int):
+        row = await self._read(self._fetchone, "SELECT MAX(created_at) FROM posts WHERE user_id = ?", (user_id,))
+        return row[0]
+
+    async def create_post(self, user_id: int, title: str, content: str, image_id, is_compressed: bool,
+                          status: str) -> int:
+        created_at = datetime.now().isoformat()
+
+        def _create():
+            try:
+                c = self._conn.execute(
+                    "INSERT INTO posts (user_id, title, content, image_id, is_compressed, created_at, status) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (user_id, title, content, image_id, 1 if is_compressed else 0, created_at, status))
+                if status == 'approved':
+                    bump_scores(self._conn, [(c.lastrowid, PUBLISH_WEIGHT)])
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            return c.lastrowid
+        post_id = await self._write(_create)
+        if status == 'approved':
+            self.events.publish(POST_PUBLISHED, post_id=post_id, user_id=user_id, created_at=created_at)
+        return post_id
+
+    def _comments_for(self, post_ids, limit):
+        # Последние limit комментариев к каждому посту одним запросом: post_id -> [(username, content), ...]
+        comments = {post_id: [] for post_id in post_ids}
+        if comments and limit:
+            placeholders = ", ".join("?" * len(comments))
+            query = ("SELECT post_id, username, content FROM ("
+                     "SELECT post_id, username, content, "
+                     "ROW_NUMBER() OVER (PARTITION BY post_id ORDER BY created_at DESC) AS rn "
+                     f"FROM comments WHERE post_id IN ({placeholders})"
+                     ") WHERE rn <= ? ORDER BY post_id, rn")
+            for post_id, username, content in self._reader_conn().execute(query, (*comments, limit)):
+                comments[post_id].append((username, content))
+        return comments
+
+    def _load_page(self, query, params, limit, comments_limit, cursor, backward):
+        # Страница постов по курсору (LIMIT + 1 вместо COUNT) и последние комментарии ко всем постам
+        # одним запросом (comments_limit=0 - без комментариев). Последний столбец строки - created_at,
+        # первый - post_id.
+        conn = self._reader_conn()
+        query, cursor_params = keyset_query(query, cursor, backward)
+        rows = conn.execute(query, (*params, *cursor_params, limit + 1)).fetchall()
+        page = build_page(rows, limit, cursor, backward, key=lambda row: (row[-1], row[0]))
+        comments = self._comments_for([row[0] for row in page.rows], comments_limit)
+        return PostPage(page.rows, comments, page.next_cursor, page.prev_cursor)
+
+    async def get_user_posts_page(self, user_id: int, cursor: str = None, backward: bool = False,
+                                  limit: int = 10, comments_limit: int = 3) -> "PostPage":
+        return await self._read(self._load_page,
+                                "SELECT post_id, title, content, status, created_at FROM posts "
+                                "WHERE user_id = ? AND status = 'approved'",
+                                (user_id,), limit, comments_limit, cursor, backward)
+
+    async def get_feed_page(self, cursor: str = None, backward: bool = False,
+                            limit: int = 10, comments_limit: int = 3) -> "PostPage":
+        return await self._read(self._load_page,
+                                "SELECT post_id, title, content, username, image_id, created_at FROM posts p "
+                                "JOIN users u ON p.user_id = u.user_id WHERE status = 'approved'",
+                                (), limit, comments_limit, cursor, backward)
+
+    def _feed_keys(self, cursor, limit):
+        query, params = keyset_query("SELECT post_id, created_at FROM posts WHERE status = 'approved'", cursor)
+        return self._reader_conn().execute(query, (*params, limit)).fetchall()
+
+    async def get_feed_keys(self, cursor: str = None, limit: int = 500):
+        # [(post_id, created_at), ...] ленты после курсора - только по индексу, без текста постов
+        return await self._read(self._feed_keys, cursor, limit)
+
+    async def get_feed_posts(self, post_ids) -> list:
+        # [(post_id, title, content, username), ...] одобренных постов в порядке post_ids
+        if not post_ids:
+            return []
+        placeholders = ", ".join("?" * len(post_ids))
+        rows = await self._read(self._fetchall,
+                                "SELECT p.post_id, p.title, p.content, u.username FROM posts p "
+                                f"JOIN users u ON p.user_id = u.user_id WHERE p.post_id IN ({placeholders}) "
+                                # "+" не даёт планировщику взять индекс по status вместо поиска по post_id
+                                "AND +p.status = 'approved'", list(post_ids))
+        by_id = {row[0]: row for row in rows}
+        return [by_id[post_id] for post_id in post_ids if post_id in by_id]
+
+    # --- Просмотренные посты ---
+
+    async def get_seen(self, user_id: int) -> Optional[bytes]:
+        row = await self._read(self._fetchone, "SELECT bitmap FROM user_seen WHERE user_id = ?", (user_id,))
+        return row[0] if row else None
+
+    async def save_seen(self, rows):
+        # [(user_id, bitmap), ...] одной транзакцией
+        def _save():
+            try:
+                now = datetime.now().isoformat()
+                self._conn.executemany("INSERT OR REPLACE INTO user_seen (user_id, bitmap, updated_at) "
+                                       "VALUES (?, ?, ?)", [(user_id, bitmap, now) for user_id, bitmap in rows])
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        await self._write(_save)
+
+    # --- Сводки авторам ---
+
+    async def get_digest_interval(self, user_id: int) -> Optional[int]:
+        # Период сводки в минутах (0 - сводки выключены) или None - по умолчанию
+        row = await self._read(self._fetchone, "SELECT interval_minutes FROM digest_settings WHERE user_id = ?",
+                               (user_id,))
+        return row[0] if row else None
+
+    async def get_digest_intervals(self, user_ids) -> dict:
+        # user_id -> период в минутах для пользователей, изменивших настройку
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        placeholders = ", ".join("?" * len(user_ids))
+        return dict(await self._read(self._fetchall, "SELECT user_id, interval_minutes FROM digest_settings "
+                                                     f"WHERE user_id IN ({placeholders})", user_ids))
+
+    async def set_digest_interval(self, user_id: int, minutes: int):
+        await self._write(self._execute, "INSERT OR REPLACE INTO digest_settings (user_id, interval_minutes) "
+                                         "VALUES (?, ?)", (user_id, minutes))
+
+    async def get_post_titles(self, post_ids) -> dict:
+        # post_id -> title одобренных постов
+        post_ids = list(post_ids)
+        if not post_ids:
+            return {}
+        placeholders = ", ".join("?" * len(post_ids))
+        return dict(await self._read(self._fetchall, "SELECT post_id, title FROM posts "
+                                                     f"WHERE post_id IN ({placeholders}) AND +status = 'approved'",
+                                                     post_ids))
+
+    def _search(self, match, cursor, limit, window):
+        # Лучшие совпадения первыми (BM25 отрицателен, меньше - лучше), заголовок весит вдвое больше текста.
+        # Ранжируются только window самых новых совпадений: FTS5 отдаёт их потоком по rowid, а оценка
+        # всех совпадений частого слова на миллионе постов занимает секунды. С posts соединяется только страница.
+        # Окно закрепляется на первой странице границами post_id: посты, опубликованные позже, в эту
+        # выдачу не попадают. Страницы идут по курсору (оценка, post_id). Оценки BM25 зависят от
+        # статистики всего индекса и сдвигаются с каждым новым постом, поэтому оценка последнего
+        # показанного поста пересчитывается по текущему индексу, и граница страницы сдвигается вместе
+        # с остальными оценками. Если этот пост удалён, граница - оценка из курсора.
+        conn = self._reader_conn()
+        score_query = "SELECT rowid, bm25(posts_fts, 2.0, 1.0) AS score FROM posts_fts WHERE posts_fts MATCH ? "
+        if cursor:
+            max_post_id, min_post_id, score, post_id = decode_search_cursor(cursor)
+            window_query = f"{score_query}AND rowid BETWEEN ? AND ?"
+            row = conn.execute(f"{window_query} AND rowid = ?", (match, min_post_id, max_post_id, post_id)).fetchone()
+            window_query = (f"SELECT rowid, score, ? AS low FROM ({window_query}) "
+                            "WHERE (score, rowid) > (?, ?)")
+            params = [min_post_id, match, min_post_id, max_post_id, row[1] if row else score, post_id]
+        else:
+            max_post_id = conn.execute("SELECT IFNULL(MAX(post_id), 0) FROM posts").fetchone()[0]
+            # Нижняя граница окна - самый старый из ранжируемых постов
+            window_query = (f"SELECT rowid, score, MIN(rowid) OVER () AS low FROM ("
+                            f"{score_query}AND rowid <= ? ORDER BY rowid DESC LIMIT ?)")
+            params = [match, max_post_id, window]
+        query = ("SELECT p.post_id, p.title, p.content, u.username, f.score, f.low FROM ("
+                 f"{window_query} ORDER BY score, rowid LIMIT ?"
+                 ") f JOIN posts p ON p.post_id = f.rowid JOIN users u ON u.user_id = p.user_id "
+                 "WHERE p.status = 'approved' ORDER BY f.score, f.rowid")
+        rows = conn.execute(query, (*params, limit + 1)).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_search_cursor(max_post_id, last[5], last[4], last[0])
+        return RankedPage([row[:4] for row in rows[:limit]], next_cursor)
+
+    def _index_terms(self, prefixes, limit):
+        query = "SELECT term FROM posts_fts_vocab WHERE term >= ? AND term < ? LIMIT ?"
+        return {prefix: [row[0] for row in self._reader_conn().execute(query, (prefix, prefix + _MAX_CHAR, limit))]
+                for prefix in prefixes}
+
+    async def get_index_terms(self, prefixes, limit: int = 5000) -> dict:
+        # prefix -> [слова поискового индекса, начинающиеся с prefix], не больше limit на префикс
+        return await self._read(self._index_terms, list(prefixes), limit)
+
+    async def search_posts(self, match: str, cursor: str = None, limit: int = 5, window: int = 5000) -> RankedPage:
+        # match - запрос на языке FTS5 (см. search.to_match_query)
+        return await self._read(self._search, match, cursor, limit, window)
+
+    def _trending(self, cursor, limit):
+        params = []
+        keyset = ""
+        if cursor:
+            keyset = "WHERE (score, post_id) < (?, ?) "
+            params = list(decode_rank_cursor(cursor))
+        query = ("SELECT p.post_id, p.title, p.content, u.username, s.score FROM ("
+                 f"SELECT post_id, score FROM post_scores {keyset}ORDER BY score DESC, post_id DESC LIMIT ?"
+                 ") s JOIN posts p ON p.post_id = s.post_id JOIN users u ON u.user_id = p.user_id "
+                 "ORDER BY s.score DESC, s.post_id DESC")
+        rows = self._reader_conn().execute(query, (*params, limit + 1)).fetchall()
+        next_cursor = encode_rank_cursor(rows[limit - 1][4], rows[limit - 1][0]) if len(rows) > limit else None
+        return RankedPage([row[:4] for row in rows[:limit]], next_cursor)
+
+    async def get_trending_page(self, cursor: str = None, limit: int = 10) -> RankedPage:
+        # Популярное по индексу оценок (см. trending.py), курсор - (оценка, post_id) последнего поста
+        return await self._read(self._trending, cursor, limit)
+
+    async def get_approved_post_likes(self):
+        return await self._read(self._fetchall, "SELECT post_id, likes FROM posts WHERE status = 'approved'")
+
+    async def get_post_with_author(self, post_id: int):
+        return await self._read(self._fetchone,
+                               "SELECT title, content, username, image_id, is_compressed FROM posts p "
+                               "JOIN users u ON p.user_id = u.user_id WHERE post_id = ?", (post_id,))
+
+    async def get_own_post(self, post_id: int, user_id: int):
+        return await self._read(self._fetchone,
+                               "SELECT title, content, image_id, is_compressed FROM posts "
+                               "WHERE post_id = ? AND user_id = ?", (post_id, user_id))
+
+    async def get_approved_post_author(self, post_id: int):
+        row = await self._read(self._fetchone,
+                              "SELECT user_id FROM posts WHERE post_id = ? AND status = 'approved'", (post_id,))
+        return row[0] if row else None
+
+    async def get_post_author_title(self, post_id: int):
+        # (user_id, title) или None
+        return await self._read(self._fetchone, "SELECT user_id, title FROM posts WHERE post_id = ?", (post_id,))
+
+    async def delete_post(self, post_id: int) -> bool:
+        # False - поста уже нет (удалён другим нажатием); тогда и события нет
+        c = await self._write(self._execute, "DELETE FROM posts WHERE post_id = ?", (post_id,))
+        if not c.rowcount:
+            return False
+        self.events.publish(POST_DELETED, post_id=post_id)
+        return True
+
+    async def get_user_moderation_posts(self, user_id: int):
+        return await self._read(self._fetchall,
+                               "SELECT post_id, title, content, status FROM posts WHERE user_id = ? "
+                               "AND status IN ('pending', 'returned') ORDER BY created_at DESC", (user_id,))
+
+    async def get_returned_post(self, post_id: int, user_id: int):
+        return await self._read(self._fetchone,
+                               "SELECT title, content FROM posts WHERE post_id = ? AND user_id = ? "
+                               "AND status = 'returned'", (post_id, user_id))
+
+    async def get_pending_page(self, cursor: str = None, backward: bool = False, limit: int = 8) -> "PostPage":
+        # Очередь модерации от старых постов к новым, по индексу (status, created_at, post_id)
+        return await self._read(self._load_page,
+                                "SELECT post_id, title, content, username, image_id, created_at FROM posts p "
+                                "JOIN users u ON p.user_id = u.user_id WHERE status = 'pending'",
+                                (), limit, 0, cursor, backward)
+
+    async def get_moderation_queue(self):
+        # (число постов на модерации, created_at самого старого или None)
+        return await self._read(self._fetchone,
+                               "SELECT COUNT(*), MIN(created_at) FROM posts WHERE status = 'pending'")
+
+    async def moderate_posts(self, post_ids, status: str) -> list:
+        # Решение по пакету постов ('approved' или 'returned') одной транзакцией. Меняются только
+        # посты, которые ещё ждут модерации: другой администратор мог успеть их рассмотреть.
+        # Возвращает [(post_id, user_id, title), ...] изменённых постов.
+        post_ids = list(post_ids)
+        if not post_ids:
+            return []
+
+        def _moderate():
+            placeholders = ", ".join("?" * len(post_ids))
+            try:
+                # "+" - поиск по post_id, а не обход всей очереди по индексу статуса
+                rows = self._conn.execute("SELECT post_id, user_id, title, created_at FROM posts "
+                                          f"WHERE post_id IN ({placeholders}) AND +status = 'pending'",
+                                          post_ids).fetchall()
+                self._conn.executemany("UPDATE posts SET status = ? WHERE post_id = ?",
+                                       [(status, row[0]) for row in rows])
+                if status == 'approved':
+                    bump_scores(self._conn, [(row[0], PUBLISH_WEIGHT) for row in rows])
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            return rows
+        rows = await self._write(_moderate)
+        if status == 'approved':
+            # Пост встаёт в ленту по времени создания, а не одобрения
+            for post_id, user_id, _, created_at in rows:
+                self.events.publish(POST_PUBLISHED, post_id=post_id, user_id=user_id, created_at=created_at)
+        return [(post_id, user_id, title) for post_id, user_id, title, _ in rows]
+
+    async def get_recent_approved(self, limit: int = 5):
+        return await self._read(self._fetchall,
+                               "SELECT post_id, title, username FROM posts p JOIN users u ON p.user_id = u.user_id "
+                               "WHERE status = 'approved' ORDER BY created_at DESC LIMIT ?", (limit,))
+
+    # --- Комментарии и реакции ---
+
+    async def get_latest_comments(self, post_id: int, limit: int = 3):
+        return await self._read(self._fetchall,
+                               "SELECT username, content FROM comments WHERE post_id = ? "
+                               "ORDER BY created_at DESC LIMIT ?", (post_id, limit))
+
+    async def get_latest_comments_many(self, post_ids, limit: int = 3):
+        return await self._read(self._comments_for, list(post_ids), limit)
+
+    async def add_comment(self, post_id: int, user_id: int, username: str, content: str):
+        def _comment():
+            try:
+                self._conn.execute("INSERT INTO comments (post_id, user_id, username, content, created_at) "
+                                   "VALUES (?, ?, ?, ?, ?)", (post_id, user_id, username, content, datetime.now().isoformat()))
+                bump_scores(self._conn, [(post_id, COMMENT_WEIGHT)])
+                author = self._conn.execute("SELECT user_id FROM posts WHERE post_id = ?", (post_id,)).fetchone()
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            return author[0] if author else None
+        author_id = await self._write(_comment)
+        self.events.publish(COMMENT_ADDED, post_id=post_id, user_id=user_id, author_id=author_id)
+
+    async def get_reaction(self, user_id: int, post_id: int):
+        row = await self._read(self._fetchone,
+                              "SELECT reaction FROM reactions WHERE user_id = ? AND post_id = ?", (user_id, post_id))
+        return row[0] if row else None
+
+    async def add_likes(self, likes) -> list:
+        # Пакет [(user_id, post_id), ...] одной транзакцией: повторные лайки пропускает
+        # INSERT OR IGNORE. Триггер реакций на время пакета выключен (миграция counter_bypass):
+        # прибавки сводятся в один UPDATE на пост и один на автора. Оценки популярного -
+        # bump_scores в той же транзакции. Возвращает реально добавленные лайки.
+        def _like():
+            added = []
+            try:
+                self._conn.execute("INSERT INTO counter_bypass (flag) VALUES (1)")
+                for user_id, post_id in likes:
+                    if self._conn.execute("INSERT OR IGNORE INTO reactions (user_id, post_id, reaction) "
+                                          "VALUES (?, ?, 'like')", (user_id, post_id)).rowcount:
+                        added.append((user_id, post_id))
+                per_post = Counter(post_id for _, post_id in added)
+                placeholders = ", ".join("?" * len(per_post))
+                authors = dict(self._conn.execute(f"SELECT post_id, user_id FROM posts WHERE post_id IN ({placeholders})",
+                                                  list(per_post)).fetchall()) if per_post else {}
+                per_author = Counter()
+                for post_id, count in per_post.items():
+                    if post_id in authors:
+                        per_author[authors[post_id]] += count
+                self._conn.executemany("UPDATE posts SET likes = likes + ? WHERE post_id = ?",
+                                       [(count, post_id) for post_id, count in per_post.items()])
+                self._conn.executemany("UPDATE users SET likes = likes + ? WHERE user_id = ?",
+                                       [(count, user_id) for user_id, count in per_author.items()])
+                self._conn.execute("DELETE FROM counter_bypass")
+                bump_scores(self._conn, [(post_id, LIKE_WEIGHT) for _, post_id in added])
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+            return added, authors
+        added, authors = await self._write(_like)
+        for user_id, post_id in added:
+            self.events.publish(POST_LIKED, post_id=post_id, user_id=user_id, author_id=authors.get(post_id))
+        return added
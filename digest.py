@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from events import POST_LIKED, COMMENT_ADDED
+from notifications import NotificationQueue, insert_notifications
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 60  # минут
+# Варианты настройки в профиле: текст кнопки -> период в минутах, 0 - без сводок
+INTERVALS = {"Сводка раз в час": 60, "Сводка раз в день": 24 * 60, "Без сводок": 0}
+MAX_LINES = 10
+
+
+def _plural(n: int, one: str, few: str, many: str) -> str:
+    if n % 10 == 1 and n % 100 != 11:
+        return one
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return few
+    return many
+
+
+def digest_text(posts: Dict[int, List[int]], titles: Dict[int, str]) -> Optional[str]:
+    # posts: post_id -> [лайки, комментарии]; None - все посты удалены или сняты с публикации
+    lines = []
+    ranked = sorted((post_id for post_id in posts if post_id in titles), key=lambda p: -sum(posts[p]))
+    for post_id in ranked[:MAX_LINES]:
+        likes, comments = posts[post_id]
+        parts = []
+        if likes:
+            parts.append(f"+{likes} ❤️")
+        if comments:
+            parts.append(f"{comments} {_plural(comments, 'новый комментарий', 'новых комментария', 'новых комментариев')}")
+        lines.append(f"{', '.join(parts)} к «{titles[post_id]}»")
+    if not lines:
+        return None
+    if len(ranked) > MAX_LINES:
+        lines.append(f"...и ещё историй: {len(ranked) - MAX_LINES}")
+    return "Новое у ваших историй:\n" + "\n".join(lines)
+
+
+def load_checkpoint(conn) -> list:
+    return conn.execute("SELECT author_id, post_id, likes, comments, since FROM digest_pending").fetchall()
+
+
+def save_checkpoint(conn, rows):
+    # Полный снимок накопленного в памяти одной транзакцией
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM digest_pending")
+        conn.executemany("INSERT INTO digest_pending (author_id, post_id, likes, comments, since) "
+                         "VALUES (?, ?, ?, ?, ?)", rows)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def commit_digests(conn, notifications, author_ids):
+    # Сводки попадают в очередь уведомлений в той же транзакции, в которой их активность уходит
+    # из контрольной точки: после сбоя сводка не теряется и не уходит второй раз
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        insert_notifications(conn, notifications)
+        conn.executemany("DELETE FROM digest_pending WHERE author_id = ?", [(author_id,) for author_id in author_ids])
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+class _Activity:
+    __slots__ = ("since", "posts")
+
+    def __init__(self, since: datetime):
+        self.since = since
+        # post_id -> [лайки, комментарии]
+        self.posts: Dict[int, List[int]] = {}
+
+
+class DigestAggregator:
+    """Сводки авторам о лайках и комментариях к их историям.
+
+    Событие только увеличивает счётчик в памяти: author_id -> post_id -> [лайки, комментарии].
+    Раз в tick секунд авторам, у которых с первого события прошёл их период (настройка в
+    профиле, по умолчанию default_interval минут), уходит одна сводка на все истории через
+    очередь уведомлений - вместо сообщения на каждый лайк. Собственные лайки и комментарии
+    автора не учитываются. Накопленное пишется в digest_pending раз в checkpoint_interval
+    секунд и при остановке, поэтому перезапуск теряет не больше этого интервала событий.
+    """
+
+    def __init__(self, db, notifications: NotificationQueue, default_interval: int = DEFAULT_INTERVAL,
+                 tick: float = 60, checkpoint_interval: float = 60):
+        self.db = db
+        self.notifications = notifications
+        self.default_interval = default_interval
+        self.tick = tick
+        self.checkpoint_interval = checkpoint_interval
+        self.stats = Counter()
+        self._pending: Dict[int, _Activity] = {}
+        self._dirty = False
+        self._checkpointed_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    def attach(self, events):
+        events.subscribe(POST_LIKED, lambda post_id, user_id, author_id=None, **_:
+                         self.add(author_id, user_id, post_id, likes=1))
+        events.subscribe(COMMENT_ADDED, lambda post_id, user_id, author_id=None, **_:
+                         self.add(author_id, user_id, post_id, comments=1))
+
+    def add(self, author_id: Optional[int], actor_id: int, post_id: int, likes: int = 0, comments: int = 0):
+        if author_id is None or author_id == actor_id:
+            return
+        activity = self._pending.get(author_id)
+        if activity is None:
+            activity = self._pending[author_id] = _Activity(datetime.now())
+        counts = activity.posts.setdefault(post_id, [0, 0])
+        counts[0] += likes
+        counts[1] += comments
+        self.stats["events"] += likes + comments
+        self._dirty = True
+
+    async def load(self):
+        # Активность, накопленная до перезапуска
+        for author_id, post_id, likes, comments, since in await self.db.run_sync(load_checkpoint):
+            activity = self._pending.setdefault(author_id, _Activity(datetime.fromisoformat(since)))
+            activity.posts[post_id] = [likes, comments]
+        logger.info(f"Сводки: загружена активность {len(self._pending)} авторов")
+
+    async def run_once(self, now: datetime = None) -> int:
+        # Отправляет созревшие сводки; возвращает их число
+        now = now or datetime.now()
+        async with self._lock:
+            intervals = await self.db.get_digest_intervals(self._pending)
+            due = {}
+            for author_id, activity in list(self._pending.items()):
+                interval = intervals.get(author_id, self.default_interval)
+                if interval == 0:
+                    # Сводки выключены - накопленное не нужно
+                    self.stats["dropped"] += sum(map(sum, activity.posts.values()))
+                    del self._pending[author_id]
+                    self._dirty = True
+                elif activity.since + timedelta(minutes=interval) <= now:
+                    due[author_id] = self._pending.pop(author_id)
+            if not due:
+                return 0
+            self._dirty = True
+            titles = await self.db.get_post_titles({post_id for activity in due.values() for post_id in activity.posts})
+            rows = []
+            for author_id, activity in due.items():
+                text = digest_text(activity.posts, titles)
+                if text is not None:
+                    # Ключ не даст поставить ту же сводку дважды
+                    rows.append((author_id, text, f"digest:{author_id}:{activity.since.isoformat()}"))
+                    self.stats["included"] += sum(map(sum, activity.posts.values()))
+            try:
+                await self.db.run_sync(commit_digests, rows, list(due))
+            except BaseException:
+                # Вернём активность; события, пришедшие за время записи, добавятся к ней
+                for author_id, activity in due.items():
+                    self._merge(author_id, activity)
+                raise
+            self.notifications.wake()
+            self.stats["digests"] += len(rows)
+            return len(rows)
+
+    def _merge(self, author_id: int, activity: _Activity):
+        current = self._pending.get(author_id)
+        if current is None:
+            self._pending[author_id] = activity
+            return
+        current.since = min(current.since, activity.since)
+        for post_id, (likes, comments) in activity.posts.items():
+            counts = current.posts.setdefault(post_id, [0, 0])
+            counts[0] += likes
+            counts[1] += comments
+
+    async def checkpoint(self):
+        async with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            rows = [(author_id, post_id, likes, comments, activity.since.isoformat())
+                    for author_id, activity in self._pending.items()
+                    for post_id, (likes, comments) in activity.posts.items()]
+            try:
+                await self.db.run_sync(save_checkpoint, rows)
+            except BaseException:
+                self._dirty = True
+                raise
+            self._checkpointed_at = time.monotonic()
+            self.stats["checkpoints"] += 1
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            try:
+                await self.run_once()
+                if time.monotonic() - self._checkpointed_at >= self.checkpoint_interval:
+                    await self.checkpoint()
+            except Exception:
+                logger.exception("Ошибка отправки сводок")
+
+    def metrics(self) -> dict:
+        # Без сводок каждое событие было бы отдельным сообщением
+        saved = self.stats["included"] - self.stats["digests"]
+        return {**self.stats, "сэкономлено вызовов": saved, "авторов ждут": len(self._pending)}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.checkpoint()
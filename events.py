@@ -0,0 +1,28 @@
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+# События изменения данных, на которые подписываются кэши и индексы в памяти
+POST_PUBLISHED = "post_published"  # post_id, user_id, created_at
+POST_DELETED = "post_deleted"      # post_id
+POST_LIKED = "post_liked"          # post_id, user_id, author_id
+COMMENT_ADDED = "comment_added"    # post_id, user_id, author_id
+USER_STATUS_CHANGED = "user_status_changed"  # user_id, is_blocked=None, is_admin=None
+SETTING_CHANGED = "setting_changed"  # key, value
+
+
+class EventBus:
+    def __init__(self):
+        self._subscribers = defaultdict(list)
+
+    def subscribe(self, event: str, callback):
+        self._subscribers[event].append(callback)
+
+    def publish(self, event: str, **payload):
+        # Подписчики вызываются синхронно в цикле событий; ошибка одного не мешает остальным
+        for callback in self._subscribers[event]:
+            try:
+                callback(**payload)
+            except Exception:
+                logger.exception(f"Ошибка подписчика события {event}")
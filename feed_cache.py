@@ -0,0 +1,84 @@
+import asyncio
+import logging
+from collections import Counter
+from typing import Dict, Optional
+
+from db import Database, PostPage
+from events import POST_PUBLISHED, POST_DELETED
+
+logger = logging.getLogger(__name__)
+
+
+class FeedPageCache:
+    """Общий кэш первых pages страниц ленты.
+
+    Первые страницы ленты одинаковы для всех пользователей, поэтому хранятся в памяти
+    под номером версии ленты. Публикация, одобрение и удаление поста увеличивают
+    версию, и следующий запрос читает страницы заново. Одновременные промахи по одной
+    странице ждут один запрос к БД (single-flight) вместо того, чтобы повторять его.
+
+    Кэшируются страницы, до которых можно дойти от первой по next_cursor; курсоры
+    глубже pages-й страницы идут прямо в БД.
+    """
+
+    def __init__(self, db: Database, pages: int = 5):
+        self.db = db
+        self.pages = pages
+        self.stats = Counter()
+        self.version = 0
+        # cursor -> страница текущей версии; None - первая страница
+        self._pages: Dict[Optional[str], PostPage] = {}
+        # cursor -> номер страницы (0 - первая) для курсоров первых pages страниц
+        self._depth: Dict[Optional[str], int] = {None: 0}
+        self._inflight: Dict[tuple, asyncio.Task] = {}
+
+    def attach(self, events):
+        events.subscribe(POST_PUBLISHED, lambda **_: self.invalidate())
+        events.subscribe(POST_DELETED, lambda **_: self.invalidate())
+
+    def invalidate(self):
+        self.version += 1
+        self._pages.clear()
+        self._depth = {None: 0}
+        self.stats["invalidations"] += 1
+
+    async def get_page(self, cursor: Optional[str] = None) -> PostPage:
+        depth = self._depth.get(cursor)
+        if depth is None:
+            self.stats["bypass"] += 1
+            return await self.db.get_feed_page(cursor, comments_limit=0)
+        page = self._pages.get(cursor)
+        if page is not None:
+            self.stats["hits"] += 1
+            return page
+
+        key = (self.version, cursor)
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["misses"] += 1
+            task = self._inflight[key] = asyncio.ensure_future(self._load(key, cursor, depth))
+            # Ошибку получат ожидающие; если их нет, asyncio не должен ругаться на неполученное исключение
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    async def _load(self, key: tuple, cursor: Optional[str], depth: int) -> PostPage:
+        # Загрузка - отдельная задача: отмена обработчика, который её начал, не отменяет
+        # запрос для остальных ожидающих
+        try:
+            page = await self.db.get_feed_page(cursor, comments_limit=0)
+        finally:
+            del self._inflight[key]
+        # Лента могла измениться, пока шёл запрос: такую страницу отдаём, но не кэшируем
+        if key[0] == self.version:
+            self._pages[cursor] = page
+            if page.next_cursor and depth + 1 < self.pages:
+                self._depth[page.next_cursor] = depth + 1
+        return page
+
+    def metrics(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        served = self.stats["hits"] + self.stats["coalesced"]
+        hit_rate = f"{served / lookups * 100:.1f}%" if lookups else "-"
+        return {**self.stats, "версия": self.version, "страниц": len(self._pages), "из памяти": hit_rate}
@@ -0,0 +1,318 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+# Отсутствующее поле в отложенной записи (state=None - это допустимое значение)
+_MISSING = object()
+_EMPTY_DATA = "{}"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key TEXT PRIMARY KEY,
+    state TEXT,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fsm_states_updated ON fsm_states(updated_at);
+"""
+
+_UPSERT_STATE = ("INSERT INTO fsm_states (key, state, updated_at) VALUES (?, ?, ?) "
+                 "ON CONFLICT(key) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at")
+_UPSERT_DATA = ("INSERT INTO fsm_states (key, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at")
+_UPSERT_BOTH = ("INSERT INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+                "updated_at = excluded.updated_at")
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище aiogram в отдельном файле SQLite.
+
+    Черновики историй, ожидание комментария и курсоры ленты переживают перезапуск.
+    Состояния, не менявшиеся ttl секунд, удаляются.
+
+    Несколько процессов могут работать с одним файлом (WAL). При shared=True чтение
+    всегда идёт в БД, а запись возвращает управление только после коммита: следующий
+    апдейт пользователя, попавший в другой процесс, видит состояние. Одновременные
+    записи разных пользователей попадают в одну транзакцию, но каждая запись ждёт
+    её коммита. Если процесс один, shared=False отдаёт запись сразу: изменения
+    копятся в памяти и сбрасываются одной транзакцией раз в flush_interval секунд
+    или при batch_size ключах, повторные записи одного ключа схлопываются, а
+    прочитанные состояния кэшируются. Цена - до flush_interval последних изменений
+    при аварийном завершении процесса.
+    """
+
+    def __init__(self, path: str = "fsm.db", key_builder: Optional[KeyBuilder] = None,
+                 flush_interval: float = 0.05, batch_size: int = 500, ttl: float = 7 * 24 * 3600,
+                 evict_interval: float = 3600, shared: bool = True, max_cached: int = 10000):
+        self.path = path
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.ttl = ttl
+        self.evict_interval = evict_interval
+        self.shared = shared
+        self.max_cached = max_cached
+        self.stats = Counter()
+        # key -> {"state": ..., "data": json} - ещё не записанные изменения
+        self._pending: Dict[str, dict] = {}
+        # Изменения, которые сейчас пишутся в БД; читаются, пока запись не завершится
+        self._flushing: Dict[str, dict] = {}
+        # key -> (state, data) - только при shared=False
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-writer")
+        self._reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-reader")
+        self._local = threading.local()
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        self._flush_seq = 0
+        self._flush_lock = asyncio.Lock()
+        self._timer = None
+        self._urgent = False
+        self._tasks = set()
+        self._evict_task = None
+
+    # --- Соединения (по одному на поток исполнителя) ---
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA busy_timeout = 5000")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    async def _run(self, executor, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, func, *args)
+
+    # --- Чтение ---
+
+    def _select(self, key: str):
+        row = self._conn().execute("SELECT state, data FROM fsm_states WHERE key = ? AND updated_at >= ?",
+                                   (key, time.time() - self.ttl)).fetchone()
+        return row if row else (None, _EMPTY_DATA)
+
+    async def _load(self, key: str, field: str):
+        # Сначала несброшенные изменения, затем кэш процесса, затем БД
+        for changes in (self._pending, self._flushing):
+            entry = changes.get(key)
+            if entry is not None and entry[field] is not _MISSING:
+                return entry[field]
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            self.stats["cache_hits"] += 1
+            return self._cache[key][0 if field == "state" else 1]
+        self.stats["reads"] += 1
+        seq = self._flush_seq
+        record = await self._run(self._reader, self._select, key)
+        # Кэшируем, только если за время чтения ничего не сбрасывалось (иначе снимок мог устареть)
+        if not self.shared and seq == self._flush_seq:
+            self._remember(key, *record)
+        return record[0 if field == "state" else 1]
+
+    def _remember(self, key: str, state, data: str):
+        # Несброшенные изменения новее прочитанного из БД
+        for changes in (self._flushing, self._pending):
+            entry = changes.get(key)
+            if entry is not None:
+                state = state if entry["state"] is _MISSING else entry["state"]
+                data = data if entry["data"] is _MISSING else entry["data"]
+        self._cache[key] = (state, data)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._load(self.key_builder.build(key), "state")
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return json.loads(await self._load(self.key_builder.build(key), "data"))
+
+    # --- Запись ---
+
+    def _stage(self, key: str, field: str, value):
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = self._pending[key] = {"state": _MISSING, "data": _MISSING}
+        elif entry[field] is not _MISSING:
+            self.stats["coalesced"] += 1
+        entry[field] = value
+        self.stats["writes"] += 1
+        if key in self._cache:
+            state, data = self._cache[key]
+            self._cache[key] = (value, data) if field == "state" else (state, value)
+
+        if not self.shared:
+            # В общем режиме запись сбрасывает сам _write
+            self._schedule_flush(0 if len(self._pending) >= self.batch_size else self.flush_interval)
+        if self._evict_task is None and self.ttl:
+            self._evict_task = asyncio.create_task(self._evict_loop())
+
+    async def _write(self, key: str, field: str, value):
+        self._stage(key, field, value)
+        if self.shared:
+            # Другие процессы читают только БД: запись должна попасть туда до конца обработчика
+            try:
+                await self._flush()
+            except Exception:
+                # Изменение остаётся в памяти процесса и будет записано фоновым повтором
+                self._schedule_flush(max(self.flush_interval, 1.0))
+                raise
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._write(self.key_builder.build(key), "state", state.state if isinstance(state, State) else state)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(f"Data must be a dict or dict-like object, got {type(data).__name__}")
+        await self._write(self.key_builder.build(key), "data", json.dumps(data, ensure_ascii=False))
+
+    def _schedule_flush(self, delay: float):
+        if delay <= 0:
+            # Один внеочередной сброс на пакет, а не на каждую запись сверх batch_size
+            if not self._urgent:
+                self._urgent = True
+                self._spawn(self.flush())
+        elif self._timer is None or self._timer.done():
+            self._timer = self._spawn(self._flush_later(delay))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    def _write_batch(self, batch: Dict[str, dict]):
+        conn = self._conn()
+        now = time.time()
+        params = {_UPSERT_STATE: [], _UPSERT_DATA: [], _UPSERT_BOTH: []}
+        for key, entry in batch.items():
+            state, data = entry["state"], entry["data"]
+            if data is _MISSING:
+                params[_UPSERT_STATE].append((key, state, now))
+            elif state is _MISSING:
+                params[_UPSERT_DATA].append((key, data, now))
+            else:
+                params[_UPSERT_BOTH].append((key, state, data, now))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for query, rows in params.items():
+                if rows:
+                    conn.executemany(query, rows)
+            # Пустые записи (после state.clear()) не храним
+            conn.executemany("DELETE FROM fsm_states WHERE key = ? AND state IS NULL AND data = '{}'",
+                             ((key,) for key in batch))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def flush(self):
+        # Сбрасывает накопленные изменения; при ошибке пакет остаётся в памяти до повтора
+        try:
+            await self._flush()
+        except Exception:
+            logger.exception(f"Не удалось записать FSM-состояния ({len(self._pending)}), повторим позже")
+            self._schedule_flush(max(self.flush_interval, 1.0))
+
+    async def _flush(self):
+        # Пишет накопленные изменения одной транзакцией; ошибку пробрасывает
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._urgent = False
+            self._flushing = batch
+            try:
+                await self._run(self._writer, self._write_batch, batch)
+                self.stats["flushes"] += 1
+                self.stats["flushed_keys"] += len(batch)
+            except BaseException:
+                # Возвращаем неудачный пакет (и при отмене задачи - запись могла не завершиться),
+                # не затирая более новые изменения; повторная запись тех же значений безвредна
+                for key, entry in batch.items():
+                    newer = self._pending.setdefault(key, entry)
+                    if newer is not entry:
+                        for field in ("state", "data"):
+                            if newer[field] is _MISSING:
+                                newer[field] = entry[field]
+                raise
+            finally:
+                self._flushing = {}
+                self._flush_seq += 1
+
+    # --- Удаление простаивающих состояний ---
+
+    def _delete_expired(self) -> int:
+        conn = self._conn()
+        c = conn.execute("DELETE FROM fsm_states WHERE updated_at < ?", (time.time() - self.ttl,))
+        return c.rowcount
+
+    async def evict_expired(self) -> int:
+        evicted = await self._run(self._writer, self._delete_expired)
+        # Кэш процесса мог держать удалённые ключи - сбрасываем его целиком
+        self._cache.clear()
+        self.stats["evicted"] += evicted
+        if evicted:
+            logger.info(f"Удалено простаивающих FSM-состояний: {evicted}")
+        return evicted
+
+    async def _evict_loop(self):
+        while True:
+            try:
+                await self.evict_expired()
+            except Exception:
+                logger.exception("Ошибка при удалении устаревших FSM-состояний")
+            await asyncio.sleep(self.evict_interval)
+
+    async def close(self, retries: int = 3, retry_delay: float = 0.5) -> None:
+        tasks = [task for task in (*self._tasks, self._evict_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        self._timer = self._evict_task = None
+        # Последний сброс с повторами; что не удалось записать - в лог поимённо
+        for attempt in range(retries + 1):
+            try:
+                await self._flush()
+                break
+            except Exception:
+                logger.exception(f"Не удалось записать FSM-состояния при остановке, попытка {attempt + 1}")
+                if attempt < retries:
+                    await asyncio.sleep(retry_delay * 2 ** attempt)
+        if self._pending:
+            self.stats["lost"] += len(self._pending)
+            logger.error(f"Потеряны несохранённые FSM-состояния ({len(self._pending)}): "
+                         f"{', '.join(sorted(self._pending))}")
+            self._pending = {}
+        self._reader.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
+        with self._conns_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
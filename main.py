@@ -1,44 +1,148 @@
-import asyncio
-import logging
-from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
-import sqlite3
-
-from system import setup_handlers as system_handlers, setup_database
-from user import setup_handlers as user_handlers
-from feed import setup_handlers as feed_handlers
-from admin import setup_handlers as admin_handlers
-from random_post import setup_handlers as random_handlers
-
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-# Инициализация бота с вашим токеном
-TOKEN = 'TOKEN'
-bot = Bot(token=TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-
-async def main():
-    # Инициализация базы данных
-    conn = sqlite3.connect('database.db')
-    setup_database(conn)
-
-    # Подключение обработчиков из модулей
-    system_handlers(dp, conn, bot)
-    user_handlers(dp, conn, bot)
-    feed_handlers(dp, conn, bot)
-    admin_handlers(dp, conn, bot)
-    random_handlers(dp, conn, bot)
-
-    try:
-        logger.info("Бот StoryGram запущен!")
-        await dp.start_polling(bot)
-    finally:
-        await dp.storage.close()
-        await bot.session.close()
-        conn.close()
-
-if __name__ == "__main__":
+import asyncio
+import logging
+from aiogram import Bot, Dispatcher
+
+from db import Database
+from counters import CounterReconciler
+from trending import ScorePruner
+from cards import CardRenderer
+from feed_cache import FeedPageCache
+from prefetch import PagePrefetcher
+from seen import SeenTracker
+from notifications import NotificationQueue
+from digest import DigestAggregator
+from fsm_storage import SQLiteStorage
+from settings import Settings
+from metrics import Metrics
+from middlewares import setup_middlewares
+from ordering import UserOrderMiddleware
+from reactions import ReactionBuffer
+from routing import Routes
+from sender import SendScheduler, CurrentChatMiddleware
+from webhook import run_webhook
+from system import setup_handlers as system_handlers, setup_database
+from user import setup_handlers as user_handlers
+from feed import setup_handlers as feed_handlers
+from admin import setup_handlers as admin_handlers
+from random_post import setup_handlers as random_handlers
+from search import setup_handlers as search_handlers
+
+# Настройка логирования
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Инициализация бота с вашим токеном
+TOKEN = 'TOKEN'
+
+# Режим получения апдейтов: 'polling' или 'webhook'
+MODE = 'polling'
+WEBHOOK_URL = 'https://example.com'  # публичный адрес, на который Telegram шлёт апдейты
+WEBHOOK_SECRET = 'SECRET'  # секрет из заголовка X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = '0.0.0.0'
+WEBHOOK_PORT = 8080
+WEBHOOK_WORKERS = 16
+
+bot = Bot(token=TOKEN)
+# Состояния FSM (черновики, ввод комментария) хранятся в SQLite и переживают перезапуск
+storage = SQLiteStorage('fsm.db')
+dp = Dispatcher(storage=storage)
+
+async def main():
+    # Инициализация базы данных
+    db = Database('database.db')
+    await db.connect()
+    await db.run_sync(setup_database)
+    settings = Settings(db)
+    await settings.load()
+
+    # Все исходящие запросы идут через планировщик с лимитами Telegram
+    scheduler = SendScheduler()
+    bot.session.middleware(scheduler)
+    dp.update.outer_middleware(CurrentChatMiddleware())
+
+    # Апдейты одного пользователя обрабатываются по порядку, разных - параллельно
+    user_order = UserOrderMiddleware()
+    dp.update.outer_middleware(user_order)
+
+    metrics = Metrics()
+    metrics.register("Очередь апдейтов", user_order.metrics)
+    metrics.register("Отправка", lambda: {**scheduler.stats, "в очереди": scheduler.queue_depth()})
+    metrics.register("FSM", lambda: storage.stats)
+
+    # Лайки копятся в памяти и пишутся в БД пакетами
+    reactions = ReactionBuffer(db)
+    metrics.register("Лайки", reactions.metrics)
+
+    # Счётчики лайков и постов ведут триггеры; фоновая сверка исправляет расхождения
+    reconciler = CounterReconciler(db)
+    metrics.register("Счётчики", lambda: reconciler.stats)
+    # Оценки популярного обновляются вместе с лайками и комментариями, затухшие посты чистятся фоном
+    pruner = ScorePruner(db)
+    metrics.register("Популярное", lambda: pruner.stats)
+
+    # Готовые карточки постов общие для ленты, случайной истории и профиля
+    cards = CardRenderer(db)
+    cards.attach(db.events)
+    metrics.register("Карточки", cards.metrics)
+    # Первые страницы ленты общие для всех пользователей
+    feed_cache = FeedPageCache(db)
+    feed_cache.attach(db.events)
+    metrics.register("Лента", feed_cache.metrics)
+    # Следующая страница "Загрузить ещё" готовится заранее
+    prefetcher = PagePrefetcher()
+    metrics.register("Предзагрузка", prefetcher.metrics)
+    # Просмотренные посты для режима "Непрочитанное"
+    seen = SeenTracker(db)
+    seen.attach(db.events)
+    metrics.register("Просмотры", seen.metrics)
+    # Уведомления пишутся в таблицу notification_outbox и отправляются фоном с повторами
+    notifications = NotificationQueue(db, bot)
+    metrics.register("Уведомления", notifications.metrics)
+    # Лайки и комментарии к историям приходят авторам одной сводкой за период
+    digests = DigestAggregator(db, notifications)
+    digests.attach(db.events)
+    await digests.load()
+    metrics.register("Сводки авторам", digests.metrics)
+
+    # Статусы пользователей проверяются до обработчиков
+    setup_middlewares(dp, db)
+
+    # Подключение обработчиков из модулей: все маршруты собираются в одну таблицу
+    routes = Routes()
+    system_handlers(dp, routes, db, bot, settings)
+    user_handlers(dp, routes, db, bot, settings, cards, prefetcher, notifications)
+    feed_handlers(dp, routes, db, bot, reactions, cards, feed_cache, prefetcher, seen)
+    admin_handlers(dp, routes, db, bot, settings, metrics, notifications)
+    random_handlers(dp, routes, db, bot, cards, seen)
+    search_handlers(dp, routes, db, bot, cards)
+    routes.setup(dp)
+
+    try:
+        reconciler.start()
+        pruner.start()
+        notifications.start()
+        digests.start()
+        logger.info("Бот StoryGram запущен!")
+        if MODE == 'webhook':
+            await run_webhook(dp, bot, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_URL,
+                              workers=WEBHOOK_WORKERS, metrics=metrics)
+        else:
+            await dp.start_polling(bot)
+    finally:
+        # Дорабатываем апдейты, переданные в очереди пользователей
+        await user_order.close()
+        prefetcher.close()
+        # Последние лайки из буфера ещё попадут в контрольную точку сводок
+        await reactions.close()
+        await digests.close()
+        await notifications.close()
+        await seen.close()
+        await pruner.close()
+        await reconciler.close()
+        await scheduler.close()
+        await dp.storage.close()
+        await bot.session.close()
+        await db.close()
+
+if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
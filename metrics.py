@@ -0,0 +1,40 @@
+import logging
+from typing import Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class Metrics:
+    """Реестр счётчиков компонентов бота.
+
+    Компонент регистрирует функцию, возвращающую словарь текущих значений;
+    значения собираются только при запросе отчёта.
+    """
+
+    def __init__(self):
+        self._sources: Dict[str, Callable[[], dict]] = {}
+
+    def register(self, name: str, source: Callable[[], dict]):
+        self._sources[name] = source
+
+    def snapshot(self) -> Dict[str, dict]:
+        result = {}
+        for name, source in self._sources.items():
+            try:
+                result[name] = dict(source())
+            except Exception:
+                logger.exception(f"Не удалось собрать метрики {name}")
+        return result
+
+    def format(self) -> str:
+        lines = []
+        for name, values in self.snapshot().items():
+            lines.append(f"[{name}]")
+            lines.extend(f"  {key}: {_format_value(value)}" for key, value in values.items())
+        return "\n".join(lines) or "Метрик пока нет"
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        return f"{value:.1f}"
+    return str(value)
@@ -0,0 +1,86 @@
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import TelegramObject, Message, CallbackQuery, InlineQuery
+
+from db import Database
+from callbacks import CallbackDataMiddleware
+from events import USER_STATUS_CHANGED
+
+logger = logging.getLogger(__name__)
+
+BLOCKED_TEXT = "Администрация StoryGram заблокировала вас."
+
+
+class UserStatusCache:
+    """Флаги is_blocked / is_admin всех пользователей в памяти.
+
+    Хранятся только id с установленным флагом: заблокированных и администраторов
+    единицы, поэтому объём не зависит от общего числа пользователей.
+    """
+
+    def __init__(self):
+        self._blocked = set()
+        self._admins = set()
+
+    def attach(self, events):
+        events.subscribe(USER_STATUS_CHANGED, self.update)
+
+    async def load(self, db: Database):
+        self._blocked = set(await db.get_blocked_ids())
+        self._admins = set(await db.get_admin_ids())
+        logger.info(f"Статусы пользователей: {len(self._blocked)} заблокированных, {len(self._admins)} админов")
+
+    def update(self, user_id: int, is_blocked: bool = None, is_admin: bool = None):
+        if is_blocked is not None:
+            (self._blocked.add if is_blocked else self._blocked.discard)(user_id)
+        if is_admin is not None:
+            (self._admins.add if is_admin else self._admins.discard)(user_id)
+
+    def is_blocked(self, user_id: int) -> bool:
+        return user_id in self._blocked
+
+    def is_admin(self, user_id: int) -> bool:
+        return user_id in self._admins
+
+
+class UserStatusMiddleware(BaseMiddleware):
+    # Отсекает заблокированных до обработчиков и передаёт is_admin в данные обработчика
+    def __init__(self, cache: UserStatusCache):
+        self.cache = cache
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        if self.cache.is_blocked(user.id):
+            if isinstance(event, Message):
+                await event.answer(BLOCKED_TEXT)
+            elif isinstance(event, CallbackQuery):
+                await event.answer(BLOCKED_TEXT, show_alert=True)
+            elif isinstance(event, InlineQuery):
+                # Пустой ответ только этому пользователю, иначе Telegram отдаст ему чужой кеш
+                await event.answer([], cache_time=60, is_personal=True)
+            return None
+        data["is_admin"] = self.cache.is_admin(user.id)
+        return await handler(event, data)
+
+
+def setup_middlewares(dp: Dispatcher, db: Database):
+    user_status = UserStatusCache()
+    user_status.attach(db.events)
+    middleware = UserStatusMiddleware(user_status)
+    dp.message.outer_middleware(middleware)
+    dp.callback_query.outer_middleware(middleware)
+    dp.inline_query.outer_middleware(middleware)
+    dp.callback_query.outer_middleware(CallbackDataMiddleware())
+
+    @dp.startup()
+    async def load_user_status():
+        await user_status.load(db)
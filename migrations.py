@@ -0,0 +1,394 @@
+import logging
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+from trending import seed_scores
+
+logger = logging.getLogger(__name__)
+
+
+def _baseline(conn):
+    # Исходная схема StoryGram. IF NOT EXISTS позволяет принять существующие базы без изменений
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        name TEXT,
+        about TEXT,
+        rating INTEGER DEFAULT 0,
+        posts_count INTEGER DEFAULT 0,
+        likes INTEGER DEFAULT 0,
+        dislikes INTEGER DEFAULT 0,
+        last_profile_edit TIMESTAMP,
+        is_blocked INTEGER DEFAULT 0,
+        is_admin INTEGER DEFAULT 0,
+        joined_at TIMESTAMP
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS posts (
+        post_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        title TEXT,
+        content TEXT,
+        image_id TEXT,
+        is_compressed INTEGER DEFAULT 0,
+        created_at TIMESTAMP,
+        likes INTEGER DEFAULT 0,
+        dislikes INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'pending',
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS comments (
+        comment_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        post_id INTEGER,
+        user_id INTEGER,
+        username TEXT,
+        content TEXT,
+        created_at TIMESTAMP,
+        FOREIGN KEY (post_id) REFERENCES posts(post_id),
+        FOREIGN KEY (user_id) REFERENCES users(user_id)
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )''')
+
+    conn.execute('''CREATE TABLE IF NOT EXISTS reactions (
+        user_id INTEGER,
+        post_id INTEGER,
+        reaction TEXT,
+        PRIMARY KEY (user_id, post_id),
+        FOREIGN KEY (user_id) REFERENCES users(user_id),
+        FOREIGN KEY (post_id) REFERENCES posts(post_id)
+    )''')
+
+    default_settings = [
+        ('welcome_message', 'Добро пожаловать в StoryGram!'),
+        ('rules', 'Правила StoryGram:\n1. Только 18+\n2. Без спама\n3. Уважайте других\nStoryGram хранит заполненную вами информацию о себе.'),
+        ('info', 'StoryGram - мини-социальная сеть для историй с вашими историями'),
+        ('moderation_enabled', '0'),
+        ('post_delay', '5')
+    ]
+    conn.executemany('INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)', default_settings)
+    conn.execute("INSERT OR IGNORE INTO users (user_id, username, is_admin, joined_at) VALUES (?, ?, ?, ?)",
+                 (000000000, "admin", 1, datetime.now().isoformat()))
+
+
+# Денормализованные счётчики ведёт сама БД: posts.likes/dislikes - реакции на пост,
+# users.likes/dislikes - реакции на все посты автора, users.posts_count - одобренные посты.
+# Уже накопленное расхождение исправляет counters.CounterReconciler.
+_COUNTER_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS trg_reactions_insert AFTER INSERT ON reactions BEGIN
+        UPDATE posts SET likes = likes + (NEW.reaction = 'like'),
+                         dislikes = dislikes + (NEW.reaction = 'dislike')
+        WHERE post_id = NEW.post_id;
+        UPDATE users SET likes = likes + (NEW.reaction = 'like'),
+                         dislikes = dislikes + (NEW.reaction = 'dislike')
+        WHERE user_id = (SELECT user_id FROM posts WHERE post_id = NEW.post_id);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_reactions_delete AFTER DELETE ON reactions BEGIN
+        UPDATE posts SET likes = likes - (OLD.reaction = 'like'),
+                         dislikes = dislikes - (OLD.reaction = 'dislike')
+        WHERE post_id = OLD.post_id;
+        UPDATE users SET likes = likes - (OLD.reaction = 'like'),
+                         dislikes = dislikes - (OLD.reaction = 'dislike')
+        WHERE user_id = (SELECT user_id FROM posts WHERE post_id = OLD.post_id);
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_posts_insert_approved AFTER INSERT ON posts
+    WHEN NEW.status = 'approved' BEGIN
+        UPDATE users SET posts_count = posts_count + 1 WHERE user_id = NEW.user_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_posts_status AFTER UPDATE OF status ON posts
+    WHEN (OLD.status = 'approved') != (NEW.status = 'approved') BEGIN
+        UPDATE users SET posts_count = posts_count + (NEW.status = 'approved') - (OLD.status = 'approved')
+        WHERE user_id = NEW.user_id;
+    END''',
+    # Пост к этому моменту уже удалён: реакции на него снимаются со счётчиков автора здесь,
+    # а trg_reactions_delete не находит ни поста, ни автора
+    '''CREATE TRIGGER IF NOT EXISTS trg_posts_delete AFTER DELETE ON posts BEGIN
+        UPDATE users SET likes = likes - OLD.likes,
+                         dislikes = dislikes - OLD.dislikes,
+                         posts_count = posts_count - (OLD.status = 'approved')
+        WHERE user_id = OLD.user_id;
+        DELETE FROM reactions WHERE post_id = OLD.post_id;
+    END''',
+]
+
+
+# Полнотекстовый индекс одобренных постов. Таблица без содержимого (content=''): текст
+# хранится только в posts, в индекс попадает нормализованная копия (ё -> е), поэтому
+# удаление из индекса передаёт те же нормализованные значения.
+_FTS_TEXT = "replace(replace({0}, 'ё', 'е'), 'Ё', 'Е')"
+
+# Посты, существовавшие до миграции, индексирует backfill_search_index чанками после неё;
+# пока строка в search_backfill есть, триггеры пропускают ещё не пройденные посты
+# (done, upto] - их текущую версию возьмёт сам backfill.
+_FTS_READY = "NOT EXISTS (SELECT 1 FROM search_backfill WHERE {0} > done AND {0} <= upto)"
+
+_SEARCH_INDEX = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+        title, content, content='', tokenize='unicode61 remove_diacritics 2')""",
+    "CREATE TABLE IF NOT EXISTS search_backfill (done INTEGER NOT NULL, upto INTEGER NOT NULL)",
+    f'''CREATE TRIGGER IF NOT EXISTS trg_posts_fts_insert AFTER INSERT ON posts
+    WHEN NEW.status = 'approved' AND {_FTS_READY.format("NEW.post_id")} BEGIN
+        INSERT INTO posts_fts (rowid, title, content)
+        VALUES (NEW.post_id, {_FTS_TEXT.format("NEW.title")}, {_FTS_TEXT.format("NEW.content")});
+    END''',
+    # Сначала старая версия удаляется из индекса, затем добавляется новая - в одном триггере,
+    # чтобы порядок был определён
+    f'''CREATE TRIGGER IF NOT EXISTS trg_posts_fts_update AFTER UPDATE OF status, title, content ON posts
+    WHEN (OLD.status = 'approved' OR NEW.status = 'approved') AND {_FTS_READY.format("NEW.post_id")} BEGIN
+        INSERT INTO posts_fts (posts_fts, rowid, title, content)
+        SELECT 'delete', OLD.post_id, {_FTS_TEXT.format("OLD.title")}, {_FTS_TEXT.format("OLD.content")}
+        WHERE OLD.status = 'approved';
+        INSERT INTO posts_fts (rowid, title, content)
+        SELECT NEW.post_id, {_FTS_TEXT.format("NEW.title")}, {_FTS_TEXT.format("NEW.content")}
+        WHERE NEW.status = 'approved';
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS trg_posts_fts_delete AFTER DELETE ON posts
+    WHEN OLD.status = 'approved' AND {_FTS_READY.format("OLD.post_id")} BEGIN
+        INSERT INTO posts_fts (posts_fts, rowid, title, content)
+        VALUES ('delete', OLD.post_id, {_FTS_TEXT.format("OLD.title")}, {_FTS_TEXT.format("OLD.content")});
+    END''',
+]
+
+
+def rebuild_search_index(conn):
+    # Полная перестройка индекса из posts (после сбоя или ручных правок базы); незаконченный
+    # backfill больше не нужен
+    conn.execute("DELETE FROM search_backfill")
+    conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('delete-all')")
+    conn.execute(f"INSERT INTO posts_fts (rowid, title, content) "
+                 f"SELECT post_id, {_FTS_TEXT.format('title')}, {_FTS_TEXT.format('content')} "
+                 f"FROM posts WHERE status = 'approved'")
+    conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('optimize')")
+
+
+def _search_index(conn):
+    # В транзакции миграции только схема; сами посты - backfill_search_index
+    for statement in _SEARCH_INDEX:
+        conn.execute(statement)
+    conn.execute("INSERT INTO search_backfill (done, upto) SELECT 0, IFNULL(MAX(post_id), 0) FROM posts")
+
+
+def backfill_search_index(conn, chunk: int = 2000) -> int:
+    # Индексирует посты, существовавшие до миграции search_index, по chunk post_id за транзакцию,
+    # чтобы блокировка записи не держалась на всё время построения. Продолжает с места остановки.
+    indexed = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT done, upto FROM search_backfill").fetchone()
+            if row is None:
+                conn.commit()
+                return indexed
+            done, upto = row
+            last = min(done + chunk, upto)
+            indexed += conn.execute(
+                f"INSERT INTO posts_fts (rowid, title, content) "
+                f"SELECT post_id, {_FTS_TEXT.format('title')}, {_FTS_TEXT.format('content')} "
+                f"FROM posts WHERE post_id > ? AND post_id <= ? AND status = 'approved'", (done, last)).rowcount
+            if last >= upto:
+                conn.execute("DELETE FROM search_backfill")
+            else:
+                conn.execute("UPDATE search_backfill SET done = ?", (last,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+
+# Популярное: оценка одобренного поста (см. trending.py). Пост уходит из таблицы вместе
+# с одобрением или удалением; оценки добавляет Database в тех же транзакциях, что и события.
+_POST_SCORES = [
+    """CREATE TABLE IF NOT EXISTS post_scores (
+        post_id INTEGER PRIMARY KEY,
+        score REAL NOT NULL
+    )""",
+    # Лента популярного: ORDER BY score DESC, post_id DESC; чистка: WHERE score < ? ORDER BY score
+    "CREATE INDEX IF NOT EXISTS idx_post_scores_score ON post_scores(score, post_id)",
+    '''CREATE TRIGGER IF NOT EXISTS trg_post_scores_unapprove AFTER UPDATE OF status ON posts
+    WHEN OLD.status = 'approved' AND NEW.status != 'approved' BEGIN
+        DELETE FROM post_scores WHERE post_id = OLD.post_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS trg_post_scores_delete AFTER DELETE ON posts BEGIN
+        DELETE FROM post_scores WHERE post_id = OLD.post_id;
+    END''',
+]
+
+
+# Исходящие уведомления (см. notifications.py): строка живёт, пока не доставлена или не признана
+# мёртвой; доставленные хранятся сутки ради ключей дедупликации.
+_NOTIFICATION_OUTBOX = [
+    """CREATE TABLE IF NOT EXISTS notification_outbox (
+        id INTEGER PRIMARY KEY,
+        chat_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        dedup_key TEXT UNIQUE,
+        status TEXT NOT NULL DEFAULT 'pending',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP NOT NULL,
+        next_attempt_at TIMESTAMP NOT NULL,
+        last_error TEXT
+    )""",
+    # Выборка к отправке: WHERE status = 'pending' AND next_attempt_at <= ?; чистка доставленных
+    "CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON notification_outbox(status, next_attempt_at)",
+]
+
+
+def _notification_outbox(conn):
+    for statement in _NOTIFICATION_OUTBOX:
+        conn.execute(statement)
+
+
+# Сводки авторам (см. digest.py): период сводки пользователя и контрольная точка накопленной
+# в памяти активности - переживает перезапуск с потерей не больше интервала между точками.
+_AUTHOR_DIGESTS = [
+    "CREATE TABLE IF NOT EXISTS digest_settings (user_id INTEGER PRIMARY KEY, interval_minutes INTEGER NOT NULL)",
+    """CREATE TABLE IF NOT EXISTS digest_pending (
+        author_id INTEGER NOT NULL,
+        post_id INTEGER NOT NULL,
+        likes INTEGER NOT NULL,
+        comments INTEGER NOT NULL,
+        since TIMESTAMP NOT NULL,
+        PRIMARY KEY (author_id, post_id)
+    )""",
+]
+
+
+def _author_digests(conn):
+    for statement in _AUTHOR_DIGESTS:
+        conn.execute(statement)
+
+
+# Пакет лайков из ReactionBuffer обновляет счётчики сам - одним UPDATE на пост и автора
+# вместо двух на каждую реакцию (Database.add_likes). На время пакета в counter_bypass лежит
+# строка, и триггер вставки реакции пропускает свои UPDATE; строка удаляется в той же
+# транзакции, поэтому другие соединения её не видят.
+_COUNTER_BYPASS = [
+    "CREATE TABLE IF NOT EXISTS counter_bypass (flag INTEGER PRIMARY KEY)",
+    "DROP TRIGGER IF EXISTS trg_reactions_insert",
+    '''CREATE TRIGGER trg_reactions_insert AFTER INSERT ON reactions
+    WHEN NOT EXISTS (SELECT 1 FROM counter_bypass) BEGIN
+        UPDATE posts SET likes = likes + (NEW.reaction = 'like'),
+                         dislikes = dislikes + (NEW.reaction = 'dislike')
+        WHERE post_id = NEW.post_id;
+        UPDATE users SET likes = likes + (NEW.reaction = 'like'),
+                         dislikes = dislikes + (NEW.reaction = 'dislike')
+        WHERE user_id = (SELECT user_id FROM posts WHERE post_id = NEW.post_id);
+    END''',
+]
+
+
+def _counter_bypass(conn):
+    for statement in _COUNTER_BYPASS:
+        conn.execute(statement)
+
+
+def _post_scores(conn):
+    for statement in _POST_SCORES:
+        conn.execute(statement)
+    seed_scores(conn)
+
+
+def _counter_triggers(conn):
+    # executescript сам завершает транзакцию, поэтому триггеры создаются по одному
+    for statement in _COUNTER_TRIGGERS:
+        conn.execute(statement)
+
+
+# Каждый индекс - отдельная миграция: блокировка записи держится только на время
+# построения одного индекса, а читатели в режиме WAL продолжают работать.
+MIGRATIONS = [
+    (1, "baseline", _baseline),
+    # Лента: WHERE status = 'approved' ORDER BY created_at, post_id
+    (2, "idx_posts_status_created",
+     "CREATE INDEX IF NOT EXISTS idx_posts_status_created ON posts(status, created_at, post_id)"),
+    # Мои истории, модерация автора: WHERE user_id = ? AND status ... ORDER BY created_at
+    (3, "idx_posts_user_status_created",
+     "CREATE INDEX IF NOT EXISTS idx_posts_user_status_created ON posts(user_id, status, created_at, post_id)"),
+    # Задержка публикации: SELECT MAX(created_at) FROM posts WHERE user_id = ?
+    (4, "idx_posts_user_created",
+     "CREATE INDEX IF NOT EXISTS idx_posts_user_created ON posts(user_id, created_at)"),
+    # Последние комментарии: WHERE post_id = ? ORDER BY created_at DESC
+    (5, "idx_comments_post_created",
+     "CREATE INDEX IF NOT EXISTS idx_comments_post_created ON comments(post_id, created_at)"),
+    # Блокировка и разблокировка: WHERE username = ?
+    (6, "idx_users_username",
+     "CREATE INDEX IF NOT EXISTS idx_users_username ON users(username)"),
+    # Списки администраторов и заблокированных - частичные индексы по редким флагам
+    (7, "idx_users_admins",
+     "CREATE INDEX IF NOT EXISTS idx_users_admins ON users(user_id) WHERE is_admin = 1"),
+    (8, "idx_users_blocked",
+     "CREATE INDEX IF NOT EXISTS idx_users_blocked ON users(username) WHERE is_blocked = 1"),
+    # Реакции по посту (первичный ключ начинается с user_id)
+    (9, "idx_reactions_post",
+     "CREATE INDEX IF NOT EXISTS idx_reactions_post ON reactions(post_id)"),
+    (10, "counter_triggers", _counter_triggers),
+    (11, "search_index", _search_index),
+    (12, "post_scores", _post_scores),
+    # Просмотренные посты пользователя - сжатое множество post_id (см. seen.py)
+    (13, "user_seen",
+     "CREATE TABLE IF NOT EXISTS user_seen (user_id INTEGER PRIMARY KEY, bitmap BLOB NOT NULL, updated_at TIMESTAMP)"),
+    (14, "notification_outbox", _notification_outbox),
+    (15, "author_digests", _author_digests),
+    (16, "counter_bypass", _counter_bypass),
+    # Словарь поискового индекса: по нему поиск раскрывает основу слова в формы из индекса
+    (17, "search_vocabulary",
+     "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts_vocab USING fts5vocab(posts_fts, row)"),
+]
+
+
+def get_schema_version(conn) -> int:
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT,
+        applied_at TIMESTAMP
+    )''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def apply_migrations(conn):
+    current = get_schema_version(conn)
+    conn.commit()
+    for version, name, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"Применение миграции {version}: {name}")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if callable(migration):
+                migration(conn)
+            else:
+                conn.execute(migration)
+            conn.execute("INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                         (version, name, datetime.now().isoformat()))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception(f"Ошибка миграции {version}: {name}")
+            raise
+    if current < MIGRATIONS[-1][0]:
+        # Обновляем статистику планировщика для новых индексов
+        conn.execute("PRAGMA optimize")
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_backfill'").fetchone() and \
+            conn.execute("SELECT 1 FROM search_backfill").fetchone():
+        started = time.perf_counter()
+        indexed = backfill_search_index(conn)
+        logger.info(f"Поисковый индекс: добавлено постов {indexed} за {time.perf_counter() - started:.1f} c")
+    return get_schema_version(conn)
+
+
+if __name__ == "__main__":
+    # Обновление рабочей базы заранее, пока запущена старая версия бота:
+    # python migrations.py database.db
+    logging.basicConfig(level=logging.INFO)
+    path = sys.argv[1] if len(sys.argv) > 1 else 'database.db'
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode = WAL")
+    version = apply_migrations(connection)
+    connection.close()
+    logger.info(f"Схема {path} обновлена до версии {version}")
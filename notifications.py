@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import sqlite3
+import sys
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE = 4096
+
+# Строки notification_outbox: pending - ждёт отправки (в том числе повторной), sent - доставлена,
+# dead - не доставлена за max_attempts попыток или получатель недоступен насовсем.
+# У доставленной строки next_attempt_at - время доставки: по нему чистятся старые строки.
+PENDING, SENT, DEAD = "pending", "sent", "dead"
+# Ответы BadRequest, после которых в чат не доставить ничего; остальные (текст, разметка) повторяются
+_CHAT_GONE = ("chat not found", "user is deactivated")
+
+
+def insert_notifications(conn, rows: Iterable[Tuple[int, str, Optional[str]]]) -> int:
+    # rows: [(chat_id, текст, ключ дедупликации или None), ...] в транзакции вызывающего, чтобы
+    # уведомление записалось вместе с изменением, о котором сообщает. Строка с уже известным
+    # ключом пропускается. Возвращает число добавленных строк.
+    now = datetime.now().isoformat()
+    added = 0
+    for chat_id, text, key in rows:
+        added += conn.execute("INSERT OR IGNORE INTO notification_outbox "
+                              "(chat_id, text, dedup_key, created_at, next_attempt_at) VALUES (?, ?, ?, ?, ?)",
+                              (chat_id, text, key, now, now)).rowcount
+    return added
+
+
+def enqueue_notifications(conn, rows: Iterable[Tuple[int, str, Optional[str]]]) -> int:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        added = insert_notifications(conn, rows)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return added
+
+
+def due_notifications(conn, now: datetime, limit: int) -> list:
+    # [(id, chat_id, text, attempts), ...] к отправке, от самых старых
+    return conn.execute("SELECT id, chat_id, text, attempts FROM notification_outbox "
+                        "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at, id LIMIT ?",
+                        (now.isoformat(), limit)).fetchall()
+
+
+def record_results(conn, sent: List[int], failed: List[Tuple[int, str, str, Optional[datetime]]], now: datetime):
+    # failed: [(id, новый статус, ошибка, время следующей попытки), ...] - одной транзакцией
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany("UPDATE notification_outbox SET status = 'sent', next_attempt_at = ? WHERE id = ?",
+                         [(now.isoformat(), row_id) for row_id in sent])
+        conn.executemany("UPDATE notification_outbox SET status = ?, attempts = attempts + 1, last_error = ?, "
+                         "next_attempt_at = COALESCE(?, next_attempt_at) WHERE id = ?",
+                         [(status, error, retry_at and retry_at.isoformat(), row_id)
+                          for row_id, status, error, retry_at in failed])
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def purge_sent(conn, before: datetime, limit: int) -> int:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        deleted = conn.execute("DELETE FROM notification_outbox WHERE id IN (SELECT id FROM notification_outbox "
+                               "WHERE status = 'sent' AND next_attempt_at < ? LIMIT ?)",
+                               (before.isoformat(), limit)).rowcount
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return deleted
+
+
+def outbox_summary(conn) -> Tuple[Dict[str, int], Optional[str]]:
+    # ({статус: число строк}, время следующей попытки среди ожидающих)
+    counts = dict(conn.execute("SELECT status, COUNT(*) FROM notification_outbox GROUP BY status").fetchall())
+    row = conn.execute("SELECT MIN(next_attempt_at) FROM notification_outbox WHERE status = 'pending'").fetchone()
+    return counts, row[0]
+
+
+def requeue_dead(conn) -> int:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        count = conn.execute("UPDATE notification_outbox SET status = 'pending', attempts = 0, next_attempt_at = ? "
+                             "WHERE status = 'dead'", (datetime.now().isoformat(),)).rowcount
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return count
+
+
+class NotificationQueue:
+    """Исходящие уведомления через таблицу notification_outbox.
+
+    Обработчик только записывает уведомление в таблицу и сразу возвращается; отправляет
+    фоновый диспетчер, поэтому сбой Telegram или перезапуск бота уведомление не теряют.
+    Доставка "хотя бы один раз": строка помечается доставленной после ответа Telegram.
+    Уведомление с ключом дедупликации ставится в очередь один раз, сколько бы раз его ни
+    добавили (повтор обработчика, двойное нажатие).
+
+    Диспетчер ждёт window секунд после постановки и забирает до batch готовых строк; строки
+    одному получателю уходят одним сообщением. Одновременно отправляется не больше
+    concurrency сообщений, сами отправки проходят через SendScheduler с приоритетом
+    уведомлений. Неудачная отправка повторяется с экспоненциальной задержкой; после
+    max_attempts попыток, а также если бот заблокирован получателем или чат не найден,
+    строка становится мёртвой и остаётся в таблице для разбора (python notifications.py).
+    """
+
+    def __init__(self, db, bot: Bot, window: float = 1.0, concurrency: int = 8, batch: int = 200,
+                 max_attempts: int = 8, retry_base: float = 10, retry_max: float = 3600,
+                 poll_interval: float = 30, keep_sent: timedelta = timedelta(days=1), close_timeout: float = 5):
+        self.db = db
+        self.bot = bot
+        self.window = window
+        self.batch = batch
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.poll_interval = poll_interval
+        self.keep_sent = keep_sent
+        self.close_timeout = close_timeout
+        self.stats = Counter()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._wakeup = asyncio.Event()
+        self._counts: Dict[str, int] = {}
+        self._stopping = False
+        self._task = None
+
+    async def notify(self, chat_id: int, text: str, key: str = None):
+        await self.notify_many([(chat_id, text, key)])
+
+    async def notify_many(self, rows: List[Tuple[int, str, Optional[str]]]):
+        if not rows:
+            return
+        added = await self.db.run_sync(enqueue_notifications, rows)
+        self.stats["queued"] += added
+        self.stats["deduplicated"] += len(rows) - added
+        self.wake()
+
+    def wake(self):
+        # Строки добавлены в таблицу в обход notify (insert_notifications в чужой транзакции)
+        self._wakeup.set()
+
+    async def _loop(self):
+        while not self._stopping:
+            try:
+                delay = await self.dispatch()
+            except Exception:
+                logger.exception("Ошибка отправки уведомлений")
+                delay = self.poll_interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                if not self._stopping:
+                    # Даём накопиться уведомлениям того же пакета решений
+                    await asyncio.sleep(self.window)
+            except asyncio.TimeoutError:
+                pass
+
+    async def dispatch(self) -> float:
+        # Отправляет всё готовое; возвращает, через сколько секунд нужна следующая попытка
+        self._wakeup.clear()
+        while True:
+            rows = await self.db.run_sync(due_notifications, datetime.now(), self.batch)
+            if rows:
+                await self._send_batch(rows)
+            if len(rows) < self.batch or self._stopping:
+                break
+        await self.db.run_sync(purge_sent, datetime.now() - self.keep_sent, 1000)
+        self._counts, next_at = await self.db.run_sync(outbox_summary)
+        if next_at is None:
+            return self.poll_interval
+        wait = (datetime.fromisoformat(next_at) - datetime.now()).total_seconds()
+        return min(max(wait, 0.0), self.poll_interval)
+
+    async def _send_batch(self, rows):
+        by_chat = defaultdict(list)
+        for row_id, chat_id, text, attempts in rows:
+            by_chat[chat_id].append((row_id, text, attempts))
+        results = await asyncio.gather(*(self._send_chat(chat_id, items) for chat_id, items in by_chat.items()))
+        sent, failed = [], []
+        for chat_sent, chat_failed in results:
+            sent += chat_sent
+            failed += chat_failed
+        await self.db.run_sync(record_results, sent, failed, datetime.now())
+
+    async def _send_chat(self, chat_id: int, items):
+        sent, failed = [], []
+        messages = _join(items)
+        self.stats["coalesced"] += len(items) - len(messages)
+        for text, message_items in messages:
+            async with self._semaphore:
+                try:
+                    await self.bot.send_message(chat_id, text)
+                except (TelegramForbiddenError, TelegramBadRequest) as e:
+                    if isinstance(e, TelegramBadRequest) and not any(
+                            reason in e.message.lower() for reason in _CHAT_GONE):
+                        # Telegram отклонил само сообщение (текст, разметка) - это ошибка бота, а не получателя
+                        self.stats["bad_request"] += 1
+                        logger.error(f"Telegram отклонил уведомление в чат {chat_id}, повторим: {e}")
+                        failed += [self._retry(row_id, attempts, e) for row_id, attempts in message_items]
+                        continue
+                    # Бот заблокирован, чат не существует или пользователь удалён: повтор не поможет
+                    self.stats["dead"] += len(message_items)
+                    logger.warning(f"Уведомление в чат {chat_id} не доставлено: {e}")
+                    failed += [(row_id, DEAD, str(e), None) for row_id, _ in message_items]
+                    continue
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    logger.warning(f"Не удалось отправить уведомление в чат {chat_id}, повторим: {e}")
+                    failed += [self._retry(row_id, attempts, e) for row_id, attempts in message_items]
+                    continue
+            self.stats["sent"] += 1
+            sent += [row_id for row_id, _ in message_items]
+        return sent, failed
+
+    def _retry(self, row_id: int, attempts: int, error: Exception):
+        attempts += 1
+        if attempts >= self.max_attempts:
+            self.stats["dead"] += 1
+            return row_id, DEAD, str(error), None
+        delay = min(self.retry_base * 2 ** (attempts - 1), self.retry_max)
+        return row_id, PENDING, str(error), datetime.now() + timedelta(seconds=delay)
+
+    def metrics(self) -> dict:
+        return {**self.stats, "ждут": self._counts.get(PENDING, 0), "мёртвые": self._counts.get(DEAD, 0)}
+
+    def start(self):
+        # Уведомления, не доставленные до перезапуска, уходят сразу
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        # Дожидается записи результатов текущего пакета, иначе его сообщения уйдут повторно
+        # после запуска. Недоставленные строки остаются в таблице до следующего запуска.
+        if self._task is not None:
+            self._stopping = True
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._task, timeout=self.close_timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Отправка уведомлений прервана, часть сообщений может уйти повторно")
+            self._task = None
+
+
+def _join(items) -> List[Tuple[str, list]]:
+    # [(id, текст, попыток), ...] -> [(сообщение, [(id, попыток), ...]), ...]: тексты склеиваются
+    # построчно в сообщения не длиннее лимита Telegram
+    messages, current, current_items = [], "", []
+    for row_id, text, attempts in items:
+        text = text[:MAX_MESSAGE]
+        if current and len(current) + 1 + len(text) > MAX_MESSAGE:
+            messages.append((current, current_items))
+            current, current_items = "", []
+        current = f"{current}\n{text}" if current else text
+        current_items.append((row_id, attempts))
+    if current:
+        messages.append((current, current_items))
+    return messages
+
+
+if __name__ == "__main__":
+    # Состояние очереди и последние мёртвые уведомления: python notifications.py database.db
+    # Вернуть мёртвые уведомления в очередь: python notifications.py database.db --retry
+    logging.basicConfig(level=logging.INFO)
+    path = sys.argv[1] if len(sys.argv) > 1 else 'database.db'
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    if "--retry" in sys.argv:
+        logger.info(f"Возвращено в очередь: {requeue_dead(connection)}")
+    counts, next_at = outbox_summary(connection)
+    logger.info(f"Уведомления {path}: {counts or 'нет'}, следующая попытка: {next_at or '-'}")
+    for chat_id, text, attempts, error in connection.execute(
+            "SELECT chat_id, text, attempts, last_error FROM notification_outbox WHERE status = 'dead' "
+            "ORDER BY id DESC LIMIT 20"):
+        logger.info(f"мёртвое: чат {chat_id}, попыток {attempts}, {error}: {text[:60]!r}")
+    connection.close()
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+from contextlib import suppress
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+
+class _UserQueue:
+    __slots__ = ("tail", "depth", "enqueued")
+
+    def __init__(self):
+        # Задача последнего апдейта пользователя: следующий апдейт ждёт её завершения
+        self.tail = None
+        # Апдейтов пользователя в обработке и в ожидании; на нуле очередь удаляется
+        self.depth = 0
+        # Время постановки в очередь ждущих апдейтов, по порядку
+        self.enqueued = deque()
+
+
+class UserOrderMiddleware(BaseMiddleware):
+    """Обрабатывает апдейты одного пользователя строго по очереди, разных - параллельно.
+
+    Middleware не ждёт обработчик: апдейт передаётся в отдельную задачу, которая
+    начинает работу, когда закончится предыдущий апдейт того же пользователя, и
+    сразу возвращает управление. Поэтому очередь одного пользователя не занимает
+    обработчики вебхука и не задерживает апдейты других пользователей. Очередь
+    пользователя живёт, пока у него есть апдейты, и удаляется с последним из них.
+    Всего апдейтов в обработке не больше max_pending: при переполнении приём ждёт
+    свободного места, и вебхук отвечает 503 по своей очереди. Задача создаётся
+    в контексте апдейта, поэтому contextvars внешних middleware (current_chat)
+    сохраняются. Ошибки обработчиков пишутся в лог здесь же.
+    """
+
+    def __init__(self, max_pending: int = 1000):
+        self._queues: Dict[int, _UserQueue] = {}
+        self._slots = asyncio.Semaphore(max_pending)
+        self._tasks = set()
+        self.stats = Counter()
+        self._wait_ms = 0.0
+        self._max_wait_ms = 0.0
+        self._max_depth = 0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+        await self._slots.acquire()
+        queue = self._queues.get(user.id)
+        if queue is None:
+            queue = self._queues[user.id] = _UserQueue()
+        queue.depth += 1
+        enqueued = time.monotonic()
+        queue.enqueued.append(enqueued)
+        self._max_depth = max(self._max_depth, queue.depth)
+        task = asyncio.create_task(self._run(user.id, queue, queue.tail, enqueued, handler, event, data))
+        queue.tail = task
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, user_id: int, queue: _UserQueue, previous, enqueued: float, handler, event, data):
+        try:
+            if previous is not None:
+                # wait не пробрасывает ошибку предыдущего апдейта
+                await asyncio.wait((previous,))
+            queue.enqueued.remove(enqueued)
+            waited = (time.monotonic() - enqueued) * 1000
+            self._wait_ms += waited
+            self._max_wait_ms = max(self._max_wait_ms, waited)
+            if waited >= 1:
+                self.stats["waited"] += 1
+            self.stats["handled"] += 1
+            await handler(event, data)
+        except Exception:
+            self.stats["errors"] += 1
+            logger.exception(f"Ошибка обработки апдейта пользователя {user_id}")
+        finally:
+            with suppress(ValueError):
+                # Апдейт отменён, не дождавшись очереди
+                queue.enqueued.remove(enqueued)
+            self._slots.release()
+            queue.depth -= 1
+            if queue.depth == 0:
+                del self._queues[user_id]
+
+    async def close(self, timeout: float = 10.0):
+        # Дорабатываем принятые апдейты, оставшиеся по таймауту отменяем
+        if not self._tasks:
+            return
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        if pending:
+            logger.warning(f"Не дождались обработки {len(pending)} апдейтов при остановке")
+        for task in pending:
+            task.cancel()
+        for task in pending:
+            with suppress(asyncio.CancelledError):
+                await task
+
+    def metrics(self) -> dict:
+        handled = self.stats["handled"]
+        now = time.monotonic()
+        result = {
+            **self.stats,
+            "пользователей в обработке": len(self._queues),
+            "в очереди сейчас": sum(queue.depth for queue in self._queues.values()),
+            "макс. глубина на пользователя": self._max_depth,
+            "среднее ожидание, мс": self._wait_ms / handled if handled else 0.0,
+            "макс. ожидание, мс": self._max_wait_ms,
+        }
+        # Самые длинные очереди: глубина и сколько ждёт их первый апдейт
+        deepest = sorted(self._queues.items(), key=lambda item: item[1].depth, reverse=True)[:5]
+        for user_id, queue in deepest:
+            waiting = (now - queue.enqueued[0]) * 1000 if queue.enqueued else 0.0
+            result[f"очередь {user_id}"] = f"{queue.depth} апд., ждёт {waiting:.0f} мс"
+        return result
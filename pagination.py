@@ -0,0 +1,106 @@
+import math
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional, Tuple
+
+# Курсор - непрозрачная строка с позицией (created_at, post_id) последнего показанного поста.
+# created_at хранится в микросекундах от эпохи в base36, чтобы курсор оставался коротким.
+_EPOCH = datetime(1970, 1, 1)
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def to_base36(value: int) -> str:
+    if value < 0:
+        return "-" + to_base36(-value)
+    result = ""
+    while True:
+        value, rem = divmod(value, 36)
+        result = _DIGITS[rem] + result
+        if not value:
+            return result
+
+
+def from_base36(value: str) -> int:
+    return int(value, 36)
+
+
+class Cursor(NamedTuple):
+    created_at: str
+    post_id: int
+
+
+def encode_cursor(created_at: str, post_id: int) -> str:
+    micros = (datetime.fromisoformat(created_at) - _EPOCH) // timedelta(microseconds=1)
+    return f"{to_base36(micros)}.{to_base36(post_id)}"
+
+
+def decode_cursor(token: str) -> Cursor:
+    # ValueError при повреждённом курсоре
+    micros, post_id = token.split(".")
+    created_at = (_EPOCH + timedelta(microseconds=from_base36(micros))).isoformat()
+    return Cursor(created_at, from_base36(post_id))
+
+
+def encode_search_cursor(max_post_id: int, min_post_id: int, score: float, post_id: int) -> str:
+    # Курсор выдачи поиска: окно совпадений [min_post_id, max_post_id], закреплённое на первой
+    # странице, и (оценка, post_id) последнего показанного результата
+    return f"{to_base36(max_post_id)}~{to_base36(min_post_id)}~{encode_rank_cursor(score, post_id)}"
+
+
+def decode_search_cursor(token: str) -> Tuple[int, int, float, int]:
+    # ValueError при повреждённом курсоре
+    max_post_id, min_post_id, rank = token.split("~", 2)
+    max_post_id, min_post_id = from_base36(max_post_id), from_base36(min_post_id)
+    score, post_id = decode_rank_cursor(rank)
+    if min_post_id < 0 or max_post_id < min_post_id or post_id < 0 or not math.isfinite(score):
+        raise ValueError(f"Повреждённый курсор поиска: {token!r}")
+    return max_post_id, min_post_id, score, post_id
+
+
+def encode_rank_cursor(score: float, post_id: int) -> str:
+    # Курсор популярного: (оценка, post_id) последнего показанного поста
+    return f"{score!r}~{to_base36(post_id)}"
+
+
+def decode_rank_cursor(token: str) -> Tuple[float, int]:
+    # ValueError при повреждённом курсоре
+    score, post_id = token.split("~")
+    return float(score), from_base36(post_id)
+
+
+class KeysetPage(NamedTuple):
+    rows: list
+    next_cursor: Optional[str]  # None - дальше постов нет
+    prev_cursor: Optional[str]  # None - это первая страница
+
+
+def keyset_query(query: str, cursor: Optional[str] = None, backward: bool = False,
+                 columns=("created_at", "post_id")):
+    # Дописывает к запросу с WHERE условие по курсору, сортировку и LIMIT ? (значение - limit + 1)
+    params = []
+    if cursor:
+        created_at, post_id = decode_cursor(cursor)
+        query += f" AND ({columns[0]}, {columns[1]}) {'<' if backward else '>'} (?, ?)"
+        params = [created_at, post_id]
+    order = "DESC" if backward else "ASC"
+    query += f" ORDER BY {columns[0]} {order}, {columns[1]} {order} LIMIT ?"
+    return query, params
+
+
+def build_page(rows: list, limit: int, cursor: Optional[str], backward: bool, key) -> KeysetPage:
+    # rows получены запросом keyset_query с LIMIT limit + 1; key(row) -> (created_at, post_id)
+    has_extra = len(rows) > limit
+    rows = rows[:limit]
+    if backward:
+        rows.reverse()
+    if not rows:
+        return KeysetPage(rows, None, None)
+    first, last = key(rows[0]), key(rows[-1])
+    if backward:
+        has_next, has_prev = cursor is not None, has_extra
+    else:
+        has_next, has_prev = has_extra, cursor is not None
+    return KeysetPage(
+        rows,
+        encode_cursor(*last) if has_next else None,
+        encode_cursor(*first) if has_prev else None,
+    )
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import sys
+import time
+from collections import Counter, OrderedDict
+from functools import partial
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def approx_size(value) -> int:
+    # Примерный размер в байтах: sys.getsizeof самого объекта плюс всего, что в нём лежит
+    # (элементы кортежей, списков и словарей, атрибуты объектов - клавиатуры карточек)
+    size = sys.getsizeof(value)
+    if isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return size
+    if isinstance(value, dict):
+        return size + sum(approx_size(k) + approx_size(v) for k, v in value.items())
+    if isinstance(value, (tuple, list, set, frozenset)):
+        return size + sum(approx_size(item) for item in value)
+    if hasattr(value, "__dict__"):
+        return size + approx_size(vars(value))
+    return size
+
+
+class PagePrefetcher:
+    """Фоновая загрузка следующей страницы для "Загрузить ещё".
+
+    Пока пользователю отправляется страница n, страница n+1 уже загружается и
+    рендерится. Результат хранится ttl секунд, по одной записи на пользователя и
+    список (лента, мои истории). Самые старые записи вытесняются, когда записей больше
+    max_entries или готовые страницы вместе занимают больше max_bytes - размер
+    считается по approx_size, когда загрузка завершилась. Счётчики: hits - нажатие получило готовую страницу, misses - нет,
+    waste - загруженная страница не пригодилась (истекла, вытеснена, курсор другой).
+    """
+
+    def __init__(self, ttl: float = 30, max_entries: int = 1000, max_bytes: int = 32 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stats = Counter()
+        # (user_id, kind) -> (cursor, task, expires_at)
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # (user_id, kind) -> примерный размер загруженной страницы; пока загрузка идёт, записи нет
+        self._sizes: Dict[tuple, int] = {}
+        self._bytes = 0
+
+    def prefetch(self, user_id: int, kind: str, cursor: str, loader: Callable[[str], Awaitable[Any]]):
+        key = (user_id, kind)
+        self._discard(key)
+        self._expire()
+        task = asyncio.create_task(loader(cursor))
+        task.add_done_callback(partial(self._done, key))
+        self._entries[key] = (cursor, task, time.monotonic() + self.ttl)
+        self.stats["prefetched"] += 1
+        self._evict()
+
+    async def take(self, user_id: int, kind: str, cursor: str) -> Optional[Any]:
+        # Результат loader(cursor) или None, если его нужно загрузить самому
+        entry = self._pop((user_id, kind))
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        entry_cursor, task, expires_at = entry
+        if entry_cursor != cursor or expires_at < time.monotonic():
+            task.cancel()
+            self.stats["waste"] += 1
+            self.stats["misses"] += 1
+            return None
+        try:
+            result = await task
+        except Exception:
+            logger.exception(f"Ошибка предзагрузки страницы для {user_id}")
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return result
+
+    def _pop(self, key) -> Optional[tuple]:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= self._sizes.pop(key, 0)
+        return entry
+
+    def _discard(self, key):
+        entry = self._pop(key)
+        if entry is not None:
+            entry[1].cancel()
+            self.stats["waste"] += 1
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._discard(next(iter(self._entries)))
+
+    def _expire(self):
+        # Записи упорядочены по времени добавления, а ttl общий - истёкшие лежат в начале
+        now = time.monotonic()
+        while self._entries:
+            key, (_, _, expires_at) = next(iter(self._entries.items()))
+            if expires_at >= now:
+                break
+            self._discard(key)
+
+    def _done(self, key: tuple, task: asyncio.Task):
+        if task.cancelled():
+            return
+        # Забираем исключение, чтобы asyncio не писал о нём, если страницу так и не попросят
+        if task.exception() is not None:
+            self.stats["errors"] += 1
+            return
+        entry = self._entries.get(key)
+        # Запись могли забрать или заменить, пока шла загрузка
+        if entry is None or entry[1] is not task:
+            return
+        self._sizes[key] = approx_size(task.result())
+        self._bytes += self._sizes[key]
+        self._evict()
+
+    def metrics(self) -> dict:
+        return {**self.stats, "в памяти": len(self._entries), "КБ": self._bytes // 1024}
+
+    def close(self):
+        for _, task, _ in self._entries.values():
+            task.cancel()
+        self._entries.clear()
+        self._sizes.clear()
+        self._bytes = 0
@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from collections import Counter
+from contextlib import suppress
+from typing import Dict, Tuple
+
+from db import Database
+
+logger = logging.getLogger(__name__)
+
+
+class ReactionBuffer:
+    """Отложенная запись лайков.
+
+    Лайк сразу попадает в буфер в памяти и виден нажавшему пользователю, а в БД
+    буфер сбрасывается одной транзакцией раз в flush_interval секунд или при
+    batch_size лайках вместо отдельной транзакции на каждое нажатие.
+    """
+
+    def __init__(self, db: Database, flush_interval: float = 0.05, batch_size: int = 500):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.stats = Counter()
+        # (user_id, post_id) -> None, порядок нажатий сохраняется
+        self._pending: Dict[Tuple[int, int], None] = {}
+        # Лайки, которые сейчас пишутся в БД
+        self._flushing: Dict[Tuple[int, int], None] = {}
+        self._flush_lock = asyncio.Lock()
+        self._timer = None
+        self._urgent = False
+        self._tasks = set()
+
+    def _buffered(self, key) -> bool:
+        return key in self._pending or key in self._flushing
+
+    async def has_liked(self, user_id: int, post_id: int) -> bool:
+        key = (user_id, post_id)
+        if self._buffered(key):
+            return True
+        return await self.db.get_reaction(user_id, post_id) is not None
+
+    async def add_like(self, user_id: int, post_id: int) -> bool:
+        # False - лайк уже был (в буфере или в БД)
+        key = (user_id, post_id)
+        if self._buffered(key) or await self.db.get_reaction(user_id, post_id) is not None:
+            self.stats["duplicates"] += 1
+            return False
+        # Пока шло чтение, тот же лайк мог попасть в буфер
+        if self._buffered(key):
+            self.stats["duplicates"] += 1
+            return False
+        self._pending[key] = None
+        self.stats["likes"] += 1
+        if len(self._pending) >= self.batch_size:
+            self._schedule_flush(0)
+        else:
+            self._schedule_flush(self.flush_interval)
+        return True
+
+    def _schedule_flush(self, delay: float):
+        if delay <= 0:
+            if not self._urgent:
+                self._urgent = True
+                self._spawn(self.flush())
+        elif self._timer is None or self._timer.done():
+            self._timer = self._spawn(self._flush_later(delay))
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_later(self, delay: float):
+        await asyncio.sleep(delay)
+        await self.flush()
+
+    async def flush(self):
+        try:
+            await self._flush()
+        except Exception:
+            logger.exception(f"Не удалось записать {len(self._pending)} лайков, повторим позже")
+            self._schedule_flush(max(self.flush_interval, 1.0))
+
+    async def _flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._urgent = False
+            self._flushing = batch
+            try:
+                added = await self.db.add_likes(list(batch))
+            except BaseException:
+                # Пакет возвращается в буфер, в том числе при отмене; уже записанное add_likes пропустит
+                self._pending = {**batch, **self._pending}
+                raise
+            finally:
+                self._flushing = {}
+            self.stats["flushes"] += 1
+            self.stats["flushed"] += len(added)
+            self.stats["ignored"] += len(batch) - len(added)
+
+    def metrics(self) -> dict:
+        return {**self.stats, "в буфере": len(self._pending)}
+
+    async def close(self, retries: int = 3, retry_delay: float = 0.5):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        for task in tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        self._timer = None
+        # Последний сброс с повторами; что не удалось записать - в лог попарно
+        for attempt in range(retries + 1):
+            try:
+                await self._flush()
+                break
+            except Exception:
+                logger.exception(f"Не удалось записать лайки при остановке, попытка {attempt + 1}")
+                if attempt < retries:
+                    await asyncio.sleep(retry_delay * 2 ** attempt)
+        if self._pending:
+            self.stats["lost"] += len(self._pending)
+            logger.error(f"Потеряны незаписанные лайки ({len(self._pending)}), (user_id, post_id): "
+                         f"{', '.join(map(str, self._pending))}")
+            self._pending = {}
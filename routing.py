@@ -0,0 +1,231 @@
+import copy
+import logging
+from dataclasses import replace
+from typing import Any, Callable, Dict, Optional
+
+from aiogram import Dispatcher, types
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+
+logger = logging.getLogger(__name__)
+
+BACK = "Назад"
+MAIN = "main"
+MAX_SCREENS = 10
+# Стек экранов хранится отдельно от данных диалога, чтобы state.clear() его не стирал
+SCREENS_DESTINY = "screens"
+
+
+class PrefixTrie:
+    # Префиксное дерево по символам: поиск самого длинного зарегистрированного префикса за O(длина строки)
+    def __init__(self):
+        self._root = {}
+
+    def insert(self, prefix: str, value):
+        node = self._root
+        for char in prefix:
+            node = node.setdefault(char, {})
+        node[None] = value
+
+    def resolve(self, key: str):
+        # -> (value, остаток key после префикса) или (None, None)
+        node, found, found_at = self._root, None, 0
+        for i, char in enumerate(key):
+            if None in node:
+                found, found_at = node[None], i
+            node = node.get(char)
+            if node is None:
+                break
+        else:
+            if None in node:
+                return node[None], ""
+        if found is None:
+            return None, None
+        return found, key[found_at:]
+
+
+class _Route:
+    __slots__ = ("handler", "opens", "leaf", "guard")
+
+    def __init__(self, handler: Callable, opens: Optional[str] = None, leaf: bool = False,
+                 guard: Optional[Callable] = None):
+        self.handler = CallableObject(handler)
+        self.opens = opens
+        self.leaf = leaf
+        self.guard = guard
+
+
+class Routes:
+    """Единая таблица маршрутов вместо цепочки фильтров aiogram.
+
+    Тексты кнопок и команды ищутся в словаре, префиксы текста - в префиксном дереве,
+    обработчики состояний FSM - по имени состояния, callback - по действию, которое
+    CallbackDataMiddleware уже разобрало в data["cb"]. На каждый апдейт
+    находится ровно один обработчик; повторная регистрация того же ключа - ошибка.
+
+    Порядок для сообщений: команда, "Назад", кнопка меню (прерывает ввод в состоянии),
+    обработчик текущего состояния, префикс текста.
+
+    "Назад" работает по стеку экранов пользователя в хранилище FSM: обработчик кнопки,
+    открывающей меню (opens=...), кладёт его в стек, обработчик листового экрана
+    (leaf=True) отмечает, что пользователь ушёл с меню. "Назад" с листа или из ввода
+    возвращает на текущее меню, "Назад" с меню - на предыдущее.
+
+    guarded(guard) даёт ту же таблицу, но у всех зарегистрированных через неё маршрутов
+    перед обработчиком вызывается await guard(event, data): False - апдейт обработан
+    (guard сам ответил пользователю), обработчик не вызывается.
+    """
+
+    def __init__(self):
+        self._commands: Dict[str, _Route] = {}
+        self._texts: Dict[str, _Route] = {}
+        self._text_prefixes = PrefixTrie()
+        self._states: Dict[str, _Route] = {}
+        self._callbacks: Dict[str, _Route] = {}
+        self._menus: Dict[str, CallableObject] = {}
+        self._guard: Optional[Callable] = None
+
+    def guarded(self, guard: Callable) -> "Routes":
+        # Копия разделяет с исходной все таблицы - меняется только guard новых маршрутов
+        routes = copy.copy(self)
+        routes._guard = guard
+        return routes
+
+    @staticmethod
+    def _add(table: dict, key, route: _Route, kind: str):
+        if key in table:
+            raise ValueError(f"{kind} {key!r} уже зарегистрирован")
+        table[key] = route
+
+    # --- Регистрация ---
+
+    def command(self, name: str, opens: str = None):
+        def decorator(handler):
+            self._add(self._commands, name, _Route(handler, opens, guard=self._guard), "Команда")
+            return handler
+        return decorator
+
+    def text(self, *texts: str, opens: str = None, leaf: bool = False):
+        def decorator(handler):
+            route = _Route(handler, opens, leaf, self._guard)
+            for text in texts:
+                self._add(self._texts, text, route, "Текст")
+            return handler
+        return decorator
+
+    def text_prefix(self, prefix: str, opens: str = None, leaf: bool = False):
+        def decorator(handler):
+            self._text_prefixes.insert(prefix, _Route(handler, opens, leaf, self._guard))
+            return handler
+        return decorator
+
+    def state(self, *states: State):
+        def decorator(handler):
+            route = _Route(handler, guard=self._guard)
+            for state in states:
+                self._add(self._states, state.state, route, "Состояние")
+            return handler
+        return decorator
+
+    def callback(self, action: str):
+        # Обработчик получает разобранные данные кнопки в аргументе cb (callbacks.CallbackData)
+        def decorator(handler):
+            self._add(self._callbacks, action, _Route(handler, guard=self._guard), "Callback")
+            return handler
+        return decorator
+
+    def menu(self, name: str):
+        # Отрисовка экрана меню для кнопки "Назад": render(message, **data)
+        def decorator(render):
+            self._add(self._menus, name, CallableObject(render), "Меню")
+            return render
+        return decorator
+
+    # --- Разбор апдейтов ---
+
+    def resolve_message(self, message: types.Message, raw_state: Optional[str]):
+        # -> (route, вид маршрута); без обращений к хранилищу
+        text = message.text
+        if text:
+            if text.startswith("/"):
+                route = self._commands.get(text[1:].split(maxsplit=1)[0].split("@")[0])
+                if route is not None:
+                    return route, "command"
+            if text == BACK:
+                return None, "back"
+            route = self._texts.get(text)
+            if route is not None:
+                return route, "text"
+        if raw_state is not None:
+            route = self._states.get(raw_state)
+            if route is not None:
+                return route, "state"
+        if text:
+            route, _ = self._text_prefixes.resolve(text)
+            if route is not None:
+                return route, "text"
+        return None, None
+
+    async def dispatch_message(self, message: types.Message, **data: Any):
+        raw_state = data.get("raw_state")
+        route, kind = self.resolve_message(message, raw_state)
+        if kind == "back":
+            return await self._go_back(message, raw_state, data)
+        if route is None:
+            return UNHANDLED
+        if route.guard is not None and not await route.guard(message, data):
+            return None
+        state = data["state"]
+        if raw_state is not None and kind != "state":
+            # Кнопка меню посреди ввода прерывает ввод; данные FSM сохраняются
+            await state.set_state(None)
+        result = await route.handler.call(message, **data)
+        if route.opens or route.leaf:
+            await self._navigate(state, route)
+        return result
+
+    async def dispatch_callback(self, callback: types.CallbackQuery, **data: Any):
+        cb = data.get("cb")
+        route = self._callbacks.get(cb.action) if cb is not None else None
+        if route is None:
+            logger.warning(f"Нет обработчика для callback {callback.data!r}")
+            return UNHANDLED
+        if route.guard is not None and not await route.guard(callback, data):
+            return None
+        return await route.handler.call(callback, **data)
+
+    # --- Стек экранов ---
+
+    @staticmethod
+    def _screens(state: FSMContext) -> FSMContext:
+        return FSMContext(storage=state.storage, key=replace(state.key, destiny=SCREENS_DESTINY))
+
+    async def _navigate(self, state: FSMContext, route: _Route):
+        screens_ctx = self._screens(state)
+        stored = await screens_ctx.get_data()
+        screens = stored.get("screens") or [MAIN]
+        if route.opens:
+            if route.opens in screens:
+                screens = screens[:screens.index(route.opens) + 1]
+            else:
+                screens = (screens + [route.opens])[-MAX_SCREENS:]
+        await screens_ctx.set_data({"screens": screens, "on_leaf": route.leaf})
+
+    async def _go_back(self, message: types.Message, raw_state: Optional[str], data: dict):
+        state = data["state"]
+        screens_ctx = self._screens(state)
+        stored = await screens_ctx.get_data()
+        screens = stored.get("screens") or [MAIN]
+        if raw_state is not None:
+            await state.set_state(None)
+        elif not stored.get("on_leaf") and len(screens) > 1:
+            screens = screens[:-1]
+        await screens_ctx.set_data({"screens": screens, "on_leaf": False})
+        render = self._menus.get(screens[-1]) or self._menus[MAIN]
+        return await render.call(message, **data)
+
+    def setup(self, dp: Dispatcher):
+        dp.message.register(self.dispatch_message)
+        dp.callback_query.register(self.dispatch_callback)
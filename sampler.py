@@ -0,0 +1,176 @@
+import random
+from collections import OrderedDict, deque
+
+from events import POST_PUBLISHED, POST_DELETED, POST_LIKED
+
+
+class FenwickTree:
+    # Дерево Фенвика по весам слотов: обновление и выбор по префиксной сумме за O(log n)
+    def __init__(self, size: int = 0):
+        self._tree = [0] * (size + 1)
+
+    def __len__(self):
+        return len(self._tree) - 1
+
+    def add(self, index: int, delta: int):
+        index += 1
+        size = len(self._tree)
+        while index < size:
+            self._tree[index] += delta
+            index += index & -index
+
+    def total(self) -> int:
+        index, result = len(self), 0
+        while index > 0:
+            result += self._tree[index]
+            index -= index & -index
+        return result
+
+    def find(self, value: float) -> int:
+        # Наименьший индекс, префиксная сумма которого больше value
+        position, step = 0, 1 << len(self).bit_length()
+        while step:
+            nxt = position + step
+            if nxt < len(self._tree) and self._tree[nxt] <= value:
+                position = nxt
+                value -= self._tree[nxt]
+            step >>= 1
+        return position
+
+    @classmethod
+    def build(cls, weights, size: int):
+        tree = cls(size)
+        data = tree._tree
+        for i, weight in enumerate(weights, start=1):
+            data[i] += weight
+            parent = i + (i & -i)
+            if parent <= size:
+                data[parent] += data[i]
+        # Хвост без весов тоже нужно протолкнуть вверх
+        for i in range(len(weights) + 1, size + 1):
+            parent = i + (i & -i)
+            if parent <= size:
+                data[parent] += data[i]
+        return tree
+
+
+class _History:
+    # Последние показанные пользователю посты: очередь для порядка и множество для проверки
+    __slots__ = ("order", "ids")
+
+    def __init__(self):
+        self.order = deque()
+        self.ids = set()
+
+    def add(self, post_id: int, limit: int):
+        if post_id not in self.ids:
+            self.order.append(post_id)
+            self.ids.add(post_id)
+        while len(self.order) > limit:
+            self.ids.discard(self.order.popleft())
+
+
+class StorySampler:
+    """Случайный выбор одобренной истории за O(1) (равномерно) или O(log n) (по лайкам).
+
+    Держит в памяти только id одобренных постов и их лайки; обновляется по событиям БД.
+    В режиме без повторов пользователю не показываются его последние history постов, но
+    не больше половины всех: тогда выбор с отбрасыванием показанных в среднем укладывается
+    в две попытки, а память на пользователя ограничена.
+    """
+
+    MAX_TRIES = 32
+
+    def __init__(self, weighted: bool = False, no_repeat: bool = False, max_tracked_users: int = 10000,
+                 history: int = 200):
+        self.weighted = weighted
+        self.no_repeat = no_repeat
+        self.max_tracked_users = max_tracked_users
+        self.history = history
+        self._ids = []
+        self._likes = []
+        self._slots = {}
+        self._tree = FenwickTree()
+        # user_id -> _History (для режима без повторов)
+        self._seen = OrderedDict()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def attach(self, events):
+        events.subscribe(POST_PUBLISHED, lambda post_id, **_: self.add(post_id))
+        events.subscribe(POST_DELETED, lambda post_id, **_: self.remove(post_id))
+        events.subscribe(POST_LIKED, lambda post_id, **_: self.add_like(post_id))
+
+    def load(self, rows):
+        # rows: [(post_id, likes), ...]
+        self._ids = [post_id for post_id, _ in rows]
+        self._likes = [likes or 0 for _, likes in rows]
+        self._slots = {post_id: slot for slot, post_id in enumerate(self._ids)}
+        capacity = max(16, len(self._ids) * 2)
+        self._tree = FenwickTree.build([likes + 1 for likes in self._likes], capacity)
+        self._seen.clear()
+
+    def add(self, post_id: int, likes: int = 0):
+        if post_id in self._slots:
+            return
+        slot = len(self._ids)
+        if slot >= len(self._tree):
+            self._tree = FenwickTree.build([n + 1 for n in self._likes], max(16, slot * 2))
+        self._ids.append(post_id)
+        self._likes.append(likes)
+        self._slots[post_id] = slot
+        self._tree.add(slot, likes + 1)
+
+    def remove(self, post_id: int):
+        slot = self._slots.pop(post_id, None)
+        if slot is None:
+            return
+        last = len(self._ids) - 1
+        self._tree.add(slot, -(self._likes[slot] + 1))
+        if slot != last:
+            # Переносим последний пост в освободившийся слот
+            moved_id, moved_likes = self._ids[last], self._likes[last]
+            self._tree.add(last, -(moved_likes + 1))
+            self._tree.add(slot, moved_likes + 1)
+            self._ids[slot], self._likes[slot] = moved_id, moved_likes
+            self._slots[moved_id] = slot
+        self._ids.pop()
+        self._likes.pop()
+
+    def add_like(self, post_id: int):
+        slot = self._slots.get(post_id)
+        if slot is not None:
+            self._likes[slot] += 1
+            self._tree.add(slot, 1)
+
+    def _pick(self) -> int:
+        if self.weighted:
+            return self._ids[self._tree.find(random.random() * self._tree.total())]
+        return self._ids[random.randrange(len(self._ids))]
+
+    def _history_for(self, user_id: int) -> _History:
+        history = self._seen.get(user_id)
+        if history is None:
+            history = self._seen[user_id] = _History()
+            if len(self._seen) > self.max_tracked_users:
+                self._seen.popitem(last=False)
+        else:
+            self._seen.move_to_end(user_id)
+        return history
+
+    def sample(self, user_id: int = None):
+        if not self._ids:
+            return None
+        if not self.no_repeat or user_id is None:
+            return self._pick()
+
+        history = self._history_for(user_id)
+        # По лайкам недавно показанные могут набрать почти весь вес - тогда после MAX_TRIES
+        # попыток допускаем повтор
+        for _ in range(self.MAX_TRIES):
+            post_id = self._pick()
+            if post_id not in history.ids:
+                break
+        history.add(post_id, min(self.history, len(self._ids) // 2))
+        return post_id
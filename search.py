@@ -0,0 +1,199 @@
+import logging
+import re
+import sqlite3
+import sys
+import time
+from typing import Optional
+
+from aiogram import Dispatcher, types, Bot
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.context import FSMContext
+from aiogram.types import (ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton,
+                           InlineQueryResultArticle, InputTextMessageContent)
+
+from db import Database
+from routing import Routes
+from cards import CardRenderer, SEARCH_CARD, PREVIEW_LENGTH
+from callbacks import CallbackData, encode_callback, SEARCH_MORE
+from migrations import rebuild_search_index
+
+logger = logging.getLogger(__name__)
+
+MAX_TERMS = 8
+INLINE_LIMIT = 20
+
+_WORD = re.compile(r"\w+")
+_CYRILLIC = re.compile(r"[а-я]")
+_REFLEXIVE = ("ся", "сь")
+# Окончания существительных и прилагательных, глаголов; при стемминге проверяются от длинных к коротким
+_NOMINAL_ENDINGS = {
+    "иями", "ями", "ами", "иях", "ях", "ах", "ией", "ей", "ой", "ий", "ый", "ие", "ые", "ое", "ее",
+    "ого", "его", "ому", "ему", "ыми", "ими", "ым", "им", "ом", "ем", "ую", "юю", "ая", "яя", "ов", "ев",
+    "ия", "ию", "ии", "а", "я", "о", "е", "ы", "и", "у", "ю", "ь", "й",
+}
+_VERB_ENDINGS = {"ешь", "ете", "ет", "ут", "ют", "ит", "ат", "ят", "ить", "ать", "ять", "еть", "ла", "ло", "ли", "ть"}
+_ENDINGS = sorted(_NOMINAL_ENDINGS | _VERB_ENDINGS, key=len, reverse=True)
+_ENDING_SET = _NOMINAL_ENDINGS | _VERB_ENDINGS
+_MIN_STEM = 3
+
+
+class SearchStates(StatesGroup):
+    query = State()
+
+
+def stem(word: str) -> str:
+    # Грубый стеммер: отбрасывает типичное окончание, оставляя основу не короче _MIN_STEM букв
+    word = word.lower().replace("ё", "е")
+    if not _CYRILLIC.search(word):
+        return word
+    for ending in _REFLEXIVE:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            word = word[:-len(ending)]
+            break
+    for ending in _ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= _MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def search_stems(text: str) -> list:
+    # Основы слов запроса без повторов, не больше MAX_TERMS
+    stems = []
+    for word in _WORD.findall(text)[:MAX_TERMS]:
+        base = stem(word)
+        if len(base) >= 2 and base not in stems:
+            stems.append(base)
+    return stems
+
+
+def is_word_form(base: str, term: str) -> bool:
+    # term - основа base с одним из окончаний, у глагольных - и с -ся/-сь
+    rest = term[len(base):]
+    if not rest or rest in _ENDING_SET:
+        return True
+    return rest[-2:] in _REFLEXIVE and rest[:-2] in _VERB_ENDINGS
+
+
+async def to_match_query(db: Database, text: str) -> Optional[str]:
+    # Текст пользователя -> запрос FTS5, все слова обязательны. Русское слово ищется в любой форме:
+    # в словаре индекса берутся слова с префиксом-основой ("истор" -> "история", "историей"), и в
+    # запрос идут только те, что состоят из основы и окончания. Запрос не длиннее числа форм,
+    # которые реально встречаются в историях, и FTS5 читает их списки документов потоком, а
+    # префиксный запрос "истор"* склеивает списки всех слов с этим началом целиком - на частой
+    # основе это в разы медленнее. Остальные слова ищутся префиксным запросом.
+    # Слова берутся в кавычки, поэтому операторы FTS5 (OR, NEAR, *) из текста не действуют.
+    # "" - в тексте нет слов; None - какого-то слова нет в индексе, искать нечего.
+    stems = search_stems(text)
+    if not stems:
+        return ""
+    cyrillic = [base for base in stems if _CYRILLIC.search(base)]
+    terms = await db.get_index_terms(cyrillic) if cyrillic else {}
+    groups = []
+    for base in stems:
+        if base not in terms:
+            groups.append(f'"{base}"*')
+            continue
+        forms = [term for term in terms[base] if is_word_form(base, term)]
+        if not forms:
+            return None
+        groups.append("(" + " OR ".join(f'"{form}"' for form in forms) + ")")
+    return " AND ".join(groups)
+
+
+def get_search_menu():
+    return ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text="Назад")]],
+        resize_keyboard=True
+    )
+
+
+def setup_handlers(dp: Dispatcher, routes: Routes, db: Database, bot: Bot, cards: CardRenderer):
+    def more_keyboard(cursor: str):
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Загрузить ещё", callback_data=encode_callback(SEARCH_MORE, cursor=cursor))]
+        ])
+
+    async def send_results(message: types.Message, page):
+        for card in await cards.render_page(SEARCH_CARD, page.posts):
+            await message.answer(card.text, parse_mode="HTML", reply_markup=card.keyboard)
+
+    @routes.text("Поиск", leaf=True)
+    async def search_menu(message: types.Message, state: FSMContext):
+        await message.answer("Введите слова для поиска историй:", reply_markup=get_search_menu())
+        await state.set_state(SearchStates.query)
+
+    @routes.state(SearchStates.query)
+    async def process_query(message: types.Message, state: FSMContext):
+        # Остаёмся в поиске: следующий текст - новый запрос, "Назад" - выход
+        match = await to_match_query(db, message.text or "")
+        if match == "":
+            await message.answer("Введите хотя бы одно слово", reply_markup=get_search_menu())
+            return
+        logger.info(f"search for user {message.from_user.id}: {message.text}")
+        # Хранится текст: запрос FTS5 строится из него заново по текущему словарю индекса
+        await state.update_data(search_text=message.text)
+        page = await db.search_posts(match) if match else None
+        if not page or not page.posts:
+            await message.answer("Ничего не найдено", reply_markup=get_search_menu())
+            return
+        await send_results(message, page)
+        reply_markup = more_keyboard(page.next_cursor) if page.next_cursor else get_search_menu()
+        await message.answer(f"Результаты поиска: {message.text}", reply_markup=reply_markup)
+
+    @routes.callback(SEARCH_MORE)
+    async def load_more_results(callback: types.CallbackQuery, state: FSMContext, cb: CallbackData):
+        match = await to_match_query(db, (await state.get_data()).get("search_text") or "")
+        if match == "":
+            await callback.answer("Повторите поиск")
+            return
+        page = await db.search_posts(match, cb.cursor) if match else None
+        if not page or not page.posts:
+            await callback.message.edit_text("Больше ничего не найдено")
+            await callback.answer()
+            return
+        await send_results(callback.message, page)
+        if page.next_cursor:
+            await callback.message.edit_reply_markup(reply_markup=more_keyboard(page.next_cursor))
+        else:
+            await callback.message.edit_reply_markup(reply_markup=None)
+        await callback.answer()
+
+    @dp.inline_query()
+    async def inline_search(query: types.InlineQuery):
+        # @бот слова - поиск из любого чата; offset - курсор следующей страницы
+        match = await to_match_query(db, query.query)
+        if not match:
+            await query.answer([], cache_time=300)
+            return
+        try:
+            page = await db.search_posts(match, query.offset or None, INLINE_LIMIT)
+        except (ValueError, OverflowError):
+            await query.answer([], cache_time=300)
+            return
+        page_cards = await cards.render_page(SEARCH_CARD, page.posts)
+        results = [
+            InlineQueryResultArticle(
+                id=str(post_id),
+                title=title[:100],
+                description=content[:PREVIEW_LENGTH],
+                # Без кнопок: у сообщения из инлайн-режима нет чата бота для callback
+                input_message_content=InputTextMessageContent(message_text=card.text, parse_mode="HTML"),
+            )
+            for (post_id, title, content, username), card in zip(page.posts, page_cards)
+        ]
+        await query.answer(results, cache_time=30, next_offset=page.next_cursor or "")
+
+
+if __name__ == "__main__":
+    # Полная перестройка поискового индекса: python search.py database.db
+    logging.basicConfig(level=logging.INFO)
+    path = sys.argv[1] if len(sys.argv) > 1 else 'database.db'
+    connection = sqlite3.connect(path, timeout=30)
+    connection.execute("PRAGMA journal_mode = WAL")
+    started = time.perf_counter()
+    connection.execute("BEGIN IMMEDIATE")
+    rebuild_search_index(connection)
+    connection.commit()
+    count = connection.execute("SELECT COUNT(*) FROM posts WHERE status = 'approved'").fetchone()[0]
+    connection.close()
+    logger.info(f"Поисковый индекс {path} перестроен: {count} постов за {time.perf_counter() - started:.1f} c")
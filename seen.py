@@ -0,0 +1,319 @@
+import array
+import asyncio
+import bisect
+import logging
+import struct
+import sys
+from collections import Counter, OrderedDict
+from contextlib import suppress
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from db import Database, RankedPage
+from events import POST_PUBLISHED
+from pagination import encode_cursor, decode_cursor
+
+logger = logging.getLogger(__name__)
+
+_ARRAY_MAX = 4096          # больше - контейнер становится битовой картой
+_BITMAP_BYTES = 1 << 13    # 65536 бит
+_ARRAY, _BITMAP = 0, 1
+_VERSION = 1
+_HEADER = struct.Struct("<BI")           # версия, число контейнеров
+_CONTAINER = struct.Struct("<IBI")       # старшие биты post_id, вид, мощность
+_POPCOUNT = bytes(bin(i).count("1") for i in range(256))
+
+
+def _to_le(values: array.array) -> bytes:
+    if sys.byteorder == "big":
+        values = array.array("H", values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_le(data: bytes) -> array.array:
+    values = array.array("H")
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+class SeenSet:
+    """Множество post_id в формате Roaring.
+
+    post_id делится на старшие биты (ключ контейнера) и младшие 16 бит. Контейнер
+    с не более чем 4096 значениями - отсортированный массив uint16 (2 байта на пост),
+    плотный контейнер - битовая карта на 65536 бит (8 КБ). Пользователь, прочитавший
+    пару тысяч историй из миллиона, занимает несколько килобайт, а не мегабайт.
+    """
+
+    __slots__ = ("_containers", "_size")
+
+    def __init__(self):
+        # старшие биты -> array('H') или bytearray(8192)
+        self._containers: Dict[int, object] = {}
+        self._size = 0
+
+    def add(self, post_id: int) -> bool:
+        # False - пост уже был в множестве
+        key, low = post_id >> 16, post_id & 0xFFFF
+        container = self._containers.get(key)
+        if container is None:
+            container = self._containers[key] = array.array("H")
+        if isinstance(container, bytearray):
+            mask = 1 << (low & 7)
+            if container[low >> 3] & mask:
+                return False
+            container[low >> 3] |= mask
+        else:
+            i = bisect.bisect_left(container, low)
+            if i < len(container) and container[i] == low:
+                return False
+            container.insert(i, low)
+            if len(container) > _ARRAY_MAX:
+                bitmap = bytearray(_BITMAP_BYTES)
+                for value in container:
+                    bitmap[value >> 3] |= 1 << (value & 7)
+                self._containers[key] = bitmap
+        self._size += 1
+        return True
+
+    def __contains__(self, post_id: int) -> bool:
+        container = self._containers.get(post_id >> 16)
+        if container is None:
+            return False
+        low = post_id & 0xFFFF
+        if isinstance(container, bytearray):
+            return bool(container[low >> 3] & (1 << (low & 7)))
+        i = bisect.bisect_left(container, low)
+        return i < len(container) and container[i] == low
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(c) if isinstance(c, bytearray) else len(c) * 2 for c in self._containers.values())
+
+    def to_bytes(self) -> bytes:
+        parts = [_HEADER.pack(_VERSION, len(self._containers))]
+        for key in sorted(self._containers):
+            container = self._containers[key]
+            if isinstance(container, bytearray):
+                parts.append(_CONTAINER.pack(key, _BITMAP, sum(container.translate(_POPCOUNT))))
+                parts.append(bytes(container))
+            else:
+                parts.append(_CONTAINER.pack(key, _ARRAY, len(container)))
+                parts.append(_to_le(container))
+        return b"".join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "SeenSet":
+        seen = cls()
+        version, count = _HEADER.unpack_from(data)
+        if version != _VERSION:
+            raise ValueError(f"Неизвестная версия множества просмотров: {version}")
+        offset = _HEADER.size
+        for _ in range(count):
+            key, kind, cardinality = _CONTAINER.unpack_from(data, offset)
+            offset += _CONTAINER.size
+            if kind == _BITMAP:
+                seen._containers[key] = bytearray(data[offset:offset + _BITMAP_BYTES])
+                offset += _BITMAP_BYTES
+            else:
+                seen._containers[key] = _from_le(data[offset:offset + cardinality * 2])
+                offset += cardinality * 2
+            seen._size += cardinality
+        return seen
+
+
+class _Entry:
+    __slots__ = ("seen", "resume")
+
+    def __init__(self, seen: SeenSet):
+        self.seen = seen
+        # Курсор ленты, до которого пользователь видел все посты; только в памяти
+        self.resume: Optional[str] = None
+
+
+class SeenTracker:
+    """Просмотренные пользователем посты: LRU из max_users множеств в памяти и BLOB в user_seen.
+
+    Пост отмечается, когда его карточка доставлена или открыт полный текст. Изменённые
+    множества пишутся в БД одной транзакцией раз в flush_interval секунд; вытесненное
+    из LRU, но ещё не записанное множество ждёт записи отдельно и не теряется.
+    """
+
+    def __init__(self, db: Database, max_users: int = 5000, flush_interval: float = 5.0,
+                 chunk: int = 1000, max_scan: int = 5000):
+        self.db = db
+        self.max_users = max_users
+        self.flush_interval = flush_interval
+        self.chunk = chunk
+        self.max_scan = max_scan
+        self.stats = Counter()
+        self._cache: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._dirty = set()
+        # user_id -> BLOB вытесненного из LRU и ещё не записанного множества
+        self._evicted: Dict[int, bytes] = {}
+        self._loading: Dict[int, asyncio.Task] = {}
+        self._flush_lock = asyncio.Lock()
+        self._timer = None
+
+    def attach(self, events):
+        events.subscribe(POST_PUBLISHED, self._on_published)
+
+    def _on_published(self, post_id: int, created_at: str = None, **_):
+        # Пост, одобренный позже, чем создан, встаёт в ленту перед позициями, с которых
+        # продолжается поиск непрочитанного - отодвигаем их назад к этому посту
+        if created_at is None:
+            return
+        position = (datetime.fromisoformat(created_at), post_id)
+        for entry in self._cache.values():
+            if entry.resume is None:
+                continue
+            resume = decode_cursor(entry.resume)
+            if (datetime.fromisoformat(resume.created_at), resume.post_id) >= position:
+                entry.resume = encode_cursor(created_at, post_id - 1)
+                self.stats["resume_reset"] += 1
+
+    async def _entry(self, user_id: int) -> _Entry:
+        entry = self._cache.get(user_id)
+        if entry is not None:
+            self._cache.move_to_end(user_id)
+            self.stats["hits"] += 1
+            return entry
+        task = self._loading.get(user_id)
+        if task is None:
+            self.stats["misses"] += 1
+            task = self._loading[user_id] = asyncio.ensure_future(self._load(user_id))
+            # Ошибку получат ожидающие; если их нет, asyncio не должен ругаться на неполученное исключение
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        return await asyncio.shield(task)
+
+    async def _load(self, user_id: int) -> _Entry:
+        # Загрузка - отдельная задача: отмена обработчика, который её начал, не отменяет
+        # её для остальных ожидающих
+        try:
+            blob = self._evicted.get(user_id)
+            if blob is None:
+                blob = await self.db.get_seen(user_id)
+            entry = _Entry(SeenSet.from_bytes(blob) if blob else SeenSet())
+        finally:
+            del self._loading[user_id]
+        self._cache[user_id] = entry
+        self._evict()
+        return entry
+
+    def _evict(self):
+        while len(self._cache) > self.max_users:
+            user_id, entry = self._cache.popitem(last=False)
+            self.stats["evictions"] += 1
+            if user_id in self._dirty:
+                self._dirty.discard(user_id)
+                self._evicted[user_id] = entry.seen.to_bytes()
+                self._schedule_flush()
+
+    async def get(self, user_id: int) -> SeenSet:
+        return (await self._entry(user_id)).seen
+
+    async def mark(self, user_id: int, post_ids: Iterable[int]):
+        seen = await self.get(user_id)
+        added = sum(seen.add(post_id) for post_id in post_ids)
+        if added:
+            self.stats["marked"] += added
+            # Пока множество загружалось, пользователь мог быть вытеснен из LRU
+            if user_id in self._cache:
+                self._dirty.add(user_id)
+            else:
+                self._evicted[user_id] = seen.to_bytes()
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Не удалось записать просмотры, повторим позже")
+            # Эта задача ещё не завершена - без сброса _schedule_flush решит, что запись уже запланирована
+            self._timer = None
+            self._schedule_flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = {**self._evicted, **{user_id: self._cache[user_id].seen.to_bytes()
+                                        for user_id in dirty if user_id in self._cache}}
+            if not rows:
+                return
+            evicted, self._evicted = self._evicted, {}
+            try:
+                await self.db.save_seen(list(rows.items()))
+            except BaseException:
+                # Вернём всё, что не записалось, в том числе при отмене; более свежие изменения важнее
+                self._evicted = {**evicted, **self._evicted}
+                self._dirty |= {user_id for user_id in dirty if user_id in self._cache}
+                raise
+            self.stats["flushes"] += 1
+            self.stats["saved"] += len(rows)
+
+    async def unread_page(self, user_id: int, cursor: Optional[str] = None, limit: int = 10) -> RankedPage:
+        # Страница ленты без просмотренных постов. Лента читается по индексу (created_at, post_id)
+        # чанками по chunk постов и фильтруется множеством просмотров; за один вызов просматривается
+        # не больше max_scan постов - тогда страница короче, а курсор указывает, где продолжить.
+        # Так один вызов - не больше max_scan / chunk запросов к БД; прочитанное подряд начало
+        # ленты пропускается по entry.resume и в этот предел не входит.
+        entry = await self._entry(user_id)
+        from_start = cursor is None
+        position = cursor or entry.resume
+        # (post_id, created_at) последнего просмотренного поста и конца прочитанного отрезка
+        last = resume = None
+        picked, scanned, exhausted = [], 0, False
+        while len(picked) < limit and scanned < self.max_scan:
+            keys = await self.db.get_feed_keys(position, self.chunk)
+            for key in keys:
+                scanned += 1
+                last = key
+                if key[0] in entry.seen:
+                    # Всё до первого непрочитанного поста просмотрено - в следующий раз начнём отсюда
+                    if from_start and not picked:
+                        resume = key
+                    continue
+                picked.append(key[0])
+                if len(picked) == limit:
+                    break
+            else:
+                if len(keys) < self.chunk:
+                    exhausted = True
+                    break
+            position = encode_cursor(last[1], last[0])
+        if resume is not None:
+            entry.resume = encode_cursor(resume[1], resume[0])
+        if not exhausted and len(picked) < limit:
+            self.stats["scan_limit"] += 1
+        self.stats["scanned"] += scanned
+        # Полная страница может оказаться последней - тогда следующая придёт пустой
+        next_cursor = None if exhausted or last is None else encode_cursor(last[1], last[0])
+        return RankedPage(await self.db.get_feed_posts(picked), next_cursor)
+
+    def metrics(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        hit_rate = f"{self.stats['hits'] / lookups * 100:.1f}%" if lookups else "-"
+        memory = sum(entry.seen.nbytes for entry in self._cache.values())
+        return {**self.stats, "в памяти": len(self._cache), "КБ": memory // 1024, "попадания": hit_rate,
+                "ждут записи": len(self._dirty) + len(self._evicted)}
+
+    async def close(self):
+        # Отложенная запись может быть уже внутри flush(): дожидаемся её отмены, чтобы
+        # последняя запись шла после неё и забрала всё, что та вернула
+        timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+            with suppress(asyncio.CancelledError):
+                await timer
+        await self.flush()
@@ -0,0 +1,205 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: ответы в чат текущего апдейта идут раньше уведомлений в другие чаты
+INTERACTIVE = 0
+NOTIFICATION = 1
+
+# Чат апдейта, который сейчас обрабатывается в этой задаче
+current_chat = contextvars.ContextVar("current_chat", default=None)
+
+
+class SendQueueFull(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now: float) -> float:
+        self._refill(now)
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        # Telegram вернул 429: ничего не отправляем в этот чат до истечения retry_after
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """Планировщик исходящих запросов к Bot API.
+
+    Подключается как middleware сессии бота, поэтому через него проходят все отправки
+    и редактирования. Ограничивает общую скорость и скорость на чат (token bucket),
+    пропускает ответы пользователю раньше уведомлений и повторяет запрос после RetryAfter.
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: int = 20,
+                 group_rate: float = 20 / 60, group_burst: int = 3,
+                 max_queue: Dict[int, int] = None, max_retries: int = 3, max_chats: int = 10000):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate, self.chat_burst = chat_rate, chat_burst
+        self.group_rate, self.group_burst = group_rate, group_burst
+        self.max_queue = max_queue or {INTERACTIVE: 1000, NOTIFICATION: 5000}
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self.stats = Counter()
+        self._chats = {}
+        self._heap = []
+        # (время, когда лимит чата восстановится, запись из _heap)
+        self._waiting = []
+        self._queued = Counter()
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._worker = None
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                now = time.monotonic()
+                self._chats = {key: b for key, b in self._chats.items() if not b.is_idle(now)}
+            if isinstance(chat_id, int) and chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def queue_depth(self, priority: int = None) -> int:
+        if priority is None:
+            return sum(self._queued.values())
+        return self._queued[priority]
+
+    async def acquire(self, chat_id, priority: int = INTERACTIVE):
+        if self._queued[priority] >= self.max_queue[priority]:
+            self.stats["rejected"] += 1
+            raise SendQueueFull(f"Очередь отправки переполнена (приоритет {priority})")
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (priority, next(self._seq), chat_id, future))
+        self._queued[priority] += 1
+        self._wakeup.set()
+        started = time.monotonic()
+        try:
+            await future
+        finally:
+            # Запрос покидает очередь и при выдаче разрешения, и при отмене; отменённая
+            # запись остаётся в куче и выбрасывается, когда дойдёт до её вершины
+            self._queued[priority] -= 1
+            self.stats["wait_ms"] += int((time.monotonic() - started) * 1000)
+
+    def _grant_next(self, now: float) -> float:
+        # Выдаёт разрешение первому готовому запросу; возвращает, сколько ждать до следующего.
+        # Запросы в чаты, исчерпавшие лимит, откладываются в _waiting до момента, когда лимит
+        # восстановится, поэтому каждый запрос просматривается за O(log n), а не вся очередь.
+        while self._waiting and self._waiting[0][0] <= now:
+            heapq.heappush(self._heap, heapq.heappop(self._waiting)[1])
+        delay = self.global_bucket.wait_time(now)
+        if delay > 0:
+            return delay
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            _, _, chat_id, future = entry
+            if future.done():
+                continue
+            bucket = self._chat_bucket(chat_id)
+            chat_delay = bucket.wait_time(now)
+            if chat_delay > 0:
+                heapq.heappush(self._waiting, (now + chat_delay, entry))
+                continue
+            self.global_bucket.consume(now)
+            bucket.consume(now)
+            future.set_result(None)
+            return 0.0
+        return self._waiting[0][0] - now if self._waiting else float("inf")
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self._heap and not self._waiting:
+                await self._wakeup.wait()
+                continue
+            delay = self._grant_next(time.monotonic())
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=min(delay, 1.0))
+                except asyncio.TimeoutError:
+                    pass
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # getUpdates, answerCallbackQuery и т.п. не расходуют лимиты сообщений
+            return await make_request(bot, method)
+        priority = INTERACTIVE if chat_id == current_chat.get() else NOTIFICATION
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(chat_id, priority)
+            try:
+                response = await make_request(bot, method)
+                self.stats["sent"] += 1
+                return response
+            except TelegramRetryAfter as e:
+                self.stats["retry_after"] += 1
+                logger.warning(f"RetryAfter {e.retry_after} c для чата {chat_id}, попытка {attempt + 1}")
+                self._chat_bucket(chat_id).block(e.retry_after)
+                if attempt == self.max_retries:
+                    raise
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+        for _, _, _, future in self._heap + [entry for _, entry in self._waiting]:
+            if not future.done():
+                future.cancel()
+        self._heap.clear()
+        self._waiting.clear()
+
+
+class CurrentChatMiddleware(BaseMiddleware):
+    # Запоминает чат апдейта, чтобы планировщик отличал ответы от уведомлений
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        chat = data.get("event_chat")
+        token = current_chat.set(chat.id if chat else None)
+        try:
+            return await handler(event, data)
+        finally:
+            current_chat.reset(token)
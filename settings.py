@@ -0,0 +1,72 @@
+import logging
+
+from db import Database
+from events import SETTING_CHANGED
+
+logger = logging.getLogger(__name__)
+
+# Типы значений таблицы settings; всё остальное - строки
+SETTING_TYPES = {
+    'moderation_enabled': bool,
+    'post_delay': int,
+}
+
+
+def _parse(key: str, value: str):
+    kind = SETTING_TYPES.get(key, str)
+    if value is None:
+        return None
+    if kind is bool:
+        return value == '1'
+    return kind(value)
+
+
+def _serialize(value) -> str:
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return str(value)
+
+
+class Settings:
+    """Настройки бота в памяти. Читаются из БД один раз, изменения пишутся сразу в БД."""
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._values = {}
+
+    async def load(self):
+        self._values = {key: _parse(key, value) for key, value in await self.db.get_settings()}
+        logger.info(f"Загружено настроек: {len(self._values)}")
+
+    def get(self, key: str, default=None):
+        return self._values.get(key, default)
+
+    async def set(self, key: str, value):
+        await self.db.set_setting(key, _serialize(value))
+        self._values[key] = _parse(key, _serialize(value))
+        self.db.events.publish(SETTING_CHANGED, key=key, value=self._values[key])
+
+    def subscribe(self, callback):
+        # callback(key=..., value=...) после каждого изменения настройки
+        self.db.events.subscribe(SETTING_CHANGED, callback)
+
+    @property
+    def welcome_message(self) -> str:
+        return self._values.get('welcome_message')
+
+    @property
+    def rules(self) -> str:
+        return self._values.get('rules')
+
+    @property
+    def info(self) -> str:
+        return self._values.get('info')
+
+    @property
+    def moderation_enabled(self) -> bool:
+        return self._values.get('moderation_enabled', False)
+
+    @property
+    def post_delay(self) -> int:
+        # В минутах
+        return self._values.get('post_delay', 5)
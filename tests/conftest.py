@@ -0,0 +1,30 @@
+import os
+import sqlite3
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import apply_migrations  # noqa: E402
+
+USERS = 10
+POSTS = 20
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    # Схема всех миграций, пользователи 1..USERS, одобренные посты 1..POSTS: автор поста - post_id % USERS + 1
+    path = str(tmp_path / "test.db")
+    conn = sqlite3.connect(path)
+    apply_migrations(conn)
+    conn.executemany("INSERT INTO users (user_id, username, joined_at) VALUES (?, ?, '2024-01-01T00:00:00')",
+                     [(user_id, f"user_{user_id}") for user_id in range(1, USERS + 1)])
+    conn.executemany("INSERT INTO posts (post_id, user_id, title, content, created_at, status) "
+                     "VALUES (?, ?, ?, 'Текст', ?, 'approved')",
+                     [(post_id, post_id % USERS + 1, f"История {post_id}", f"2024-01-01T00:00:{post_id:02d}")
+                      for post_id in range(1, POSTS + 1)])
+    conn.commit()
+    conn.close()
+    return path
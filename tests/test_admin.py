@@ -0,0 +1,75 @@
+import asyncio
+import sqlite3
+
+from admin import queue_summary
+from db import Database
+from events import POST_PUBLISHED
+
+
+def _add_pending(path, post_ids):
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO posts (post_id, user_id, title, content, created_at, status) "
+                     "VALUES (?, 1, ?, 'Текст', ?, 'pending')",
+                     [(post_id, f"Заявка {post_id}", f"2024-01-02T00:00:{post_id:02d}") for post_id in post_ids])
+    conn.commit()
+    conn.close()
+
+
+def _statuses(path):
+    conn = sqlite3.connect(path)
+    try:
+        return dict(conn.execute("SELECT post_id, status FROM posts WHERE post_id > 20"))
+    finally:
+        conn.close()
+
+
+def test_batch_decides_only_posts_still_pending(db_path):
+    _add_pending(db_path, range(21, 26))
+
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        published = []
+        db.events.subscribe(POST_PUBLISHED, lambda **event: published.append(event))
+        queue = await db.get_moderation_queue()
+        approved = await db.moderate_posts([21, 22, 23], 'approved')
+        # 22 уже одобрен другим администратором, 1 - давно опубликованный пост
+        returned = await db.moderate_posts([22, 24, 1], 'returned')
+        empty = await db.moderate_posts([], 'approved')
+        left = await db.get_moderation_queue()
+        await db.close()
+        return queue, approved, returned, empty, left, published
+
+    queue, approved, returned, empty, left, published = asyncio.run(main())
+    assert queue == (5, "2024-01-02T00:00:21")
+    assert approved == [(21, 1, "Заявка 21"), (22, 1, "Заявка 22"), (23, 1, "Заявка 23")]
+    assert returned == [(24, 1, "Заявка 24")] and empty == []
+    assert left == (1, "2024-01-02T00:00:25")
+    assert _statuses(db_path) == {21: "approved", 22: "approved", 23: "approved", 24: "returned", 25: "pending"}
+    # Пост встаёт в ленту по времени создания
+    assert [(event["post_id"], event["created_at"]) for event in published] == [
+        (21, "2024-01-02T00:00:21"), (22, "2024-01-02T00:00:22"), (23, "2024-01-02T00:00:23")]
+
+
+def test_pending_page_walks_the_queue_oldest_first(db_path):
+    _add_pending(db_path, range(21, 30))
+
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        first = await db.get_pending_page(limit=4)
+        second = await db.get_pending_page(first.next_cursor, limit=4)
+        await db.moderate_posts([row[0] for row in first.posts], 'approved')
+        # Курсор второй страницы остаётся верным после решения по первой
+        again = await db.get_pending_page(first.next_cursor, limit=4)
+        await db.close()
+        return first, second, again
+
+    first, second, again = asyncio.run(main())
+    assert [row[0] for row in first.posts] == [21, 22, 23, 24]
+    assert [row[0] for row in second.posts] == [25, 26, 27, 28] == [row[0] for row in again.posts]
+
+
+def test_queue_summary():
+    assert queue_summary(0, None) == "Очередь модерации пуста"
+    assert queue_summary(3, "2000-01-01T00:00:00").startswith("На модерации: 3, самый старый ждёт ")
@@ -0,0 +1,59 @@
+import pytest
+
+import callbacks
+from callbacks import (encode_callback, decode_callback, CallbackData, MAX_BYTES, READ, LIKE, DELETE, FEED_MORE,
+                       MY_POSTS_MORE, SEARCH_MORE, TRENDING_MORE, ADMIN_DELETE, FEED, MY_POSTS)
+from pagination import encode_cursor, encode_rank_cursor, encode_search_cursor
+
+
+@pytest.mark.parametrize("action", sorted(callbacks._CODES))
+def test_every_action_roundtrips(action):
+    assert decode_callback(encode_callback(action, 123456789, FEED)) == CallbackData(action, 123456789, FEED)
+    assert decode_callback(encode_callback(action)) == CallbackData(action)
+
+
+@pytest.mark.parametrize("action, cursor", [
+    (FEED_MORE, encode_cursor("2024-05-06T07:08:09.123456", 2 ** 40)),
+    (SEARCH_MORE, encode_search_cursor(2 ** 40, 2 ** 40 - 5000, -1.2345678901234567e+300, 2 ** 40)),
+    (TRENDING_MORE, encode_rank_cursor(-1.2345678901234567e+300, 2 ** 40)),
+])
+def test_cursors_fit_telegram_limit(action, cursor):
+    data = encode_callback(action, cursor=cursor)
+    assert len(data.encode()) <= MAX_BYTES
+    assert decode_callback(data) == CallbackData(action, cursor=cursor)
+
+
+def test_short_form():
+    assert encode_callback(READ, 95, FEED) == "1r:2n:f"
+
+
+def test_too_long_data_is_refused():
+    with pytest.raises(ValueError):
+        encode_callback(FEED_MORE, cursor="x" * MAX_BYTES)
+
+
+@pytest.mark.parametrize("data, expected", [
+    ("read_12", CallbackData(READ, 12)),
+    ("like_7", CallbackData(LIKE, 7)),
+    ("admin_delete_5", CallbackData(ADMIN_DELETE, 5)),
+    ("delete_5", CallbackData(DELETE, 5)),
+    ("load_more", CallbackData(FEED_MORE)),
+    ("load_more_my_posts", CallbackData(MY_POSTS_MORE)),
+])
+def test_legacy_buttons_still_work(data, expected):
+    assert decode_callback(data) == expected
+
+
+@pytest.mark.parametrize("data", [
+    "", "9r", "1?", "1r:1:f:c:extra", "unknown_5",
+    # Курсор не того формата для действия
+    "1f::::", "1f:::zz", "1s:::1.2", "1p:::abc~1",
+])
+def test_malformed_data_is_rejected(data):
+    with pytest.raises(ValueError):
+        decode_callback(data)
+
+
+def test_my_posts_origin_survives_roundtrip():
+    cb = decode_callback(encode_callback(LIKE, 1, MY_POSTS))
+    assert cb.origin == MY_POSTS
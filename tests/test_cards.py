@@ -0,0 +1,22 @@
+import pytest
+
+from callbacks import decode_callback, READ, FEED, TRENDING, UNREAD, SEARCH, RANDOM
+from cards import build_card, FEED_CARD, TRENDING_CARD, UNREAD_CARD, SEARCH_CARD, RANDOM_CARD, FULL_CARD, PREVIEW_LENGTH
+
+
+@pytest.mark.parametrize("view, origin", [(FEED_CARD, FEED), (TRENDING_CARD, TRENDING), (UNREAD_CARD, UNREAD),
+                                          (SEARCH_CARD, SEARCH), (RANDOM_CARD, RANDOM)])
+def test_read_button_carries_origin_of_the_list(view, origin):
+    card = build_card(view, 7, "Заголовок", "Текст", "author", [])
+    cb = decode_callback(card.keyboard.inline_keyboard[0][0].callback_data)
+    assert (cb.action, cb.post_id, cb.origin) == (READ, 7, origin)
+
+
+def test_preview_is_cut_and_escaped_full_card_is_not():
+    content = "<b>" + "х" * PREVIEW_LENGTH
+    preview = build_card(FEED_CARD, 1, "A & B", content, "author", [("bob", "hi")])
+    assert "A &amp; B" in preview.text and "&lt;b&gt;" in preview.text
+    assert "х" * (PREVIEW_LENGTH - 3) + "..." in preview.text
+    assert "@bob: hi" in preview.text
+    full = build_card(FULL_CARD, 1, "A", content, "author", [])
+    assert "х" * PREVIEW_LENGTH in full.text and full.keyboard is None
@@ -0,0 +1,75 @@
+import asyncio
+import sqlite3
+import time
+
+import counters
+from counters import CounterReconciler
+from db import Database
+from events import POST_DELETED
+
+
+def test_reconciler_repairs_drift(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO reactions (user_id, post_id, reaction) VALUES (1, 1, 'like')")
+    conn.execute("UPDATE posts SET likes = 7 WHERE post_id = 1")
+    conn.execute("UPDATE users SET likes = 7 WHERE user_id = 2")
+    conn.commit()
+    conn.close()
+
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        report = await CounterReconciler(db, chunk_size=3, pause=0).run_once()
+        await db.close()
+        return report
+
+    assert asyncio.run(main()) == {"posts": 1, "users": 1}
+    conn = sqlite3.connect(db_path)
+    assert conn.execute("SELECT likes FROM posts WHERE post_id = 1").fetchone() == (1,)
+    assert conn.execute("SELECT likes FROM users WHERE user_id = 2").fetchone() == (1,)
+    conn.close()
+
+
+def test_close_waits_for_running_chunk(db_path, monkeypatch):
+    finished = []
+
+    def slow_chunk(conn, after_id, limit, repair):
+        time.sleep(0.2)
+        finished.append(after_id)
+        return None, []
+
+    monkeypatch.setattr(counters, "reconcile_posts_chunk", slow_chunk)
+
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        reconciler = CounterReconciler(db)
+        reconciler.start()
+        await asyncio.sleep(0.05)
+        await reconciler.close()
+        assert finished == [-1]
+        await db.close()
+
+    asyncio.run(main())
+
+
+def test_repeated_delete_publishes_one_event(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO reactions (user_id, post_id, reaction) VALUES (1, 1, 'like')")
+    conn.commit()
+    conn.close()
+
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        deleted = []
+        db.events.subscribe(POST_DELETED, lambda post_id: deleted.append(post_id))
+        results = [await db.delete_post(1), await db.delete_post(1), await db.delete_post(999)]
+        await db.close()
+        return results, deleted
+
+    assert asyncio.run(main()) == ([True, False, False], [1])
+    conn = sqlite3.connect(db_path)
+    # Триггер удаления снял лайк с автора один раз
+    assert conn.execute("SELECT likes, posts_count FROM users WHERE user_id = 2").fetchone() == (0, 1)
+    conn.close()
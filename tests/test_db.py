@@ -0,0 +1,98 @@
+import asyncio
+import threading
+import time
+
+from db import Database
+
+
+def _run(db_path, scenario):
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        try:
+            return await scenario(db)
+        finally:
+            await db.close()
+
+    return asyncio.run(main())
+
+
+def test_slow_query_does_not_block_the_event_loop(db_path):
+    def slow(conn):
+        time.sleep(0.3)
+        return threading.current_thread() is threading.main_thread(), conn.execute(
+            "SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    async def scenario(db):
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        result = await db.run_sync(slow)
+        task.cancel()
+        return result, ticks
+
+    (in_loop_thread, count), ticks = _run(db_path, scenario)
+    assert not in_loop_thread and count == 20
+    # Пока запрос шёл в потоке БД, цикл событий продолжал работать
+    assert ticks >= 10
+
+
+def test_comments_come_back_newest_first(db_path):
+    async def scenario(db):
+        for text in ("первый", "второй", "третий"):
+            await db.add_comment(1, 3, "user_3", text)
+        return await db.get_latest_comments(1, 2), await db.get_latest_comments(2)
+
+    latest, none = _run(db_path, scenario)
+    assert latest == [("user_3", "третий"), ("user_3", "второй")] and none == []
+
+
+def test_reads_do_not_wait_for_the_writer(db_path):
+    def long_write(conn):
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("UPDATE posts SET title = 'Черновик' WHERE post_id = 1")
+        time.sleep(0.5)
+        conn.commit()
+
+    async def scenario(db):
+        mode = await db.run_sync(lambda conn: conn.execute("PRAGMA journal_mode").fetchone()[0])
+        writing = asyncio.create_task(db.run_sync(long_write))
+        await asyncio.sleep(0.1)
+        started = time.perf_counter()
+        # Читатель видит последнее зафиксированное состояние, не дожидаясь конца транзакции
+        during = await db.get_post_author_title(1)
+        elapsed = time.perf_counter() - started
+        busy = not writing.done()
+        await writing
+        after = await db.get_post_author_title(1)
+        return mode, during, elapsed, busy, after
+
+    mode, during, elapsed, busy, after = _run(db_path, scenario)
+    assert mode == "wal"
+    assert during == (2, "История 1") and busy and elapsed < 0.3
+    assert after == (2, "Черновик")
+
+
+def test_feed_page_loads_comments_in_one_batch(db_path):
+    async def scenario(db):
+        for post_id, text in ((1, "a"), (1, "b"), (1, "c"), (2, "d")):
+            await db.add_comment(post_id, 3, "user_3", text)
+        first = await db.get_feed_page(limit=3, comments_limit=2)
+        pages = [first]
+        while pages[-1].next_cursor:
+            pages.append(await db.get_feed_page(pages[-1].next_cursor, limit=3, comments_limit=0))
+        return pages
+
+    pages = _run(db_path, scenario)
+    first = pages[0]
+    assert [row[0] for row in first.posts] == [1, 2, 3]
+    assert first.comments == {1: [("user_3", "c"), ("user_3", "b")], 2: [("user_3", "d")], 3: []}
+    # LIMIT + 1: курсор следующей страницы есть, только если за ней что-то осталось
+    assert [row[0] for page in pages for row in page.posts] == list(range(1, 21))
+    assert len(pages) == 7 and pages[-1].next_cursor is None
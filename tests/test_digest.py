@@ -0,0 +1,114 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta
+
+from db import Database
+from digest import DigestAggregator, digest_text, MAX_LINES
+from notifications import NotificationQueue
+
+
+def _outbox(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT chat_id, text, dedup_key FROM notification_outbox ORDER BY id").fetchall()
+    finally:
+        conn.close()
+
+
+def _run(db_path, scenario):
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        try:
+            return await scenario(db)
+        finally:
+            await db.close()
+
+    return asyncio.run(main())
+
+
+def _aggregator(db):
+    digests = DigestAggregator(db, NotificationQueue(db, None))
+    digests.attach(db.events)
+    return digests
+
+
+def test_digest_text():
+    text = digest_text({1: [37, 0], 2: [1, 5], 3: [0, 1], 4: [2, 0]}, {1: "Первая", 2: "Вторая", 3: "Третья"})
+    assert text.splitlines() == ["Новое у ваших историй:", "+37 ❤️ к «Первая»",
+                                 "+1 ❤️, 5 новых комментариев к «Вторая»", "1 новый комментарий к «Третья»"]
+    # Все посты удалены - сводки нет
+    assert digest_text({4: [2, 0]}, {}) is None
+    many = digest_text({post_id: [1, 0] for post_id in range(MAX_LINES + 3)},
+                       {post_id: str(post_id) for post_id in range(MAX_LINES + 3)})
+    assert many.endswith("...и ещё историй: 3")
+
+
+def test_events_become_one_digest_per_author(db_path):
+    async def scenario(db):
+        digests = _aggregator(db)
+        # Автор поста 1 - пользователь 2, поста 11 - тоже 2, поста 3 - пользователь 4
+        await db.add_likes([(5, 1), (6, 1), (7, 11), (2, 1), (5, 3)])
+        await db.add_comment(1, 8, "user_8", "Класс")
+        await db.set_digest_interval(4, 0)
+        assert await digests.run_once(datetime.now()) == 0
+        sent = await digests.run_once(datetime.now() + timedelta(hours=2))
+        return sent, digests.metrics()
+
+    sent, metrics = _run(db_path, scenario)
+    assert sent == 1
+    [(chat_id, text, key)] = _outbox(db_path)
+    assert chat_id == 2 and key.startswith("digest:2:")
+    assert "+2 ❤️, 1 новый комментарий к «История 1»" in text and "+1 ❤️ к «История 11»" in text
+    # Свой лайк автора не считается, выключившему сводки ничего не уходит
+    assert (metrics["events"], metrics["included"], metrics["dropped"]) == (5, 4, 1)
+    assert metrics["сэкономлено вызовов"] == 3
+
+
+def test_checkpoint_survives_restart(db_path):
+    async def before_restart(db):
+        digests = _aggregator(db)
+        await db.add_likes([(5, 1), (6, 3)])
+        await digests.close()
+
+    async def after_restart(db):
+        digests = _aggregator(db)
+        await digests.load()
+        assert digests.metrics()["авторов ждут"] == 2
+        await db.add_likes([(7, 1)])
+        return await digests.run_once(datetime.now() + timedelta(hours=2))
+
+    _run(db_path, before_restart)
+    assert _run(db_path, after_restart) == 2
+    texts = {chat_id: text for chat_id, text, _ in _outbox(db_path)}
+    assert "+2 ❤️ к «История 1»" in texts[2] and "+1 ❤️ к «История 3»" in texts[4]
+
+
+def test_sent_digest_is_not_repeated_after_restart(db_path):
+    async def first_run(db):
+        digests = _aggregator(db)
+        await db.add_likes([(5, 1)])
+        await digests.checkpoint()
+        # Сводка ушла в очередь, а процесс упал до следующей контрольной точки
+        assert await digests.run_once(datetime.now() + timedelta(hours=2)) == 1
+
+    async def second_run(db):
+        digests = _aggregator(db)
+        await digests.load()
+        return digests.metrics()["авторов ждут"], await digests.run_once(datetime.now() + timedelta(hours=2))
+
+    _run(db_path, first_run)
+    assert _run(db_path, second_run) == (0, 0)
+    assert len(_outbox(db_path)) == 1
+
+
+def test_daily_interval_waits(db_path):
+    async def scenario(db):
+        digests = _aggregator(db)
+        await db.set_digest_interval(2, 24 * 60)
+        await db.add_likes([(5, 1)])
+        early = await digests.run_once(datetime.now() + timedelta(hours=2))
+        late = await digests.run_once(datetime.now() + timedelta(days=1, minutes=1))
+        return early, late
+
+    assert _run(db_path, scenario) == (0, 1)
@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+
+from db import PostPage
+from events import EventBus, POST_PUBLISHED, POST_DELETED
+from feed_cache import FeedPageCache
+
+
+class FakeDb:
+    # Страница ленты - номер запроса к БД; курсор следующей страницы - "<cursor>+"
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = 0
+        self.fail = None
+        self.release = None
+
+    async def get_feed_page(self, cursor=None, comments_limit=3):
+        self.calls += 1
+        call = self.calls
+        if self.release is not None:
+            await self.release.wait()
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise self.fail
+        return PostPage([call], {}, (cursor or "") + "+", None)
+
+
+def test_pages_are_cached_until_the_feed_changes():
+    async def main():
+        db, events = FakeDb(), EventBus()
+        cache = FeedPageCache(db, pages=2)
+        cache.attach(events)
+        first = await cache.get_page()
+        again = await cache.get_page()
+        second = await cache.get_page(first.next_cursor)
+        # Третья страница глубже pages - всегда из БД
+        await cache.get_page(second.next_cursor)
+        await cache.get_page(second.next_cursor)
+        events.publish(POST_PUBLISHED, post_id=1, user_id=1, created_at="2024-01-01T00:00:00")
+        fresh = await cache.get_page()
+        events.publish(POST_DELETED, post_id=1)
+        return first, again, fresh, cache, db
+
+    first, again, fresh, cache, db = asyncio.run(main())
+    assert again is first
+    assert fresh.posts != first.posts
+    assert cache.version == 2
+    assert cache.stats["hits"] == 1 and cache.stats["bypass"] == 2
+    assert db.calls == 5
+
+
+def test_page_loaded_across_an_invalidation_is_not_cached():
+    async def main():
+        db = FakeDb()
+        db.release = asyncio.Event()
+        cache = FeedPageCache(db)
+        loading = asyncio.create_task(cache.get_page())
+        await asyncio.sleep(0)
+        cache.invalidate()
+        db.release.set()
+        stale = await loading
+        return stale, await cache.get_page()
+
+    stale, fresh = asyncio.run(main())
+    assert stale.posts == [1] and fresh.posts == [2]
+
+
+def test_concurrent_misses_share_one_query():
+    async def main():
+        db = FakeDb(delay=0.01)
+        cache = FeedPageCache(db)
+        pages = await asyncio.gather(*(cache.get_page() for _ in range(50)))
+        return pages, cache, db
+
+    pages, cache, db = asyncio.run(main())
+    assert db.calls == 1
+    assert all(page is pages[0] for page in pages)
+    assert cache.stats["misses"] == 1 and cache.stats["coalesced"] == 49
+    assert cache.metrics()["из памяти"] == "98.0%"
+
+
+def test_cancelled_leader_does_not_cancel_other_waiters():
+    async def main():
+        db = FakeDb()
+        db.release = asyncio.Event()
+        cache = FeedPageCache(db)
+        leader = asyncio.create_task(cache.get_page())
+        await asyncio.sleep(0)
+        followers = [asyncio.create_task(cache.get_page()) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        db.release.set()
+        pages = await asyncio.gather(*followers)
+        # Страница закэширована, хотя начавший загрузку запрос отменён
+        cached = await cache.get_page()
+        return leader, pages, cached, db
+
+    leader, pages, cached, db = asyncio.run(main())
+    assert leader.cancelled()
+    assert [page.posts for page in pages] == [[1]] * 3
+    assert cached is pages[0] and db.calls == 1
+
+
+def test_error_reaches_every_waiter_and_next_request_retries():
+    async def main():
+        db = FakeDb(delay=0.01)
+        db.fail = RuntimeError("database is locked")
+        cache = FeedPageCache(db)
+        results = await asyncio.gather(*(cache.get_page() for _ in range(3)), return_exceptions=True)
+        db.fail = None
+        return results, await cache.get_page(), db
+
+    results, page, db = asyncio.run(main())
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert page.posts == [2] and db.calls == 2
+
+
+@pytest.mark.parametrize("waiters", [0, 1])
+def test_failed_load_without_waiters_is_not_reported_as_unretrieved(waiters, caplog):
+    async def main():
+        db = FakeDb(delay=0.01)
+        db.fail = RuntimeError("boom")
+        cache = FeedPageCache(db)
+        tasks = [asyncio.create_task(cache.get_page()) for _ in range(1 + waiters)]
+        await asyncio.sleep(0)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0.02)
+
+    asyncio.run(main())
+    assert "exception was never retrieved" not in caplog.text
@@ -0,0 +1,218 @@
+import asyncio
+import logging
+import sqlite3
+import time
+
+import pytest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from fsm_storage import SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=5, user_id=5)
+
+
+async def _wizard(storage):
+    # Шаги мастера добавления истории, как в user.py
+    state = FSMContext(storage, KEY)
+    trace = [await state.get_state(), await state.get_data()]
+    await state.set_state("ProfileStates:add_post_title")
+    await state.update_data(title="Заголовок")
+    await state.set_state("ProfileStates:add_post_content")
+    await state.update_data(content="Текст", photo=None)
+    trace += [await state.get_state(), await state.get_data()]
+    await state.clear()
+    trace += [await state.get_state(), await state.get_data()]
+    return trace
+
+
+@pytest.mark.parametrize("shared", [True, False])
+def test_behaves_like_memory_storage(tmp_path, shared):
+    async def main():
+        expected = await _wizard(MemoryStorage())
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), shared=shared)
+        actual = await _wizard(storage)
+        await storage.close()
+        return expected, actual
+
+    expected, actual = asyncio.run(main())
+    assert actual == expected
+
+
+@pytest.mark.parametrize("shared", [True, False])
+def test_state_survives_restart_and_clear_removes_row(tmp_path, shared):
+    path = str(tmp_path / "fsm.db")
+
+    async def main():
+        storage = SQLiteStorage(path, shared=shared)
+        await storage.set_state(KEY, "ProfileStates:add_post_content")
+        await storage.set_data(KEY, {"title": "Заголовок"})
+        other = StorageKey(bot_id=1, chat_id=6, user_id=6)
+        await storage.set_state(other, "CommentStates:text")
+        await storage.set_state(other, None)
+        await storage.close()
+
+        storage = SQLiteStorage(path, shared=shared)
+        restored = await storage.get_state(KEY), await storage.get_data(KEY)
+        await storage.close()
+        return restored
+
+    assert asyncio.run(main()) == ("ProfileStates:add_post_content", {"title": "Заголовок"})
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM fsm_states").fetchone()[0] == 1
+
+
+def test_shared_write_is_visible_to_another_instance_on_return(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def main():
+        # Два процесса с общим файлом: у второго свой экземпляр хранилища
+        first, second = SQLiteStorage(path), SQLiteStorage(path)
+        await first.set_state(KEY, "ProfileStates:add_post_title")
+        await first.update_data(KEY, {"title": "Заголовок"})
+        seen = await second.get_state(KEY), await second.get_data(KEY)
+        await second.set_state(KEY, "ProfileStates:add_post_content")
+        seen_back = await first.get_state(KEY)
+        await first.close()
+        await second.close()
+        return seen, seen_back
+
+    seen, seen_back = asyncio.run(main())
+    assert seen == ("ProfileStates:add_post_title", {"title": "Заголовок"})
+    assert seen_back == "ProfileStates:add_post_content"
+
+
+def test_concurrent_shared_writes_share_transactions(tmp_path):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"))
+        keys = [StorageKey(bot_id=1, chat_id=user_id, user_id=user_id) for user_id in range(50)]
+        await asyncio.gather(*(storage.set_state(key, "S:one") for key in keys))
+        stats = dict(storage.stats)
+        await storage.close()
+        return stats
+
+    stats = asyncio.run(main())
+    assert stats["flushed_keys"] == 50
+    assert stats["flushes"] < 50
+
+
+def test_local_mode_coalesces_writes_until_flush(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def main():
+        storage = SQLiteStorage(path, shared=False, flush_interval=60)
+        for step in range(5):
+            await storage.set_state(KEY, f"S:step_{step}")
+        reader = SQLiteStorage(path)
+        before = await reader.get_state(KEY)
+        await storage.flush()
+        after = await reader.get_state(KEY)
+        stats = dict(storage.stats)
+        await storage.close()
+        await reader.close()
+        return before, after, stats
+
+    before, after, stats = asyncio.run(main())
+    assert (before, after) == (None, "S:step_4")
+    assert stats["coalesced"] == 4
+    assert stats["flushes"] == 1
+
+
+def test_idle_states_expire(tmp_path):
+    path = str(tmp_path / "fsm.db")
+
+    async def main():
+        storage = SQLiteStorage(path, ttl=3600)
+        fresh = StorageKey(bot_id=1, chat_id=6, user_id=6)
+        await storage.set_state(KEY, "S:old")
+        await storage.set_state(fresh, "S:fresh")
+        conn = sqlite3.connect(path)
+        conn.execute("UPDATE fsm_states SET updated_at = ? WHERE key = ?",
+                     (time.time() - 7200, storage.key_builder.build(KEY)))
+        conn.commit()
+        conn.close()
+        # Устаревшее состояние не читается ещё до удаления
+        expired = await storage.get_state(KEY)
+        evicted = await storage.evict_expired()
+        states = expired, await storage.get_state(fresh)
+        await storage.close()
+        return evicted, states
+
+    evicted, states = asyncio.run(main())
+    assert evicted == 1
+    assert states == (None, "S:fresh")
+
+
+def test_failed_shared_write_raises_and_is_retried(tmp_path, monkeypatch):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), flush_interval=0.01)
+        original = storage._write_batch
+        failures = [sqlite3.OperationalError("database is locked")]
+
+        def flaky(batch):
+            if failures:
+                raise failures.pop()
+            original(batch)
+
+        monkeypatch.setattr(storage, "_write_batch", flaky)
+        with pytest.raises(sqlite3.OperationalError):
+            await storage.set_state(KEY, "S:one")
+        # Процесс видит своё изменение, фоновый повтор записывает его в БД
+        local = await storage.get_state(KEY)
+        await asyncio.sleep(1.2)
+        reader = SQLiteStorage(storage.path)
+        stored = await reader.get_state(KEY)
+        await reader.close()
+        await storage.close()
+        return local, stored
+
+    assert asyncio.run(main()) == ("S:one", "S:one")
+
+
+def test_close_retries_and_logs_lost_states(tmp_path, monkeypatch, caplog):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), shared=False, flush_interval=60)
+        attempts = []
+
+        def broken(batch):
+            attempts.append(len(batch))
+            raise sqlite3.OperationalError("disk I/O error")
+
+        monkeypatch.setattr(storage, "_write_batch", broken)
+        await storage.set_state(KEY, "S:one")
+        await storage.close(retries=2, retry_delay=0.01)
+        return attempts, storage
+
+    with caplog.at_level(logging.ERROR):
+        attempts, storage = asyncio.run(main())
+    assert attempts == [1, 1, 1]
+    assert storage.stats["lost"] == 1
+    assert "Потеряны несохранённые FSM-состояния (1)" in caplog.text
+    assert storage.key_builder.build(KEY) in caplog.text
+
+
+def test_cancelled_flush_keeps_the_batch(tmp_path, monkeypatch):
+    async def main():
+        storage = SQLiteStorage(str(tmp_path / "fsm.db"), shared=False, flush_interval=60)
+        original = storage._write_batch
+
+        def slow(batch):
+            time.sleep(0.05)
+            original(batch)
+
+        monkeypatch.setattr(storage, "_write_batch", slow)
+        await storage.set_state(KEY, "S:one")
+        task = asyncio.create_task(storage.flush())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        kept = storage.key_builder.build(KEY) in storage._pending
+        monkeypatch.setattr(storage, "_write_batch", original)
+        await storage.close()
+        reader = SQLiteStorage(storage.path)
+        stored = await reader.get_state(KEY)
+        await reader.close()
+        return kept, stored
+
+    assert asyncio.run(main()) == (True, "S:one")
@@ -0,0 +1,105 @@
+import asyncio
+import sqlite3
+from datetime import datetime
+
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update
+
+from db import Database
+from middlewares import BLOCKED_TEXT, UserStatusCache, UserStatusMiddleware
+
+
+class _Session(BaseSession):
+    # Запоминает запросы к Bot API вместо отправки
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls.append((type(method).__name__, method.model_dump(exclude_none=True)))
+        return True
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": "u"}
+
+
+def _message(update_id, user_id):
+    return Update.model_validate({"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(datetime.now().timestamp()), "text": "Лента",
+        "chat": {"id": user_id, "type": "private"}, "from": _user(user_id)}})
+
+
+def _callback(update_id, user_id):
+    return Update.model_validate({"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": _user(user_id), "chat_instance": "x", "data": "like"}})
+
+
+def test_cache_follows_status_changes(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE users SET is_admin = 1 WHERE user_id = 3")
+    conn.execute("UPDATE users SET is_blocked = 1 WHERE user_id = 4")
+    conn.commit()
+    conn.close()
+
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        cache = UserStatusCache()
+        cache.attach(db.events)
+        await cache.load(db)
+        loaded = cache.is_admin(3), cache.is_admin(4), cache.is_blocked(4), cache.is_blocked(5)
+        # Блокировка из админки меняет кэш без перечитывания БД
+        await db.block_user("user_5")
+        await db.unblock_user("user_4")
+        assert await db.block_user("nobody") is None
+        changed = cache.is_blocked(5), cache.is_blocked(4)
+        await db.close()
+        return loaded, changed
+
+    loaded, changed = asyncio.run(main())
+    assert loaded == (True, False, True, False)
+    assert changed == (True, False)
+
+
+def test_blocked_user_is_stopped_before_handlers():
+    async def main():
+        cache = UserStatusCache()
+        cache.update(1, is_blocked=True)
+        cache.update(2, is_admin=True)
+        dp = Dispatcher()
+        middleware = UserStatusMiddleware(cache)
+        dp.message.outer_middleware(middleware)
+        dp.callback_query.outer_middleware(middleware)
+        handled = []
+
+        @dp.message()
+        async def on_message(message, is_admin):
+            handled.append((message.from_user.id, is_admin))
+
+        @dp.callback_query()
+        async def on_callback(callback, is_admin):
+            handled.append((callback.from_user.id, is_admin))
+
+        session = _Session()
+        bot = Bot("123456:" + "A" * 35, session=session)
+        for update in (_message(1, 1), _message(2, 2), _message(3, 3), _callback(4, 1), _callback(5, 3)):
+            await dp.feed_update(bot, update)
+        # Снятие прав и разблокировка действуют на следующий же апдейт
+        cache.update(2, is_admin=False)
+        cache.update(1, is_blocked=False)
+        await dp.feed_update(bot, _message(6, 2))
+        await dp.feed_update(bot, _message(7, 1))
+        return handled, session.calls
+
+    handled, calls = asyncio.run(main())
+    assert handled == [(2, True), (3, False), (3, False), (2, False), (1, False)]
+    assert [(name, data.get("text"), data.get("show_alert")) for name, data in calls] == [
+        ("SendMessage", BLOCKED_TEXT, None), ("AnswerCallbackQuery", BLOCKED_TEXT, True)]
@@ -0,0 +1,71 @@
+import sqlite3
+from datetime import datetime
+
+import migrations
+from migrations import MIGRATIONS, apply_migrations, get_schema_version
+
+
+def _schema(conn):
+    return sorted(conn.execute("SELECT type, name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"))
+
+
+def test_fresh_database_reaches_latest_version(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "fresh.db"))
+    assert apply_migrations(conn) == MIGRATIONS[-1][0]
+    versions = [row[0] for row in conn.execute("SELECT version FROM schema_version ORDER BY version")]
+    assert versions == [version for version, _, _ in MIGRATIONS]
+    conn.close()
+
+
+def test_second_run_changes_nothing(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "again.db"))
+    apply_migrations(conn)
+    schema = _schema(conn)
+    rows = conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()
+    assert apply_migrations(conn) == MIGRATIONS[-1][0]
+    assert _schema(conn) == schema
+    assert conn.execute("SELECT COUNT(*) FROM schema_version").fetchone() == rows
+    conn.close()
+
+
+def test_old_database_keeps_data_and_gets_counters_right(tmp_path, monkeypatch):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    # База прежней версии: только исходная схема
+    monkeypatch.setattr(migrations, "MIGRATIONS", MIGRATIONS[:1])
+    apply_migrations(conn)
+    conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'user_1')")
+    conn.execute("INSERT INTO posts (post_id, user_id, title, content, status, created_at) "
+                 "VALUES (1, 1, 'Заголовок', 'Текст', 'approved', ?)", (datetime.now().isoformat(),))
+    conn.commit()
+    monkeypatch.undo()
+
+    assert apply_migrations(conn) == MIGRATIONS[-1][0]
+    assert conn.execute("SELECT title FROM posts WHERE post_id = 1").fetchone() == ("Заголовок",)
+    # Существующий пост попал в поисковый индекс и популярное, новые реакции считают триггеры
+    assert conn.execute("SELECT rowid FROM posts_fts WHERE posts_fts MATCH 'текст'").fetchall() == [(1,)]
+    assert conn.execute("SELECT COUNT(*) FROM post_scores").fetchone() == (1,)
+    conn.execute("INSERT INTO reactions (user_id, post_id, reaction) VALUES (1, 1, 'like')")
+    assert conn.execute("SELECT likes FROM posts WHERE post_id = 1").fetchone() == (1,)
+    conn.close()
+
+
+def test_failed_migration_is_rolled_back(tmp_path, monkeypatch):
+    conn = sqlite3.connect(str(tmp_path / "broken.db"))
+    monkeypatch.setattr(migrations, "MIGRATIONS", MIGRATIONS[:2] + [(3, "broken", "CREATE INDEX broken ON nowhere(x)")])
+    try:
+        apply_migrations(conn)
+    except sqlite3.OperationalError:
+        pass
+    assert get_schema_version(conn) == 2
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'broken'").fetchone() is None
+    conn.close()
+
+
+def test_feed_query_uses_index(db_path):
+    conn = sqlite3.connect(db_path)
+    plan = " ".join(row[3] for row in conn.execute(
+        "EXPLAIN QUERY PLAN SELECT post_id FROM posts WHERE status = 'approved' "
+        "ORDER BY created_at, post_id LIMIT 11"))
+    assert "idx_posts_status_created" in plan and "TEMP B-TREE" not in plan
+    conn.close()
@@ -0,0 +1,152 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timedelta
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramNetworkError
+from aiogram.methods import SendMessage
+
+from db import Database
+from notifications import (NotificationQueue, MAX_MESSAGE, _join, due_notifications, purge_sent, requeue_dead,
+                           outbox_summary)
+
+
+class _Bot:
+    # chat_id -> исключение вместо отправки или (исключение, текст ошибки)
+    def __init__(self, failures=None):
+        self.failures = failures or {}
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        error = self.failures.get(chat_id)
+        if error is not None:
+            error, message = error if isinstance(error, tuple) else (error, "fail")
+            raise error(method=SendMessage(chat_id=chat_id, text=text), message=message)
+        self.sent.append((chat_id, text))
+
+
+def _rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {row[0]: row[1:] for row in conn.execute(
+            "SELECT dedup_key, status, attempts, last_error IS NOT NULL FROM notification_outbox")}
+    finally:
+        conn.close()
+
+
+def _run(db_path, bot, scenario, **options):
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        queue = NotificationQueue(db, bot, **options)
+        try:
+            return await scenario(db, queue)
+        finally:
+            await db.close()
+
+    return asyncio.run(main())
+
+
+def test_dedup_key_enqueues_once(db_path):
+    async def scenario(db, queue):
+        await queue.notify(1, "Одобрено", key="approved:5")
+        await queue.notify(1, "Одобрено", key="approved:5")
+        await queue.notify_many([(1, "Без ключа", None), (1, "Без ключа", None)])
+        return queue.stats
+
+    stats = _run(db_path, _Bot(), scenario)
+    assert (stats["queued"], stats["deduplicated"]) == (3, 1)
+
+
+def test_rows_for_one_chat_are_sent_as_one_message(db_path):
+    bot = _Bot()
+
+    async def scenario(db, queue):
+        await queue.notify_many([(1, "первое", "a"), (1, "второе", "b"), (2, "третье", "c")])
+        await queue.dispatch()
+
+    _run(db_path, bot, scenario)
+    assert sorted(bot.sent) == [(1, "первое\nвторое"), (2, "третье")]
+    assert {status for status, _, _ in _rows(db_path).values()} == {"sent"}
+
+
+def test_transient_failure_is_retried_later(db_path):
+    bot = _Bot({1: TelegramNetworkError})
+
+    async def scenario(db, queue):
+        await queue.notify(1, "текст", key="k")
+        delay = await queue.dispatch()
+        now = await db.run_sync(due_notifications, datetime.now(), 10)
+        later = await db.run_sync(due_notifications, datetime.now() + timedelta(seconds=61), 10)
+        return delay, now, later
+
+    delay, now, later = _run(db_path, bot, scenario, retry_base=60, poll_interval=30)
+    assert _rows(db_path)["k"] == ("pending", 1, 1)
+    # Диспетчер проснётся не позже poll_interval, строка станет готовой через retry_base
+    assert 0 < delay <= 30
+    assert now == [] and [row[3] for row in later] == [1]
+
+
+def test_max_attempts_make_row_dead(db_path):
+    bot = _Bot({1: TelegramNetworkError})
+
+    async def scenario(db, queue):
+        await queue.notify(1, "текст", key="k")
+        for _ in range(3):
+            await queue.dispatch()
+        return queue.metrics()
+
+    metrics = _run(db_path, bot, scenario, retry_base=0, max_attempts=3)
+    assert _rows(db_path)["k"] == ("dead", 3, 1)
+    assert metrics["мёртвые"] == 1 and metrics["ждут"] == 0
+
+
+def test_blocked_chat_is_dead_at_once_and_can_be_requeued(db_path):
+    bot = _Bot({1: TelegramForbiddenError})
+
+    async def scenario(db, queue):
+        await queue.notify_many([(1, "заблокирован", "a"), (2, "доставлено", "b")])
+        await queue.dispatch()
+        dead = _rows(db_path)
+        bot.failures.clear()
+        assert await db.run_sync(requeue_dead) == 1
+        await queue.dispatch()
+        return dead
+
+    dead = _run(db_path, bot, scenario)
+    assert dead == {"a": ("dead", 1, 1), "b": ("sent", 0, 0)}
+    assert _rows(db_path)["a"][0] == "sent"
+    assert (1, "заблокирован") in bot.sent
+
+
+def test_only_missing_chat_bad_request_is_permanent(db_path):
+    bot = _Bot({1: (TelegramBadRequest, "Bad Request: chat not found"),
+                2: (TelegramBadRequest, "Bad Request: can't parse entities")})
+
+    async def scenario(db, queue):
+        await queue.notify_many([(1, "нет чата", "a"), (2, "<b>", "b")])
+        await queue.dispatch()
+        return queue.stats
+
+    stats = _run(db_path, bot, scenario)
+    assert _rows(db_path) == {"a": ("dead", 1, 1), "b": ("pending", 1, 1)}
+    assert stats["dead"] == 1 and stats["bad_request"] == 1
+
+
+def test_old_sent_rows_are_purged(db_path):
+    async def scenario(db, queue):
+        await queue.notify(1, "текст", key="k")
+        await queue.dispatch()
+        kept = await db.run_sync(purge_sent, datetime.now() - timedelta(days=1), 100)
+        purged = await db.run_sync(purge_sent, datetime.now() + timedelta(seconds=1), 100)
+        return kept, purged, await db.run_sync(outbox_summary)
+
+    kept, purged, (counts, next_at) = _run(db_path, _Bot(), scenario)
+    assert (kept, purged, counts, next_at) == (0, 1, {}, None)
+
+
+def test_join_respects_message_limit():
+    items = [(row_id, "x" * 1500, 0) for row_id in range(5)]
+    messages = _join(items)
+    assert [len(items) for _, items in messages] == [2, 2, 1]
+    assert all(len(text) <= MAX_MESSAGE for text, _ in messages)
+    assert [row_id for _, items in messages for row_id, _ in items] == list(range(5))
@@ -0,0 +1,151 @@
+import asyncio
+import contextvars
+from types import SimpleNamespace
+
+from ordering import UserOrderMiddleware
+
+
+def _data(user_id):
+    return {"event_from_user": SimpleNamespace(id=user_id)}
+
+
+def test_same_user_in_order_other_users_in_parallel():
+    async def main():
+        middleware = UserOrderMiddleware()
+        log = []
+
+        async def handler(event, data):
+            log.append(("start", event))
+            await asyncio.sleep(0.05 if event == "slow" else 0)
+            log.append(("end", event))
+
+        for event, user_id in (("slow", 1), ("next", 1), ("other", 65)):
+            await middleware(handler, event, _data(user_id))
+        await middleware.close()
+        return log, middleware
+
+    log, middleware = asyncio.run(main())
+    # Второй апдейт пользователя ждёт первого, чужой - нет
+    assert log.index(("start", "next")) > log.index(("end", "slow"))
+    assert log.index(("end", "other")) < log.index(("end", "slow"))
+    assert middleware.metrics()["пользователей в обработке"] == 0
+    assert middleware.stats["handled"] == 3
+
+
+def test_burst_from_one_user_does_not_hold_workers():
+    async def main():
+        middleware = UserOrderMiddleware()
+        release = asyncio.Event()
+        done = []
+
+        async def handler(event, data):
+            if event[0] == 1:
+                await release.wait()
+            done.append(event)
+
+        # Два обработчика разбирают общую очередь, как в вебхуке
+        updates = asyncio.Queue()
+        for number in range(20):
+            updates.put_nowait((1, number))
+        updates.put_nowait((2, 0))
+
+        async def worker():
+            while not updates.empty():
+                event = updates.get_nowait()
+                await middleware(handler, event, _data(event[0]))
+
+        await asyncio.wait_for(asyncio.gather(worker(), worker()), timeout=1)
+        await asyncio.sleep(0)
+        metrics = middleware.metrics()
+        other_done = list(done)
+        release.set()
+        await middleware.close()
+        return metrics, other_done, done
+
+    metrics, other_done, done = asyncio.run(main())
+    assert other_done == [(2, 0)]
+    assert metrics["в очереди сейчас"] == 20
+    assert metrics["макс. глубина на пользователя"] == 20
+    assert metrics["очередь 1"].startswith("20 апд.")
+    assert done[1:] == [(1, number) for number in range(20)]
+
+
+def test_pending_updates_are_bounded():
+    async def main():
+        middleware = UserOrderMiddleware(max_pending=2)
+        release = asyncio.Event()
+
+        async def handler(event, data):
+            await release.wait()
+
+        await middleware(handler, "a", _data(1))
+        await middleware(handler, "b", _data(2))
+        third = asyncio.create_task(middleware(handler, "c", _data(3)))
+        await asyncio.sleep(0.01)
+        blocked = not third.done()
+        release.set()
+        await asyncio.wait_for(third, timeout=1)
+        await middleware.close()
+        return blocked, middleware.stats["handled"]
+
+    assert asyncio.run(main()) == (True, 3)
+
+
+def test_errors_are_logged_and_queue_released(caplog):
+    async def main():
+        middleware = UserOrderMiddleware()
+        handled = []
+
+        async def handler(event, data):
+            if event == "boom":
+                raise RuntimeError(event)
+            handled.append(event)
+
+        await middleware(handler, "boom", _data(1))
+        await middleware(handler, "after", _data(1))
+        await middleware.close()
+        return middleware, handled
+
+    middleware, handled = asyncio.run(main())
+    assert handled == ["after"]
+    assert middleware.stats["errors"] == 1
+    assert middleware._queues == {}
+    assert "Ошибка обработки апдейта пользователя 1" in caplog.text
+
+
+def test_handler_sees_context_of_its_update():
+    chat = contextvars.ContextVar("chat", default=None)
+
+    async def main():
+        middleware = UserOrderMiddleware()
+        seen = []
+
+        async def handler(event, data):
+            await asyncio.sleep(0)
+            seen.append((event, chat.get()))
+
+        for event in (10, 20):
+            token = chat.set(event)
+            await middleware(handler, event, _data(1))
+            chat.reset(token)
+        await middleware.close()
+        return seen
+
+    assert asyncio.run(main()) == [(10, 10), (20, 20)]
+
+
+def test_close_cancels_updates_past_timeout():
+    async def main():
+        middleware = UserOrderMiddleware()
+
+        async def handler(event, data):
+            await asyncio.sleep(10)
+
+        for event in range(3):
+            await middleware(handler, event, _data(1))
+        await middleware.close(timeout=0.01)
+        return middleware
+
+    middleware = asyncio.run(main())
+    assert middleware._queues == {}
+    assert middleware.metrics()["в очереди сейчас"] == 0
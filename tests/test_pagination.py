@@ -0,0 +1,92 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from pagination import (encode_cursor, decode_cursor, encode_rank_cursor, decode_rank_cursor, encode_search_cursor,
+                        decode_search_cursor, keyset_query, build_page, to_base36, from_base36)
+
+
+@pytest.mark.parametrize("value", [0, 1, 35, 36, 10 ** 12, -42])
+def test_base36_roundtrip(value):
+    assert from_base36(to_base36(value)) == value
+
+
+def test_cursor_roundtrip_keeps_microseconds():
+    cursor = encode_cursor("2024-05-06T07:08:09.123456", 123456)
+    assert decode_cursor(cursor) == ("2024-05-06T07:08:09.123456", 123456)
+    assert len(cursor) < 20
+
+
+def test_rank_cursor_roundtrip_is_exact():
+    score = -3.141592653589793
+    assert decode_rank_cursor(encode_rank_cursor(score, 77)) == (score, 77)
+
+
+def test_search_cursor_roundtrip():
+    assert decode_search_cursor(encode_search_cursor(5000, 10, -7.25, 42)) == (5000, 10, -7.25, 42)
+
+
+@pytest.mark.parametrize("token", ["", "1~2", "a~b~c~d", "-1~0~-1.0~1", "1~2~-1.0~1", "9~1~nan~1", "9~1~-1.0~-1"])
+def test_broken_search_cursor_raises_value_error(token):
+    with pytest.raises(ValueError):
+        decode_search_cursor(token)
+
+
+@pytest.mark.parametrize("token", ["", "abc", "1.2.3", "zz.", "1~2"])
+def test_broken_cursor_raises_value_error(token):
+    with pytest.raises(ValueError):
+        decode_cursor(token)
+
+
+def _page(conn, cursor=None, backward=False, limit=3):
+    query, params = keyset_query("SELECT post_id, created_at FROM posts WHERE status = 'approved'", cursor, backward)
+    rows = conn.execute(query, (*params, limit + 1)).fetchall()
+    return build_page(rows, limit, cursor, backward, key=lambda row: (row[1], row[0]))
+
+
+def test_forward_and_backward_pages_cover_feed_once():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE posts (post_id INTEGER PRIMARY KEY, created_at TEXT, status TEXT)")
+    # Одинаковое время у соседних постов: порядок задаёт post_id
+    conn.executemany("INSERT INTO posts VALUES (?, ?, 'approved')",
+                     [(post_id, f"2024-01-01T00:00:{post_id // 2:02d}") for post_id in range(1, 11)])
+
+    pages, cursor = [], None
+    while True:
+        page = _page(conn, cursor)
+        pages.append(page)
+        if page.next_cursor is None:
+            break
+        cursor = page.next_cursor
+    assert [row[0] for page in pages for row in page.rows] == list(range(1, 11))
+    assert pages[0].prev_cursor is None
+
+    # Назад с последней страницы возвращает те же страницы в обратном порядке
+    back = _page(conn, pages[-1].prev_cursor, backward=True)
+    assert back.rows == pages[-2].rows
+    assert back.next_cursor is not None
+
+
+def test_moderation_queue_pages_forward_and_back(db_path):
+    from db import Database
+
+    conn = sqlite3.connect(db_path)
+    conn.execute("UPDATE posts SET status = 'pending' WHERE post_id <= 7")
+    conn.commit()
+    conn.close()
+
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        first = await db.get_pending_page(limit=3)
+        second = await db.get_pending_page(first.next_cursor, limit=3)
+        back = await db.get_pending_page(second.prev_cursor, backward=True, limit=3)
+        await db.close()
+        return first, second, back
+
+    first, second, back = asyncio.run(main())
+    assert [row[0] for row in first.posts] == [1, 2, 3]
+    assert [row[0] for row in second.posts] == [4, 5, 6]
+    assert back.posts == first.posts
+    assert back.prev_cursor is None and back.next_cursor is not None
@@ -0,0 +1,94 @@
+import asyncio
+
+from prefetch import PagePrefetcher, approx_size
+
+
+async def _page(cursor):
+    return f"страница {cursor}"
+
+
+def test_take_counts_hits_misses_and_waste():
+    async def main():
+        prefetcher = PagePrefetcher()
+        prefetcher.prefetch(1, "feed", "c1", _page)
+        hit = await prefetcher.take(1, "feed", "c1")
+        # Уже забранная страница и список, который не предзагружался
+        again = await prefetcher.take(1, "feed", "c1")
+        other = await prefetcher.take(1, "my", "c1")
+        # Нажатие на кнопку старой страницы - загруженное не пригодилось
+        prefetcher.prefetch(1, "feed", "c2", _page)
+        stale = await prefetcher.take(1, "feed", "c1")
+        # Новая предзагрузка того же списка заменяет прежнюю
+        prefetcher.prefetch(1, "feed", "c3", _page)
+        prefetcher.prefetch(1, "feed", "c4", _page)
+        last = await prefetcher.take(1, "feed", "c4")
+        return prefetcher, hit, again, other, stale, last
+
+    prefetcher, hit, again, other, stale, last = asyncio.run(main())
+    assert hit == "страница c1" and last == "страница c4"
+    assert again is None and other is None and stale is None
+    assert prefetcher.stats["hits"] == 2
+    assert prefetcher.stats["misses"] == 3
+    assert prefetcher.stats["waste"] == 2
+    assert prefetcher.metrics()["в памяти"] == 0
+
+
+def test_expired_page_is_loaded_again():
+    async def main():
+        prefetcher = PagePrefetcher(ttl=0.01)
+        prefetcher.prefetch(1, "feed", "c1", _page)
+        prefetcher.prefetch(2, "feed", "c1", _page)
+        await asyncio.sleep(0.02)
+        expired = await prefetcher.take(1, "feed", "c1")
+        # Истёкшие записи других пользователей убираются при следующей предзагрузке
+        prefetcher.prefetch(3, "feed", "c1", _page)
+        return prefetcher, expired
+
+    prefetcher, expired = asyncio.run(main())
+    assert expired is None
+    assert prefetcher.stats["misses"] == 1 and prefetcher.stats["waste"] == 2
+    assert prefetcher.metrics()["в памяти"] == 1
+
+
+def test_failed_prefetch_is_a_miss():
+    async def broken(cursor):
+        raise RuntimeError("database is locked")
+
+    async def main():
+        prefetcher = PagePrefetcher()
+        prefetcher.prefetch(1, "feed", "c1", broken)
+        return prefetcher, await prefetcher.take(1, "feed", "c1")
+
+    prefetcher, result = asyncio.run(main())
+    assert result is None
+    assert prefetcher.stats["errors"] == 1 and prefetcher.stats["misses"] == 1
+
+
+def test_oldest_pages_are_evicted_by_size():
+    async def big(cursor):
+        return cursor, ["x" * 10_000]
+
+    async def main():
+        prefetcher = PagePrefetcher(max_bytes=25_000)
+        for user_id in range(1, 4):
+            prefetcher.prefetch(user_id, "feed", "c1", big)
+            await asyncio.sleep(0.01)
+        kb = prefetcher.metrics()["КБ"]
+        first = await prefetcher.take(1, "feed", "c1")
+        third = await prefetcher.take(3, "feed", "c1")
+        return prefetcher, kb, first, third
+
+    prefetcher, kb, first, third = asyncio.run(main())
+    # Третья страница не влезла в 25 КБ - вытеснена первая
+    assert first is None and third == ("c1", ["x" * 10_000])
+    assert prefetcher.stats["waste"] == 1
+    assert kb == approx_size(third) * 2 // 1024
+
+
+def test_approx_size_counts_nested_objects():
+    class Card:
+        def __init__(self, text):
+            self.text = text
+
+    text = "История " * 100
+    assert approx_size([Card(text)]) > approx_size(text) > len(text)
@@ -0,0 +1,152 @@
+import asyncio
+import sqlite3
+
+from db import Database
+from reactions import ReactionBuffer
+
+
+def _counters(path):
+    conn = sqlite3.connect(path)
+    try:
+        return (dict(conn.execute("SELECT post_id, likes FROM posts WHERE likes != 0")),
+                dict(conn.execute("SELECT user_id, likes FROM users WHERE likes != 0")),
+                conn.execute("SELECT COUNT(*) FROM counter_bypass").fetchone()[0])
+    finally:
+        conn.close()
+
+
+def test_buffered_likes_update_counters_once_per_post(db_path):
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        reactions = ReactionBuffer(db, flush_interval=10)
+        for user_id in range(1, 6):
+            assert await reactions.add_like(user_id, 1)
+            assert await reactions.add_like(user_id, 3)
+        assert not await reactions.add_like(1, 1)
+        await reactions.flush()
+        # Повтор уже записанного лайка отсекается до буфера
+        assert not await reactions.add_like(1, 1)
+        await reactions.close()
+        await db.close()
+
+    asyncio.run(main())
+    posts, users, bypass = _counters(db_path)
+    # Автор поста 1 - пользователь 2, поста 3 - пользователь 4
+    assert posts == {1: 5, 3: 5}
+    assert users == {2: 5, 4: 5}
+    assert bypass == 0
+
+
+def test_single_reaction_still_counted_by_trigger(db_path):
+    conn = sqlite3.connect(db_path)
+    conn.execute("INSERT INTO reactions (user_id, post_id, reaction) VALUES (1, 2, 'like')")
+    conn.execute("INSERT INTO reactions (user_id, post_id, reaction) VALUES (2, 2, 'dislike')")
+    conn.commit()
+    assert conn.execute("SELECT likes, dislikes FROM posts WHERE post_id = 2").fetchone() == (1, 1)
+    assert conn.execute("SELECT likes, dislikes FROM users WHERE user_id = 3").fetchone() == (1, 1)
+    conn.close()
+
+
+def test_failed_batch_leaves_counters_and_bypass_untouched(db_path):
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        try:
+            # Вторую строку нельзя записать - пакет откатывается целиком
+            await db.add_likes([(1, 1), (2, object())])
+        except sqlite3.Error:
+            pass
+        await db.close()
+
+    asyncio.run(main())
+    assert _counters(db_path) == ({}, {}, 0)
+
+
+class _FlakyDatabase:
+    def __init__(self, failures: int = 0):
+        self.failures = failures
+        self.likes = {}
+        self.release = None
+
+    async def get_reaction(self, user_id, post_id):
+        return self.likes.get((user_id, post_id))
+
+    async def add_likes(self, likes):
+        if self.release is not None:
+            await self.release.wait()
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        added = [like for like in likes if like not in self.likes]
+        self.likes.update((like, "like") for like in added)
+        return added
+
+
+def test_buffered_like_is_visible_before_and_during_flush():
+    async def main():
+        db = _FlakyDatabase()
+        db.release = asyncio.Event()
+        reactions = ReactionBuffer(db, flush_interval=10)
+        await reactions.add_like(1, 2)
+        pending = await reactions.has_liked(1, 2)
+        flushing = asyncio.create_task(reactions.flush())
+        await asyncio.sleep(0)
+        during = await reactions.has_liked(1, 2), reactions.metrics()["в буфере"]
+        db.release.set()
+        await flushing
+        return pending, during, await reactions.has_liked(1, 2), await reactions.has_liked(2, 2)
+
+    pending, during, stored, other = asyncio.run(main())
+    assert pending and during == (True, 0) and stored and not other
+
+
+def test_failed_flush_is_retried():
+    async def main():
+        db = _FlakyDatabase(failures=1)
+        reactions = ReactionBuffer(db, flush_interval=0.01)
+        await reactions.add_like(1, 2)
+        # Повтор после ошибки - не раньше чем через секунду
+        await asyncio.sleep(1.1)
+        liked = await reactions.has_liked(1, 2)
+        await reactions.close()
+        return db, reactions, liked
+
+    db, reactions, liked = asyncio.run(main())
+    assert liked and db.likes == {(1, 2): "like"}
+    assert reactions.stats["flushes"] == 1 and reactions.stats["lost"] == 0
+
+
+def test_close_retries_and_logs_lost_likes(caplog):
+    async def main(failures):
+        db = _FlakyDatabase(failures=failures)
+        reactions = ReactionBuffer(db, flush_interval=10)
+        await reactions.add_like(1, 2)
+        await reactions.add_like(3, 4)
+        await reactions.close(retries=2, retry_delay=0.001)
+        return db, reactions
+
+    db, reactions = asyncio.run(main(failures=2))
+    assert len(db.likes) == 2 and reactions.stats["lost"] == 0
+
+    db, reactions = asyncio.run(main(failures=3))
+    assert db.likes == {} and reactions.stats["lost"] == 2
+    assert "(1, 2), (3, 4)" in caplog.text
+
+
+def test_close_during_flush_keeps_the_batch():
+    async def main():
+        db = _FlakyDatabase()
+        db.release = asyncio.Event()
+        reactions = ReactionBuffer(db, flush_interval=0.01)
+        await reactions.add_like(1, 2)
+        # Отложенная запись уже ждёт БД, когда бот закрывается
+        await asyncio.sleep(0.02)
+        close = asyncio.create_task(reactions.close())
+        await asyncio.sleep(0)
+        db.release.set()
+        await close
+        return db, reactions
+
+    db, reactions = asyncio.run(main())
+    assert db.likes == {(1, 2): "like"} and reactions.stats["lost"] == 0
@@ -0,0 +1,158 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import admin
+from callbacks import CallbackData, APPROVE
+from routing import MAIN, PrefixTrie, Routes
+
+
+class _Message:
+    def __init__(self, text):
+        self.text = text
+        self.answers = []
+
+    async def answer(self, text, **_):
+        self.answers.append(text)
+
+
+class _Input(StatesGroup):
+    about = State()
+
+
+def test_trie_finds_longest_prefix():
+    trie = PrefixTrie()
+    trie.insert("Разблокировать @", "unblock")
+    trie.insert("Разблокировать", "short")
+    assert trie.resolve("Разблокировать @user") == ("unblock", "user")
+    assert trie.resolve("Разблокировать кого-то") == ("short", " кого-то")
+    assert trie.resolve("Разблокировать") == ("short", "")
+    assert trie.resolve("Разбл") == (None, None)
+    assert trie.resolve("") == (None, None)
+
+
+def test_duplicate_route_is_rejected():
+    routes = Routes()
+
+    @routes.text("Лента")
+    async def feed(message):
+        pass
+
+    with pytest.raises(ValueError):
+        routes.text("Лента")(feed)
+
+
+def test_back_returns_through_the_screen_stack():
+    routes = Routes()
+    shown = []
+
+    @routes.menu(MAIN)
+    async def main_menu(message):
+        shown.append("main")
+
+    @routes.menu("profile")
+    async def profile_menu(message):
+        shown.append("profile")
+
+    @routes.command("start")
+    async def start(message):
+        shown.append("start")
+
+    @routes.text("Профиль", opens="profile")
+    async def profile(message):
+        shown.append("profile")
+
+    @routes.text("Мои истории", leaf=True)
+    async def my_posts(message):
+        shown.append("my posts")
+
+    @routes.text("Изменить о себе")
+    async def edit_about(message, state):
+        await state.set_state(_Input.about)
+
+    @routes.state(_Input.about)
+    async def save_about(message, state):
+        shown.append(f"about: {message.text}")
+        await state.set_state(None)
+
+    async def main():
+        state = FSMContext(storage=MemoryStorage(), key=StorageKey(bot_id=1, chat_id=1, user_id=1))
+
+        async def send(text):
+            await routes.dispatch_message(_Message(text), state=state, raw_state=await state.get_state())
+
+        for text in ("/start@bot", "Профиль", "Мои истории", "Назад", "Назад", "Назад"):
+            await send(text)
+        # "Назад" из ввода возвращает на текущее меню, кнопка меню прерывает ввод
+        for text in ("Профиль", "Изменить о себе", "Назад", "Изменить о себе", "Мои истории", "Назад",
+                     "Изменить о себе", "о себе"):
+            await send(text)
+        return await state.get_state()
+
+    assert asyncio.run(main()) is None
+    assert shown == ["start", "profile", "my posts", "profile", "main", "main",
+                     "profile", "profile", "my posts", "profile", "about: о себе"]
+
+
+def test_guarded_routes_share_the_table_and_stop_denied_updates():
+    routes = Routes()
+    calls = []
+
+    async def admins(event, data):
+        return bool(data.get("is_admin"))
+
+    admin_routes = routes.guarded(admins)
+
+    @routes.text("Лента")
+    async def feed(message):
+        calls.append("feed")
+
+    @admin_routes.text("Админка")
+    async def admin_menu(message):
+        calls.append("admin")
+
+    @admin_routes.callback(APPROVE)
+    async def approve(callback, cb):
+        calls.append(("approve", cb.post_id))
+
+    async def main():
+        for is_admin in (False, True):
+            for text in ("Лента", "Админка"):
+                await routes.dispatch_message(_Message(text), raw_state=None, state=None, is_admin=is_admin)
+            await routes.dispatch_callback(SimpleNamespace(data="a"), cb=CallbackData(APPROVE, 7), is_admin=is_admin)
+
+    asyncio.run(main())
+    assert calls == ["feed", "feed", "admin", ("approve", 7)]
+
+
+def test_every_admin_route_is_guarded():
+    routes = Routes()
+    admin.setup_handlers(None, routes, None, None, None, None, None)
+    registered = [*routes._commands.values(), *routes._texts.values(), *routes._states.values(),
+                  *routes._callbacks.values()]
+    assert registered and all(route.guard is admin.admins_only for route in registered)
+    route, _ = routes._text_prefixes.resolve("Разблокировать @user")
+    assert route.guard is admin.admins_only
+
+
+def test_non_admin_is_taken_out_of_admin_input():
+    class _State:
+        def __init__(self):
+            self.value = admin.AdminStates.edit_rules.state
+
+        async def set_state(self, value):
+            self.value = value
+
+    routes = Routes()
+    settings = SimpleNamespace(set=None)
+    admin.setup_handlers(None, routes, None, None, settings, None, None)
+    message, state = _Message("Новые правила"), _State()
+
+    asyncio.run(routes.dispatch_message(message, raw_state=state.value, state=state, is_admin=False))
+    assert state.value is None
+    assert message.answers == ["У вас нет доступа к админке!"]
@@ -0,0 +1,57 @@
+import random
+from collections import Counter
+
+from sampler import FenwickTree, StorySampler
+
+
+def test_fenwick_find_matches_prefix_sums():
+    weights = [random.randint(0, 5) for _ in range(37)]
+    tree = FenwickTree.build(weights, 64)
+    assert tree.total() == sum(weights)
+    prefix = 0
+    for index, weight in enumerate(weights):
+        for value in range(prefix, prefix + weight):
+            assert tree.find(value) == index
+        prefix += weight
+
+
+def test_remove_moves_last_post_into_free_slot():
+    sampler = StorySampler()
+    sampler.load([(1, 0), (2, 0), (3, 0)])
+    sampler.remove(1)
+    sampler.add(4)
+    assert len(sampler) == 3
+    assert {sampler.sample() for _ in range(200)} == {2, 3, 4}
+
+
+def test_weighted_prefers_liked_posts():
+    sampler = StorySampler(weighted=True)
+    sampler.load([(1, 0), (2, 99)])
+    counts = Counter(sampler.sample() for _ in range(2000))
+    assert counts[2] > counts[1] * 10
+
+
+def test_no_repeat_within_history():
+    sampler = StorySampler(no_repeat=True, history=50)
+    sampler.load([(post_id, 0) for post_id in range(1, 1001)])
+    picks = [sampler.sample(user_id=1) for _ in range(50)]
+    assert len(set(picks)) == 50
+
+
+def test_history_is_bounded_by_half_of_posts():
+    sampler = StorySampler(no_repeat=True, history=50)
+    sampler.load([(post_id, 0) for post_id in range(1, 11)])
+    picks = [sampler.sample(user_id=1) for _ in range(1000)]
+    # Последние 5 показов (половина постов) не повторяются, дальше посты возвращаются
+    for i in range(len(picks) - 5):
+        assert len(set(picks[i:i + 6])) == 6
+    assert set(picks) == set(range(1, 11))
+    assert len(sampler._seen[1].order) == 5
+
+
+def test_tracked_users_are_evicted():
+    sampler = StorySampler(no_repeat=True, max_tracked_users=2)
+    sampler.load([(post_id, 0) for post_id in range(1, 101)])
+    for user_id in (1, 2, 3):
+        sampler.sample(user_id=user_id)
+    assert list(sampler._seen) == [2, 3]
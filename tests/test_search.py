@@ -0,0 +1,130 @@
+import asyncio
+import sqlite3
+
+import migrations
+from db import Database
+
+
+def _matches(conn, word):
+    return {row[0] for row in conn.execute("SELECT rowid FROM posts_fts WHERE posts_fts MATCH ?", (word,))}
+
+
+def test_backfill_runs_in_chunks_and_respects_concurrent_edits(tmp_path, monkeypatch):
+    backfill = migrations.backfill_search_index
+    conn = sqlite3.connect(str(tmp_path / "old.db"))
+    # База до поискового индекса: посты уже есть
+    monkeypatch.setattr(migrations, "MIGRATIONS", migrations.MIGRATIONS[:10])
+    migrations.apply_migrations(conn)
+    conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'user_1')")
+    conn.executemany("INSERT INTO posts (post_id, user_id, title, content, status) VALUES (?, 1, ?, 'общий', ?)",
+                     [(post_id, f"w{post_id}", "pending" if post_id == 7 else "approved") for post_id in range(1, 11)])
+    conn.commit()
+
+    # Миграция без backfill: только схема и граница
+    monkeypatch.undo()
+    monkeypatch.setattr(migrations, "backfill_search_index", lambda conn: 0)
+    migrations.apply_migrations(conn)
+    assert conn.execute("SELECT done, upto FROM search_backfill").fetchone() == (0, 10)
+    assert _matches(conn, "общий") == set()
+
+    # Пока backfill не прошёл посты, их правят обработчики
+    conn.execute("UPDATE posts SET title = 'changed' WHERE post_id = 5")
+    conn.execute("DELETE FROM posts WHERE post_id = 6")
+    conn.execute("UPDATE posts SET status = 'approved' WHERE post_id = 7")
+    conn.execute("INSERT INTO posts (post_id, user_id, title, content, status) VALUES (11, 1, 'w11', 'общий', 'approved')")
+    conn.commit()
+    assert _matches(conn, "общий") == {11}
+
+    assert backfill(conn, chunk=3) == 9
+    assert conn.execute("SELECT COUNT(*) FROM search_backfill").fetchone() == (0,)
+    assert _matches(conn, "общий") == {1, 2, 3, 4, 5, 7, 8, 9, 10, 11}
+    assert _matches(conn, "w5") == set() and _matches(conn, "changed") == {5}
+    # После backfill триггеры снова обслуживают все посты
+    conn.execute("UPDATE posts SET title = 'again' WHERE post_id = 2")
+    conn.commit()
+    assert _matches(conn, "w2") == set() and _matches(conn, "again") == {2}
+    conn.execute("INSERT INTO posts_fts (posts_fts) VALUES ('integrity-check')")
+    conn.commit()
+    # Повторный запуск миграций ничего не делает
+    assert backfill(conn) == 0
+    conn.close()
+
+
+def test_search_pages_do_not_repeat_or_skip_when_posts_are_published(db_path):
+    def publish(conn, post_ids, text):
+        conn.executemany("INSERT INTO posts (post_id, user_id, title, content, status) VALUES (?, 1, ?, ?, 'approved')",
+                         [(post_id, text, text) for post_id in post_ids])
+        conn.commit()
+
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        # Посты без искомого слова: его IDF положителен и меняется с каждым новым совпадением
+        await db.run_sync(publish, range(100, 300), "другое")
+        seen, cursor, new_id = [], None, 1000
+        while True:
+            page = await db.search_posts("текст", cursor, limit=3, window=15)
+            seen += [row[0] for row in page.posts]
+            if not page.next_cursor:
+                break
+            cursor = page.next_cursor
+            # Новые посты с более высокой оценкой сдвигают и окно, и статистику индекса
+            await db.run_sync(publish, range(new_id, new_id + 5), "текст текст")
+            new_id += 5
+        first = await db.search_posts("текст", limit=3, window=15)
+        await db.close()
+        return seen, first
+
+    seen, first = asyncio.run(main())
+    # Окно - 15 самых новых совпадений на момент первой страницы
+    assert sorted(seen) == list(range(6, 21))
+    # Новая выдача видит опубликованные посты первыми
+    assert all(row[0] >= 1000 for row in first.posts)
+
+
+def test_words_expand_to_forms_present_in_index(db_path):
+    from search import to_match_query, search_stems, is_word_form, MAX_TERMS
+
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        await db.run_sync(lambda conn: (conn.execute(
+            "INSERT INTO posts (post_id, user_id, title, content, status) "
+            "VALUES (30, 1, 'Историк', 'истории Python', 'approved')"), conn.commit()))
+        queries = [await to_match_query(db, text) for text in ("историей", "истории котов", "!!", "pyth")]
+        await db.close()
+        return queries
+
+    # "историк" начинается с основы, но это другое слово
+    assert asyncio.run(main()) == ['("истории" OR "история")', None, "", '"pyth"*']
+    assert is_word_form("сме", "смеется") and not is_word_form("истор", "историк")
+    assert len(search_stems(" ".join(f"слово{n}" for n in range(20)))) == MAX_TERMS
+
+
+def test_word_forms_are_found_and_pages_survive_deletion(db_path):
+    from search import to_match_query
+
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        # Заголовки "История N": запрос в другой форме находит все посты
+        match = await to_match_query(db, "историей")
+        first = await db.search_posts(match, limit=5)
+        expected = await db.search_posts(match, first.next_cursor, limit=5)
+        # Удаление поста с первой страницы не сдвигает следующую
+        await db.run_sync(lambda conn: (conn.execute("DELETE FROM posts WHERE post_id = ?", (first.posts[0][0],)),
+                                        conn.commit()))
+        second = await db.search_posts(match, first.next_cursor, limit=5)
+        pages, cursor = [], None
+        while True:
+            page = await db.search_posts(match, cursor, limit=5)
+            pages += [row[0] for row in page.posts]
+            if not page.next_cursor:
+                break
+            cursor = page.next_cursor
+        await db.close()
+        return first, expected, second, pages
+
+    first, expected, second, pages = asyncio.run(main())
+    assert second.posts == expected.posts
+    assert sorted(pages) == [post_id for post_id in range(1, 21) if post_id != first.posts[0][0]]
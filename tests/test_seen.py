@@ -0,0 +1,156 @@
+import asyncio
+import random
+
+import pytest
+
+from db import Database
+from seen import SeenSet, SeenTracker
+
+
+def test_roundtrip_sparse_and_dense_containers():
+    seen = SeenSet()
+    # Плотный контейнер (битовая карта), разреженный массив и пост с большим id
+    values = set(range(1, 6000)) | set(random.sample(range(70_000, 130_000), 300)) | {2 ** 31 + 5}
+    for value in values:
+        assert seen.add(value)
+    assert not seen.add(1)
+    assert len(seen) == len(values)
+
+    restored = SeenSet.from_bytes(seen.to_bytes())
+    assert len(restored) == len(values)
+    assert all(value in restored for value in values)
+    assert 0 not in restored and 6000 not in restored and 2 ** 31 + 6 not in restored
+    assert restored.to_bytes() == seen.to_bytes()
+
+
+def test_bitmap_is_smaller_than_array_for_dense_container():
+    seen = SeenSet()
+    for value in range(10_000):
+        seen.add(value)
+    assert seen.nbytes == 8192
+
+
+def test_unknown_version_is_rejected():
+    data = bytearray(SeenSet().to_bytes())
+    data[0] = 99
+    with pytest.raises(ValueError):
+        SeenSet.from_bytes(bytes(data))
+
+
+class _FlakyDatabase:
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.saved = {}
+
+    async def get_seen(self, user_id):
+        return self.saved.get(user_id)
+
+    async def save_seen(self, rows):
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database is locked")
+        self.saved.update(rows)
+
+
+def test_failed_flush_is_retried():
+    async def main():
+        db = _FlakyDatabase(failures=1)
+        tracker = SeenTracker(db, flush_interval=0.01)
+        await tracker.mark(1, [10, 20])
+        # Первая запись падает, повторная должна пройти без новых отметок
+        await asyncio.sleep(0.1)
+        return db, tracker
+
+    db, tracker = asyncio.run(main())
+    assert db.failures == 0
+    assert 20 in SeenSet.from_bytes(db.saved[1])
+    assert tracker.stats["flushes"] == 1
+    assert tracker.metrics()["ждут записи"] == 0
+
+
+class _SlowDatabase(_FlakyDatabase):
+    def __init__(self):
+        super().__init__(failures=0)
+        self.loads = 0
+        self.release = asyncio.Event()
+
+    async def get_seen(self, user_id):
+        self.loads += 1
+        await self.release.wait()
+        return await super().get_seen(user_id)
+
+    async def save_seen(self, rows):
+        await self.release.wait()
+        await super().save_seen(rows)
+
+
+def test_cancelled_loader_does_not_cancel_other_waiters():
+    async def main():
+        db = _SlowDatabase()
+        db.saved[1] = SeenSet().to_bytes()
+        tracker = SeenTracker(db)
+        leader = asyncio.create_task(tracker.get(1))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(tracker.get(1))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        db.release.set()
+        return leader, await follower, await tracker.get(1), db
+
+    leader, seen, again, db = asyncio.run(main())
+    assert leader.cancelled()
+    assert seen is again and db.loads == 1
+
+
+def test_close_keeps_changes_of_a_flush_cancelled_midway():
+    async def main():
+        db = _SlowDatabase()
+        db.release.set()
+        tracker = SeenTracker(db, flush_interval=0.01)
+        await tracker.mark(1, [10])
+        db.release.clear()
+        # Отложенная запись уже внутри flush() и ждёт БД, когда бот закрывается
+        await asyncio.sleep(0.05)
+        close = asyncio.create_task(tracker.close())
+        await asyncio.sleep(0)
+        db.release.set()
+        await close
+        return db, tracker
+
+    db, tracker = asyncio.run(main())
+    assert 10 in SeenSet.from_bytes(db.saved[1])
+    assert tracker.metrics()["ждут записи"] == 0
+
+
+def test_unread_page_scan_is_bounded(db_path):
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        tracker = SeenTracker(db, chunk=3, max_scan=6)
+        calls = 0
+        get_feed_keys = db.get_feed_keys
+
+        async def counted(*args):
+            nonlocal calls
+            calls += 1
+            return await get_feed_keys(*args)
+
+        db.get_feed_keys = counted
+        # Лента идёт от старых постов; просмотрены 1..5 и 7..10
+        await tracker.mark(1, [1, 2, 3, 4, 5, 7, 8, 9, 10])
+        first = await tracker.unread_page(1, limit=2)
+        first_calls, calls = calls, 0
+        second = await tracker.unread_page(1, first.next_cursor, limit=2)
+        # Прочитанное подряд начало ленты в следующий раз пропускается
+        calls = 0
+        again = await tracker.unread_page(1, limit=2)
+        await db.close()
+        return first, first_calls, second, again, calls, tracker
+
+    first, first_calls, second, again, calls, tracker = asyncio.run(main())
+    # Предел в 6 постов - два запроса к БД и неполная страница с курсором продолжения
+    assert [post[0] for post in first.posts] == [6] and first.next_cursor
+    assert first_calls == 2 and tracker.stats["scan_limit"] == 1
+    assert [post[0] for post in second.posts] == [11, 12]
+    assert [post[0] for post in again.posts] == [6, 11] and calls == 2
@@ -0,0 +1,152 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetMe, SendMessage
+
+from sender import SendScheduler, TokenBucket, INTERACTIVE, NOTIFICATION, current_chat
+
+
+def _scheduler():
+    return SendScheduler(global_rate=1000, chat_rate=1000, chat_burst=1000)
+
+
+def test_interactive_requests_go_first():
+    async def main():
+        scheduler = _scheduler()
+        order = []
+
+        async def send(chat_id, priority):
+            await scheduler.acquire(chat_id, priority)
+            order.append(priority)
+
+        # Все запросы встают в очередь до первого запуска планировщика
+        await asyncio.gather(*(send(i, NOTIFICATION) for i in range(1, 4)),
+                             *(send(i, INTERACTIVE) for i in range(4, 7)))
+        await scheduler.close()
+        return order
+
+    assert asyncio.run(main()) == [INTERACTIVE] * 3 + [NOTIFICATION] * 3
+
+
+def test_blocked_chat_does_not_hold_back_others():
+    async def main():
+        scheduler = _scheduler()
+        scheduler._chat_bucket(1).block(0.2)
+        blocked = asyncio.create_task(scheduler.acquire(1, INTERACTIVE))
+        await asyncio.wait_for(scheduler.acquire(2, NOTIFICATION), timeout=0.1)
+        assert not blocked.done()
+        await asyncio.wait_for(blocked, timeout=1)
+        await scheduler.close()
+
+    asyncio.run(main())
+
+
+def test_cancelled_request_leaves_queue():
+    async def main():
+        scheduler = _scheduler()
+        scheduler._chat_bucket(1).block(10)
+        waiter = asyncio.create_task(scheduler.acquire(1, NOTIFICATION))
+        await asyncio.sleep(0.01)
+        assert scheduler.queue_depth(NOTIFICATION) == 1
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.queue_depth() == 0
+        await asyncio.wait_for(scheduler.acquire(2, NOTIFICATION), timeout=0.1)
+        await scheduler.close()
+
+    asyncio.run(main())
+
+
+def test_token_bucket_refills_at_rate_up_to_capacity():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated
+    for _ in range(3):
+        assert bucket.wait_time(now) == 0
+        bucket.consume(now)
+    # Пустое ведро: следующий токен через 1 / rate секунд
+    assert bucket.wait_time(now) == pytest.approx(0.5)
+    assert bucket.wait_time(now + 0.5) == pytest.approx(0)
+    assert not bucket.is_idle(now + 1)
+    assert bucket.is_idle(now + 10) and bucket.tokens == 3
+
+
+def test_blocked_bucket_waits_for_retry_after():
+    bucket = TokenBucket(rate=100, capacity=100)
+    bucket.block(5)
+    assert 4.9 < bucket.wait_time(time.monotonic()) <= 5
+    # Более короткий RetryAfter не сокращает уже назначенную паузу
+    bucket.block(1)
+    assert bucket.wait_time(time.monotonic()) > 4.9
+
+
+def test_group_chats_get_their_own_limit():
+    scheduler = SendScheduler(chat_rate=1, chat_burst=20, group_rate=1 / 3, group_burst=3)
+    assert scheduler._chat_bucket(5).capacity == 20
+    assert scheduler._chat_bucket(-100).capacity == 3
+    assert scheduler._chat_bucket(5) is scheduler._chat_bucket(5)
+
+
+def _retry_after(method, seconds=0):
+    return TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=seconds)
+
+
+def test_retry_after_is_retried_and_blocks_the_chat():
+    async def main():
+        scheduler = _scheduler()
+        method = SendMessage(chat_id=7, text="привет")
+        failures = [_retry_after(method), _retry_after(method)]
+        calls = []
+
+        async def make_request(bot, request):
+            calls.append(request)
+            if failures:
+                raise failures.pop()
+            return "ok"
+
+        token = current_chat.set(7)
+        try:
+            result = await scheduler(make_request, None, method)
+        finally:
+            current_chat.reset(token)
+        await scheduler.close()
+        return result, calls, scheduler.stats
+
+    result, calls, stats = asyncio.run(main())
+    assert result == "ok" and len(calls) == 3
+    assert stats["retry_after"] == 2 and stats["sent"] == 1
+
+
+def test_retry_after_gives_up_after_max_retries():
+    async def main():
+        scheduler = SendScheduler(global_rate=1000, chat_rate=1000, chat_burst=1000, max_retries=1)
+        method = SendMessage(chat_id=7, text="привет")
+        calls = []
+
+        async def make_request(bot, request):
+            calls.append(request)
+            raise _retry_after(method)
+
+        try:
+            with pytest.raises(TelegramRetryAfter):
+                await scheduler(make_request, None, method)
+        finally:
+            await scheduler.close()
+        return calls
+
+    assert len(asyncio.run(main())) == 2
+
+
+def test_requests_without_chat_bypass_the_queue():
+    async def main():
+        scheduler = _scheduler()
+
+        async def make_request(bot, request):
+            return "me"
+
+        result = await scheduler(make_request, None, GetMe())
+        return result, scheduler._worker, scheduler.stats
+
+    result, worker, stats = asyncio.run(main())
+    assert result == "me" and worker is None and stats["sent"] == 0
@@ -0,0 +1,42 @@
+import asyncio
+import sqlite3
+
+from db import Database
+from settings import Settings, _parse, _serialize
+
+
+def test_values_are_parsed_by_type():
+    assert _parse('moderation_enabled', '1') is True
+    assert _parse('moderation_enabled', '0') is False
+    assert _parse('post_delay', '15') == 15
+    assert _parse('rules', '1') == '1'
+    assert _parse('post_delay', None) is None
+    assert _serialize(True) == '1' and _serialize(False) == '0' and _serialize(7) == '7'
+
+
+def test_defaults_load_typed_and_edits_write_through(db_path):
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        settings = Settings(db)
+        await settings.load()
+        loaded = settings.moderation_enabled, settings.post_delay, settings.welcome_message
+        changes = []
+        settings.subscribe(lambda key, value: changes.append((key, value)))
+        await settings.set('moderation_enabled', True)
+        await settings.set('post_delay', 12)
+        current = settings.moderation_enabled, settings.post_delay
+        # Новый экземпляр читает то, что записано в БД
+        reloaded = Settings(db)
+        await reloaded.load()
+        await db.close()
+        return loaded, changes, current, (reloaded.moderation_enabled, reloaded.post_delay)
+
+    loaded, changes, current, reloaded = asyncio.run(main())
+    assert loaded == (False, 5, 'Добро пожаловать в StoryGram!')
+    assert changes == [('moderation_enabled', True), ('post_delay', 12)]
+    assert current == reloaded == (True, 12)
+    conn = sqlite3.connect(db_path)
+    assert dict(conn.execute("SELECT key, value FROM settings WHERE key IN ('moderation_enabled', 'post_delay')")) \
+        == {'moderation_enabled': '1', 'post_delay': '12'}
+    conn.close()
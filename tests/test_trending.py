@@ -0,0 +1,38 @@
+import asyncio
+import math
+import time
+from datetime import datetime, timedelta
+
+import trending
+from db import Database
+from trending import ScorePruner, add_scores, event_score, HALF_LIFE
+
+
+def test_score_halves_per_half_life():
+    now = datetime(2025, 1, 1)
+    older = event_score(now - timedelta(seconds=HALF_LIFE), 2.0)
+    assert math.isclose(older, event_score(now, 1.0))
+    assert math.isclose(add_scores(event_score(now, 1.0), event_score(now, 1.0)), event_score(now, 2.0))
+
+
+def test_pruner_close_waits_for_running_chunk(db_path, monkeypatch):
+    finished = []
+
+    def slow_chunk(conn, now, limit):
+        time.sleep(0.2)
+        finished.append(limit)
+        return 0
+
+    monkeypatch.setattr(trending, "prune_scores_chunk", slow_chunk)
+
+    async def main():
+        db = Database(db_path)
+        await db.connect()
+        pruner = ScorePruner(db, chunk_size=10)
+        pruner.start()
+        await asyncio.sleep(0.05)
+        await pruner.close()
+        assert finished == [10]
+        await db.close()
+
+    asyncio.run(main())
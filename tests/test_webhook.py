@@ -0,0 +1,78 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher
+
+from webhook import SECRET_HEADER, WebhookServer, percentile
+
+TOKEN = "123456:" + "A" * 35
+
+
+def _update(update_id: int) -> dict:
+    return {"update_id": update_id,
+            "message": {"message_id": update_id, "date": 0, "chat": {"id": 1, "type": "private"},
+                        "from": {"id": 1, "is_bot": False, "first_name": "u"}, "text": "привет"}}
+
+
+def _run(scenario, **options):
+    async def main():
+        dp = Dispatcher()
+        handled = []
+
+        @dp.message()
+        async def echo(message):
+            handled.append(message.message_id)
+
+        bot = Bot(TOKEN)
+        server = WebhookServer(dp, bot, "secret", **options)
+        client = TestClient(TestServer(server.app))
+        await client.start_server()
+        try:
+            return await scenario(server, client, handled)
+        finally:
+            await client.close()
+            await bot.session.close()
+
+    return asyncio.run(main())
+
+
+def test_wrong_secret_and_bad_body_are_rejected():
+    async def scenario(server, client, handled):
+        statuses = [
+            (await client.post("/webhook", json=_update(1))).status,
+            (await client.post("/webhook", json=_update(1), headers={SECRET_HEADER: "wrong"})).status,
+            (await client.post("/webhook", data="{", headers={SECRET_HEADER: "secret"})).status,
+            (await client.post("/webhook", json={"update_id": "x"}, headers={SECRET_HEADER: "secret"})).status,
+        ]
+        return statuses, server
+
+    statuses, server = _run(scenario)
+    assert statuses == [401, 401, 400, 400]
+    assert server.stats["unauthorized"] == 2 and server.stats["invalid"] == 2
+    assert server.queue_depth() == 0
+
+
+def test_full_queue_answers_503_and_workers_drain_it():
+    async def scenario(server, client, handled):
+        # Обработчики ещё не запущены - очередь на два апдейта заполняется
+        statuses = []
+        for update_id in range(1, 4):
+            response = await client.post("/webhook", json=_update(update_id), headers={SECRET_HEADER: "secret"})
+            statuses.append((response.status, response.headers.get("Retry-After")))
+        server._tasks = [asyncio.create_task(server._worker())]
+        await asyncio.wait_for(server._queue.join(), timeout=5)
+        for task in server._tasks:
+            task.cancel()
+        return statuses, handled, server
+
+    statuses, handled, server = _run(scenario, queue_size=2, enqueue_timeout=0.01)
+    assert statuses == [(200, None), (200, None), (503, "1")]
+    assert handled == [1, 2]
+    assert server.stats["accepted"] == 2 and server.stats["rejected"] == 1 and server.stats["handled"] == 2
+    assert server.queue_depth() == 0 and len(server.latencies) == 2
+
+
+def test_percentile():
+    assert percentile([], 0.5) == 0.0
+    assert percentile(list(range(1, 101)), 0.5) == 51
+    assert percentile(list(range(1, 101)), 0.99) == 100
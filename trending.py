@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import math
+import sqlite3
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Популярность поста - сумма весов событий (публикация, лайки, комментарии), каждый вес
+# затухает вдвое за HALF_LIFE. В post_scores хранится логарифм этой суммы, приведённой к
+# EPOCH: score = ln(sum(w * 2 ** ((t - EPOCH) / HALF_LIFE))). Затухание одинаково для всех
+# постов и порядок не меняет, поэтому сохранённые оценки не нужно пересчитывать со временем:
+# новое событие только прибавляется к своему посту, а индекс по score сразу даёт ленту.
+# Логарифм растёт линейно (~1.4 в сутки при HALF_LIFE = 1 день) и не переполняется.
+EPOCH = datetime(2024, 1, 1)
+HALF_LIFE = 24 * 3600
+PUBLISH_WEIGHT = 1.0
+LIKE_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+# Пост выпадает из популярного, когда затухший вес опускается ниже веса одного лайка четырёхдневной давности
+MIN_WEIGHT = LIKE_WEIGHT / 16
+
+_RATE = math.log(2) / HALF_LIFE
+
+
+def event_score(when: datetime, weight: float) -> float:
+    return math.log(weight) + (when - EPOCH).total_seconds() * _RATE
+
+
+def add_scores(a: float, b: float) -> float:
+    # ln(e^a + e^b) без переполнения
+    high, low = max(a, b), min(a, b)
+    return high + math.log1p(math.exp(low - high))
+
+
+def bump_scores(conn, events, when: datetime = None):
+    # events: [(post_id, вес), ...]. Выполняется в транзакции вызывающего в потоке писателя,
+    # поэтому чтение и запись оценки не пересекаются с другими обновлениями.
+    # Оценку получают только одобренные посты: лайк мог прийти на уже удалённый пост.
+    when = when or datetime.now()
+    totals = defaultdict(float)
+    for post_id, weight in events:
+        totals[post_id] += weight
+    for post_id, weight in totals.items():
+        score = event_score(when, weight)
+        row = conn.execute("SELECT score FROM post_scores WHERE post_id = ?", (post_id,)).fetchone()
+        if row:
+            conn.execute("UPDATE post_scores SET score = ? WHERE post_id = ?", (add_scores(row[0], score), post_id))
+        else:
+            conn.execute("INSERT INTO post_scores (post_id, score) SELECT ?, ? WHERE EXISTS "
+                         "(SELECT 1 FROM posts WHERE post_id = ? AND status = 'approved')", (post_id, score, post_id))
+
+
+def seed_scores(conn, now: datetime = None):
+    # Начальные оценки для существующих постов: публикация и комментарии - по их времени,
+    # лайки (их время не хранится) - по времени публикации. Уже затухшие посты пропускаются.
+    now = now or datetime.now()
+    threshold = event_score(now, MIN_WEIGHT)
+    comments = defaultdict(list)
+    for post_id, created_at in conn.execute(
+            "SELECT c.post_id, c.created_at FROM comments c JOIN posts p ON p.post_id = c.post_id "
+            "WHERE p.status = 'approved' AND c.created_at IS NOT NULL"):
+        comments[post_id].append(datetime.fromisoformat(created_at))
+    rows = []
+    for post_id, created_at, likes in conn.execute(
+            "SELECT post_id, created_at, likes FROM posts WHERE status = 'approved' AND created_at IS NOT NULL"):
+        published = datetime.fromisoformat(created_at)
+        score = event_score(published, PUBLISH_WEIGHT + LIKE_WEIGHT * max(likes or 0, 0))
+        for commented in comments.get(post_id, ()):
+            score = add_scores(score, event_score(commented, COMMENT_WEIGHT))
+        if score >= threshold:
+            rows.append((post_id, score))
+    conn.executemany("INSERT OR REPLACE INTO post_scores (post_id, score) VALUES (?, ?)", rows)
+    return len(rows)
+
+
+def prune_scores_chunk(conn, now: datetime, limit: int) -> int:
+    # Удаляет до limit затухших постов; они лежат в начале индекса по score
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        deleted = conn.execute("DELETE FROM post_scores WHERE post_id IN (SELECT post_id FROM post_scores "
+                               "WHERE score < ? ORDER BY score LIMIT ?)",
+                               (event_score(now, MIN_WEIGHT), limit)).rowcount
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return deleted
+
+
+class ScorePruner:
+    """Периодическая чистка популярного от затухших постов.
+
+    Пересчитывать оценки со временем не нужно (см. выше), поэтому фоновая работа
+    сводится к удалению постов, чей вес затух ниже MIN_WEIGHT: таблица и индекс
+    остаются размером с "живое" популярное. Удаление идёт чанками по chunk_size
+    строк в потоке писателя с паузой между чанками. Пост, получивший новый лайк
+    или комментарий после удаления, возвращается с весом этого события.
+    """
+
+    def __init__(self, db, chunk_size: int = 500, pause: float = 0.05, interval: float = 3600):
+        self.db = db
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.interval = interval
+        self.stats = Counter()
+        self._task = None
+
+    async def run_once(self) -> int:
+        now, pruned = datetime.now(), 0
+        while True:
+            deleted = await self.db.run_sync_to_end(prune_scores_chunk, now, self.chunk_size)
+            self.stats["chunks"] += 1
+            pruned += deleted
+            if deleted < self.chunk_size:
+                break
+            await asyncio.sleep(self.pause)
+        self.stats["runs"] += 1
+        self.stats["pruned"] += pruned
+        logger.info(f"Популярное: удалено затухших постов {pruned}")
+        return pruned
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Ошибка чистки популярного")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def close(self):
+        # Дожидается текущего чанка, чтобы база не закрылась под ним
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+if __name__ == "__main__":
+    # Пересчёт популярного с нуля по постам и комментариям: python trending.py database.db
+    logging.basicConfig(level=logging.INFO)
+    path = sys.argv[1] if len(sys.argv) > 1 else 'database.db'
+    connection = sqlite3.connect(path, timeout=30, isolation_level=None)
+    started = time.perf_counter()
+    connection.execute("BEGIN IMMEDIATE")
+    connection.execute("DELETE FROM post_scores")
+    count = seed_scores(connection)
+    connection.execute("COMMIT")
+    connection.close()
+    logger.info(f"Популярное {path} пересчитано: {count} постов за {time.perf_counter() - started:.1f} c")
@@ -0,0 +1,141 @@
+import asyncio
+import hmac
+import logging
+import signal
+import time
+from collections import Counter, deque
+from contextlib import suppress
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class WebhookServer:
+    """Приём апдейтов через вебхук.
+
+    Обработчик HTTP только проверяет секрет и кладёт апдейт в ограниченную очередь,
+    после чего сразу отвечает 200. Апдейты разбирают workers задач-обработчиков.
+    Если очередь не освобождается за enqueue_timeout секунд, отвечаем 503 -
+    Telegram повторит доставку позже.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret_token: str, path: str = "/webhook",
+                 workers: int = 8, queue_size: int = 1000, enqueue_timeout: float = 1.0,
+                 latency_window: int = 10000, **workflow_data):
+        self.dp = dp
+        self.bot = bot
+        self.secret_token = secret_token
+        self.path = path
+        self.workers = workers
+        self.enqueue_timeout = enqueue_timeout
+        self.workflow_data = {"dispatcher": dp, "bots": (bot,), **dp.workflow_data, **workflow_data}
+        self.stats = Counter()
+        # Время от приёма апдейта до конца обработки, мс (последние latency_window апдейтов)
+        self.latencies = deque(maxlen=latency_window)
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+        self._runner = None
+        self._overloaded = False
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle)
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def metrics(self) -> dict:
+        latencies = list(self.latencies)
+        return {**self.stats, "в очереди": self.queue_depth(),
+                "p50, мс": percentile(latencies, 0.5), "p99, мс": percentile(latencies, 0.99)}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token):
+            self.stats["unauthorized"] += 1
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError:
+            self.stats["invalid"] += 1
+            return web.Response(status=400)
+        try:
+            await asyncio.wait_for(self._queue.put((time.monotonic(), update)), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected"] += 1
+            if not self._overloaded:
+                self._overloaded = True
+                logger.warning(f"Очередь апдейтов заполнена ({self._queue.qsize()}), отвечаем 503")
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        if self._overloaded:
+            self._overloaded = False
+            logger.info(f"Очередь апдейтов разгрузилась, отклонено всего: {self.stats['rejected']}")
+        self.stats["accepted"] += 1
+        return web.Response()
+
+    async def _worker(self):
+        while True:
+            received, update = await self._queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update, **self.workflow_data)
+            except Exception:
+                logger.exception(f"Ошибка обработки апдейта {update.update_id}")
+            finally:
+                self.latencies.append((time.monotonic() - received) * 1000)
+                self.stats["handled"] += 1
+                self._queue.task_done()
+
+    async def start(self, host: str = "0.0.0.0", port: int = 8080, url: str = None):
+        # url - публичный адрес вебхука; без него вебхук в Telegram не регистрируется
+        await self.dp.emit_startup(bot=self.bot, **self.workflow_data)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        if url:
+            await self.bot.set_webhook(url + self.path, secret_token=self.secret_token,
+                                       allowed_updates=self.dp.resolve_used_update_types(),
+                                       max_connections=100)
+        logger.info(f"Вебхук слушает {host}:{port}{self.path}, обработчиков: {self.workers}")
+
+    async def stop(self, drain_timeout: float = 10.0):
+        # Перестаём принимать апдейты, дорабатываем очередь и останавливаем обработчики
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            with suppress(asyncio.CancelledError):
+                await task
+        self._tasks = []
+        await self.dp.emit_shutdown(bot=self.bot, **self.workflow_data)
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, secret_token: str, host: str, port: int, url: str,
+                      workers: int = 8, queue_size: int = 1000, metrics=None):
+    # Работает до SIGINT/SIGTERM, как dp.start_polling
+    server = WebhookServer(dp, bot, secret_token, workers=workers, queue_size=queue_size)
+    if metrics is not None:
+        metrics.register("Вебхук", server.metrics)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with suppress(NotImplementedError):
+            loop.add_signal_handler(sig, stop.set)
+    await server.start(host, port, url)
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()